@@ -10,7 +10,11 @@ import warnings
 def init(ContextInfo):
 	print('initʼ趨,趨ֱpass')
 	warnings.filterwarnings('ignore')
-	pass
+	#ARMA(4,3)ں̨ϣÿ20K߻Ԥƫ3в׼ʱ¹ƲϴβΪֵ
+	#ϽݺͲ浽̣ظزֱӶȡ
+	cache = ContextInfo.get_model_cache(max_bytes=200*1024*1024, max_age=30*86400)
+	ContextInfo.get_model_fit_service(refit_every=20, drift_threshold=3.0, cache=cache, version=sm.__version__, order=(4,3), steps=10)
+	ContextInfo.model_key = ContextInfo.stockcode + '.' + ContextInfo.market
 
 def handlebar(ContextInfo):
 	#handlebar Kߵк
@@ -37,13 +41,6 @@ def handlebar(ContextInfo):
 	
 	try: 
 		closedata = np.array(close.diff(periods=3)["close"]) # ̼۵ADF
-		if ContextInfo.is_last_bar():
-			closedata_0 = closedata[3:-4]
-			closedataModel_ARIMA = sm.tsa.ARMA(closedata_0,(4,3)).fit()
-			predicts_ARIMA = closedataModel_ARIMA.predict(232, 241, dynamic = True)
-			print("Ԥļ۸",predicts_ARIMA[0]+close["close"][-1],predicts_ARIMA[1]+close["close"][-1], \
-			predicts_ARIMA[2]+close["close"][-1],predicts_ARIMA[3]+close["close"][-1],\
-			predicts_ARIMA[4]+close["close"][-1])
 		closedata_5 = closedata[3:-4]
 		#print len(closedata)
 		#adftest = sm.tsa.stattools.adfuller(closedata)
@@ -53,16 +50,18 @@ def handlebar(ContextInfo):
 		#result = sm.tsa.arma_order_select_ic(closedata,max_ar=6,max_ma=4,ic='aic')['aic_min_order']
 		#print result
 
-		closedataModel_ARIMA = sm.tsa.ARMA(closedata_5,(4,3)).fit()
-		#print closedataModel_ARIMA.fittedvalues
-		
-		predicts_ARIMA = closedataModel_ARIMA.predict(232, 241, dynamic = True)
-		#print predicts_ARIMA[4]
+		#ʷKߵȴKߵĽKֻȡɵԤ⣬handlebar
+		result = ContextInfo.get_model_fit_service().submit(ContextInfo.model_key, index, closedata_5, wait=not ContextInfo.is_last_bar())
+		if result is None:
+			raise ValueError('no forecast yet')
+		predicts_ARIMA = result['forecast']
+		if ContextInfo.is_last_bar():
+			print("Ԥļ۸",predicts_ARIMA[0]+close["close"][-1],predicts_ARIMA[1]+close["close"][-1], \
+			predicts_ARIMA[2]+close["close"][-1],predicts_ARIMA[3]+close["close"][-1],\
+			predicts_ARIMA[4]+close["close"][-1])
+		#forecast[0] һK (ԭ predict(232, 241) ĵ 2 ֵ)ԭ predict ĵ 5 ֵӦ forecast[3]
 		ContextInfo.paint("close_5", close["close"][-1],-1,0)
-		ContextInfo.paint("close_predict5", predicts_ARIMA[4]+close["close"][-5],-1,0)
-		
-		
-		predicts_ARIMA = closedataModel_ARIMA.predict(232, 241, dynamic = True)
+		ContextInfo.paint("close_predict5", predicts_ARIMA[3]+close["close"][-5],-1,0)
 	except:
 		ContextInfo.paint("close_5", close["close"][-1],-1,0)
 		ContextInfo.paint("close_predict5", close["close"][-5],-1,0)
@@ -26,9 +26,13 @@ def handlebar(ContextInfo):
 	if origin_data.empty:
 		return
 
+	start_pos = ContextInfo.barpos - 12 * 23
+	risk_free = ContextInfo.get_risk_free_rate_series(start_pos, start_pos + 11 * 23)[::23]
+	risk_free = np.where(risk_free > 0, risk_free, 3.5)
+	log_risk_free = np.log(1 + risk_free / 100 / 12)
 	for i in range(12):
 		try:
-			Zt_list.append(calc_zt(i + 1, origin_data, ContextInfo))
+			Zt_list.append(calc_zt(i + 1, origin_data, log_risk_free))
 		except:
 			return
 
@@ -41,10 +45,8 @@ def handlebar(ContextInfo):
 		print('value error!')
 	ContextInfo.paint('CMRA', ContextInfo.CMRA, -1, 0)
 
-def calc_zt(month, origin_data, ContextInfo):
+def calc_zt(month, origin_data, log_risk_free):
 	sumReturn = 0
-	sumRiskFreeReturn = 0
-	start_pos = ContextInfo.barpos - 12 * 23
 	for i in range(month):
 		t = i + 1
 		start_index = int(origin_data.size / 12 * (t-1))
@@ -52,14 +54,7 @@ def calc_zt(month, origin_data, ContextInfo):
 		Return = origin_data.values[end_index-1][0] / origin_data.values[start_index][0] - 1
 		tmp = math.log(1 + Return)
 		sumReturn += tmp
-		riskFree = ContextInfo.get_risk_free_rate(start_pos + i * 23)
-		if riskFree <= 0:
-			riskFree = 3.5
-		riskFree = riskFree / 100 / 12
-		#print riskFree
-		tmp_rf = math.log(1 + riskFree)
-		sumRiskFreeReturn += tmp_rf
-
+	sumRiskFreeReturn = log_risk_free[:month].sum()
 
 	return sumReturn - sumRiskFreeReturn
 
@@ -10,66 +10,45 @@ import time
 # ֲ䣺ʹüݵĳֲֻȡ
 def get_current_positions(accountid, ContextInfo):
   """
-  ͨ get_trade_detail_data ȡǰֲֵĹƱͿ÷ݶ
+  ؿ÷ݶ 0 ĳֲ֣ɳֲֲά
   ظʽ: {'510300.SH': 1000, '510500.SH': 500}
   """
-  holdinglist = {}
-  
-  #  get_trade_detail_data ǿõȫֺ
   try:
-    # 'stock' ʲ, 'position' 
-    # ע⣺get_trade_detail_data ȷлǿõȫֺ
-    resultlist = get_trade_detail_data(accountid, 'stock', "position")
+    return ContextInfo.get_position_book(accountid, 'stock').holdings('can_use_volume')
   except Exception as e:
-    #  ContextInfo.get_positions ΪãȻᵽã
-    try:
-      positions = ContextInfo.get_positions(accountid)
-      for pos in positions:
-        if pos.m_nCanUseVolume > 0:
-          holdinglist[pos.m_strInstrumentID + "." + pos.m_strExchangeID] = pos.m_nCanUseVolume
-      return holdinglist
-    except Exception as e2:
-      return holdinglist
+    return {}
 
-  for obj in resultlist:
-    # ǿ÷ݶ (m_nCanUseVolume)
-    if hasattr(obj, 'm_nCanUseVolume') and obj.m_nCanUseVolume > 0:
-      holdinglist[obj.m_strInstrumentID + "." + obj.m_strExchangeID] = obj.m_nCanUseVolume
-      
-  return holdinglist
+# µװ (ύ passorder)
+def make_order(is_buy, stock_code, volume_abs, price):
+  return {
+    'code': stock_code,
+    'volume': int(volume_abs),
+    'price': price,
+    'op_type': 23 if is_buy else 24,  # 23:  (BUY)24:  (SELL)
+    'order_type': 1101,               # 1101: Ʊ () 
+    'pr_type': 14,                    # 14: ޼ (FIX)
+    'quick_trade': 1,
+  }
 
-# µװ (ʹ passorder)
-def execute_trade(is_buy, stock_code, volume_abs, price, ContextInfo, account_id):
-  """ װ passorder á """
-  opType = 23 if is_buy else 24  # 23:  (BUY)24:  (SELL)
-  orderType = 1101        # 1101: Ʊ () 
-  prType = 14          # 14: ޼ (FIX)
-  strategyName = "ETF_Min_Trend"
-  quickTrade = 1 
-  userOrderId = str(int(time.time() * 1000)) 
-  
-  volume_final = int(volume_abs)
-  
-  if volume_final < 100 and is_buy: 
-    print(f"PASSORDER : {stock_code}  100  ({volume_final})")
-    return
+def execute_basket(orders, ContextInfo, account_id):
+  """ µuserOrderId Ψһ趨ύίлرɵ ticket """
+  valid = []
+  for order in orders:
+    if order['volume'] < 100 and order['op_type'] == 23:
+      print(f"PASSORDER : {order['code']}  100  ({order['volume']})")
+    else:
+      valid.append(order)
+  trader = ContextInfo.get_basket_trader(account_id, "ETF_Min_Trend")
+  tickets = trader.submit(valid, ContextInfo)
+  for ticket in tickets:
+    order = ticket.order
+    action = "" if order['op_type'] == 23 else ""
+    print(f"PASSORDER {action} {order['code']}: {order['volume']}  @ {order['price']:.2f}")
+  return tickets
 
-  passorder(
-    opType, 
-    orderType, 
-    account_id, 
-    stock_code, 
-    prType, 
-    price, 
-    volume_final, 
-    strategyName, 
-    quickTrade, 
-    userOrderId, 
-    ContextInfo
-  )
-  
-  action = "" if is_buy else ""
-  print(f"PASSORDER {action} {stock_code}: {volume_final}  @ {price:.2f}")
+def execute_trade(is_buy, stock_code, volume_abs, price, ContextInfo, account_id):
+  """ µµͨ """
+  return execute_basket([make_order(is_buy, stock_code, volume_abs, price)], ContextInfo, account_id)
 
 # --------------------------------------------------------
 # 壺init  handlebar
@@ -78,6 +57,9 @@ def execute_trade(is_buy, stock_code, volume_abs, price, ContextInfo, account_id
 def init(ContextInfo):
   # ---------------- 1. Բ ----------------
   ContextInfo.account_id = '40098981' 
+  ContextInfo.get_position_book(ContextInfo.account_id, 'stock', reconcile_interval=0 if ContextInfo.do_back_test else 60)
+  if not ContextInfo.do_back_test:
+    ContextInfo.set_account(ContextInfo.account_id)
   ContextInfo.hold_num = 5
   
   #  3 ETF Ʊأ
@@ -231,15 +213,8 @@ def handlebar(ContextInfo):
       return
 
     print(current_time_full)
-    op_data = ContextInfo.get_market_data_ex(
-      fields=["close"], 
-      stock_code=etfs_to_check, 
-      period="1m", 
-      end_time=current_time_full,
-      count=1, 
-      dividend_type='front'
-    )
-    # print(op_data)
+    op_prices = ContextInfo.get_last_prices(etfs_to_check, as_dict=True, dividend_type='front')
+    # print(op_prices)
     # exit()
     
     buy_candidates = []
@@ -247,17 +222,16 @@ def handlebar(ContextInfo):
     for etf in etfs_to_check:
       daily_info = ContextInfo.DAILY_DATA.get(etf)
       t_open = ContextInfo.T_OPEN_PRICE.get(etf)
-      op_close = op_data.get(etf)
+      op_price = op_prices.get(etf, np.nan)
       print(daily_info )
       print(t_open)
-      print(op_close)
+      print(op_price)
 
       
-      if daily_info is None or t_open is None or op_close is None or op_close.empty:
+      if daily_info is None or t_open is None or np.isnan(op_price):
         print(f"Warning: ETF {etf}  14:46 δܻȡҪݣ")
         continue
 
-      op_price = op_close['close'].iloc[-1]
       
       # 1.  T-2  T-1  (Close > Open)
       cond_a = (daily_info['t_minus_2_close'] > daily_info['t_minus_2_open']) and \
@@ -286,6 +260,7 @@ def handlebar(ContextInfo):
     
     target_per_stock = total_asset / ContextInfo.hold_num
     current_hold_count = len(curr_holdings_dict)
+    buy_orders = []
     
     for item in target_buys:
       etf = item['code']
@@ -295,9 +270,11 @@ def handlebar(ContextInfo):
         amount = int(target_per_stock / buy_price / 100) * 100
         
         if amount >= 100:
-          execute_trade(True, etf, amount, buy_price, ContextInfo, ContextInfo.account_id)
+          buy_orders.append(make_order(True, etf, amount, buy_price))
           current_hold_count += 1
       
+    if buy_orders:
+      execute_basket(buy_orders, ContextInfo, ContextInfo.account_id)
     print(f"ɡĿ: {[item['code'] for item in target_buys]}")
 
   # --------------------------------------------------------
@@ -317,25 +294,17 @@ def handlebar(ContextInfo):
     # print(f"[{current_time_str}] мسֲ...")
     
     # ȡµ 1m 飨ڵǰ۸
-    latest_data = ContextInfo.get_market_data_ex(
-      fields=["close"], 
-      stock_code=list(curr_holdings_dict.keys()), 
-      period="1m", 
-      end_time=current_time_full,
-      count=1, 
-      dividend_type='front'
-    )
+    latest_prices = ContextInfo.get_last_prices(list(curr_holdings_dict.keys()), as_dict=True, dividend_type='front')
     
     for etf, volume in curr_holdings_dict.items():
       daily_info = ContextInfo.DAILY_DATA.get(etf)
       t_open = ContextInfo.T_OPEN_PRICE.get(etf)
-      latest_bar = latest_data.get(etf)
-    #   print(latest_bar)
+      current_price = latest_prices.get(etf, np.nan)
+    #   print(current_price)
 
-      if daily_info is None or t_open is None or latest_bar is None or latest_bar.empty:
+      if daily_info is None or t_open is None or np.isnan(current_price):
         continue
 
-      current_price = latest_bar['close'].iloc[-1]
       
       # --- ֹ/ֹӯ ---
       should_sell = False
@@ -361,4 +330,21 @@ def handlebar(ContextInfo):
         execute_trade(False, etf, volume, current_price, ContextInfo, ContextInfo.account_id)
 
 
+# --------------------------------------------------------
+# ƻص³ֲֲ
+# --------------------------------------------------------
+
+def deal_callback(ContextInfo, dealInfo):
+  ContextInfo.dispatch_trade_callback('deal', dealInfo)
+
+def order_callback(ContextInfo, orderInfo):
+  ContextInfo.dispatch_trade_callback('order', orderInfo)
+
+def orderError_callback(ContextInfo, orderArgs, errMsg):
+  ContextInfo.dispatch_trade_callback('order_error', orderArgs, errMsg)
+
+def position_callback(ContextInfo, positonInfo):
+  ContextInfo.dispatch_trade_callback('position', positonInfo)
 
+def account_callback(ContextInfo, accountInfo):
+  ContextInfo.dispatch_trade_callback('account', accountInfo)
@@ -2,97 +2,108 @@
 import pandas as pd
 import numpy as np
 import time
+import _PyIndicator
+from _PyQuote import TRIGGER_BELOW
 
 # --------------------------------------------------------
-# ָ㸨
+# ָ꣺̺Ԥ㹲á
 # --------------------------------------------------------
 
-# ATR (Average True Range)
-def calculate_atr(df, period=14):
-    """ ָ (period)  ATR ָꡣҪ high, low, close С """
-    if df is None or len(df) < period:
-        return np.nan
-    
-    # 1.  True Range (TR)
-    df['prev_close'] = df['close'].shift(1)
-    df['high_minus_low'] = df['high'] - df['low']
-    df['high_minus_prev_close'] = abs(df['high'] - df['prev_close'])
-    df['low_minus_prev_close'] = abs(df['low'] - df['prev_close'])
-    
-    # TR ֵеֵ
-    tr = df[['high_minus_low', 'high_minus_prev_close', 'low_minus_prev_close']].max(axis=1)
+def daily_indicators(bars, r10_lookback, ma20_lookback, ma120_lookback, atr_period):
+    """ bars Ϊֻߵ ( x ) 󣬷ÿһյָꡣ """
+    close, high, low, volume = bars['close'], bars['high'], bars['low'], bars['volume']
+    ma120 = _PyIndicator.ma(close, ma120_lookback)[:, -1]
+    return {
+        'bars': np.isfinite(close).sum(axis=1),
+        'r10_return': _PyIndicator.returns(close, r10_lookback)[:, -1],    # 10ջر (R10)
+        'ma5': _PyIndicator.ma(close, 5)[:, -1],                          # 5վ (MA5)
+        'ma20': _PyIndicator.ma(close, ma20_lookback)[:, -1],             # 20վ (MA20)
+        'avg_volume_5d': _PyIndicator.ma(volume, 5)[:, -1],               # 5վɽ
+        'atr_14d': _PyIndicator.atr(high, low, close, atr_period)[:, -1],  # ATR (14ƽʵ)
+        't_minus_1_close': close[:, -1],
+        'bull': np.where(np.isfinite(ma120), close[:, -1] > ma120, np.nan),  # ̼ MA120 Ϸ
+    }
+
+def precompute_after_close(ContextInfo):
+    """ ָ̺겢̡ """
+    table, _ = ContextInfo.get_precompute_job('ETFֶӼ').run(ContextInfo)
+    if table is not None:
+        print(f"̺Ԥɣ{table.as_of} {len(table.codes)} 롣")
+
+def arm_stop_triggers(ContextInfo):
+    """ ʵ̣ΪֲֵǼ MA5 - k*ATR ֹ𴥷ʱ飬K߼鱣Ϊס """
+    engine = ContextInfo.get_trigger_engine()
+    engine.clear(tag='stop')
+    holdings = [etf for etf in get_current_positions(ContextInfo.account_id, ContextInfo) if etf in ContextInfo.DAILY_DATA]
+    if not holdings:
+        return
     
-    # 2.  Average True Range (ATR)
-    # ʹ SMA Ϊƽ̨Ըõƽ
-    atr = tr.iloc[-period:].mean()
+    def on_stop(trigger, price):
+        now = time.strftime('%H:%M')
+        if now < '09:32' or now > '14:59':
+            return
+        volume = get_current_positions(ContextInfo.account_id, ContextInfo).get(trigger.code, 0)
+        if volume <= 0:
+            engine.remove(trigger)
+            return
+        if ContextInfo.get_order_manager().open_orders(trigger.code, 'sell'):
+            return
+        engine.remove(trigger)
+        print(f" {trigger.code}ʼ۸ {price:.2f} ڶֹ̬λ {trigger.level:.2f} (MA5 - {ContextInfo.ATR_MULTIPLIER}xATR)")
+        execute_trade(False, trigger.code, volume, price, ContextInfo, ContextInfo.account_id)
     
-    return atr
+    levels = [ContextInfo.DAILY_DATA[etf]['ma5'] - ContextInfo.ATR_MULTIPLIER * ContextInfo.DAILY_DATA[etf]['atr_14d'] for etf in holdings]
+    triggers = engine.add_many(holdings, TRIGGER_BELOW, levels, on_stop, tag='stop', once=False)
+    ContextInfo.watch_quotes(holdings)
+    print(f"ѵǼ {len(triggers)} ֲֹ𴥷")
 
 # --------------------------------------------------------
 # ֲֺͽס
 # --------------------------------------------------------
 
-# ֲ䣺ʹüݵĳֲֻȡ
+# ֲɳֲֲάʵɽƻص£زÿζȡʱ
 def get_current_positions(accountid, ContextInfo):
     """
-    ͨ get_trade_detail_data ȡǰֲֵĹƱͿ÷ݶ
+    ؿ÷ݶ 0 ĳֲ֡
     ظʽ: {'510300.SH': 1000, '510500.SH': 500}
     """
-    holdinglist = {}
-    
     try:
-        # 'stock' ʲ, 'position' 
-        resultlist = get_trade_detail_data(accountid, 'stock', "position")
+        return ContextInfo.get_position_book(accountid, 'stock').holdings('can_use_volume')
     except Exception as e:
-        #  ContextInfo.get_positions Ϊ
-        try:
-            positions = ContextInfo.get_positions(accountid)
-            for pos in positions:
-                if pos.m_nCanUseVolume > 0:
-                    holdinglist[pos.m_strInstrumentID + "." + pos.m_strExchangeID] = pos.m_nCanUseVolume
-            return holdinglist
-        except Exception as e2:
-            return holdinglist
-
-    for obj in resultlist:
-        # ǿ÷ݶ (m_nCanUseVolume)
-        if hasattr(obj, 'm_nCanUseVolume') and obj.m_nCanUseVolume > 0:
-            holdinglist[obj.m_strInstrumentID + "." + obj.m_strExchangeID] = obj.m_nCanUseVolume
-            
-    return holdinglist
+        return {}
 
-# µװ (ʹ passorder)
-def execute_trade(is_buy, stock_code, volume_abs, price, ContextInfo, account_id):
-    """ װ passorder á """
-    opType = 23 if is_buy else 24  # 23:  (BUY)24:  (SELL)
-    orderType = 1101             # 1101: Ʊ () 
-    prType = 14                  # 14: ޼ (FIX)
-    strategyName = "ETF_Momentum_Rank" 
-    quickTrade = 1 
-    userOrderId = str(int(time.time() * 1000)) 
-    
-    volume_final = int(volume_abs)
-    
-    if volume_final < 100 and is_buy: 
-        print(f"PASSORDER : {stock_code}  100  ({volume_final})")
-        return
+# µװ (ύ passorder)
+def make_order(is_buy, stock_code, volume_abs, price):
+    return {
+        'code': stock_code,
+        'volume': int(volume_abs),
+        'price': price,
+        'op_type': 23 if is_buy else 24,  # 23:  (BUY)24:  (SELL)
+        'order_type': 1101,               # 1101: Ʊ () 
+        'pr_type': 14,                    # 14: ޼ (FIX)
+        'quick_trade': 1,
+    }
 
-    passorder(
-        opType, 
-        orderType, 
-        account_id, 
-        stock_code, 
-        prType, 
-        price, 
-        volume_final, 
-        strategyName, 
-        quickTrade, 
-        userOrderId, 
-        ContextInfo
-    )
-    
-    action = "" if is_buy else ""
-    print(f"PASSORDER {action} {stock_code}: {volume_final}  @ {price:.2f}")
+def execute_basket(orders, ContextInfo, account_id):
+    """ µuserOrderId Ψһ趨ύίлرɵ ticket """
+    valid = []
+    for order in orders:
+        if order['volume'] < 100 and order['op_type'] == 23:
+            print(f"PASSORDER : {order['code']}  100  ({order['volume']})")
+        else:
+            valid.append(order)
+
+    trader = ContextInfo.get_basket_trader(account_id, "ETF_Momentum_Rank")
+    tickets = trader.submit(valid, ContextInfo)
+    for ticket in tickets:
+        order = ticket.order
+        action = "" if order['op_type'] == 23 else ""
+        print(f"PASSORDER {action} {order['code']}: {order['volume']}  @ {order['price']:.2f}")
+    return tickets
+
+def execute_trade(is_buy, stock_code, volume_abs, price, ContextInfo, account_id):
+    """ µµͨ """
+    return execute_basket([make_order(is_buy, stock_code, volume_abs, price)], ContextInfo, account_id)
 
 # --------------------------------------------------------
 # 壺init  handlebar
@@ -101,6 +112,9 @@ def execute_trade(is_buy, stock_code, volume_abs, price, ContextInfo, account_id
 def init(ContextInfo):
     # ---------------- 1. Բ ----------------
     ContextInfo.account_id = '40098981' 
+    ContextInfo.get_position_book(ContextInfo.account_id, 'stock', reconcile_interval=0 if ContextInfo.do_back_test else 60)
+    if not ContextInfo.do_back_test:
+        ContextInfo.set_account(ContextInfo.account_id)
     ContextInfo.hold_num = 5
     ContextInfo.R10_LOOKBACK = 10     # 10ջرΪ
     ContextInfo.MA20_LOOKBACK = 20    # 20վ߼
@@ -124,6 +138,18 @@ def init(ContextInfo):
     ContextInfo.DAILY_DATA = {} 
     ContextInfo.IS_MARKET_BULL = False # ȫж
     
+    # ָԤ㣺ʵÿ 15:30 㲢̣ 09:31 ֱӶȡ
+    # ȫʹòȨ۸ǰȨԤ T ճϢʱڵռ۸ֹλ ma5 - k*atr ƫ
+    r10, ma20, ma120, atr_period = (ContextInfo.R10_LOOKBACK, ContextInfo.MA20_LOOKBACK,
+        ContextInfo.MA120_LOOKBACK, ContextInfo.ATR_PERIOD)
+    job = ContextInfo.get_precompute_job('ETFֶӼ',
+        sorted(set(ContextInfo.etf_pool + [ContextInfo.BENCHMARK_CODE])),
+        fields=("close", "high", "low", "volume"), count=ContextInfo.look_back_days,
+        dividend_type='none')
+    job.register('daily', lambda bars: daily_indicators(bars, r10, ma20, ma120, atr_period))
+    if not ContextInfo.do_back_test:
+        job.schedule(ContextInfo, precompute_after_close, '153000')
+    
     # ---------------- 2. Ԥ ----------------
     print("ʷ(1d)ͷ(1m)...")
     start_date = "20250101" 
@@ -153,30 +179,33 @@ def handlebar(ContextInfo):
     if current_time_str == '09:31': 
         print(f"[{current_time_log}] ȡݣ㶯;...")
         
-        # 1. ȡ ETF ͻ׼
-        all_codes = list(set(ContextInfo.etf_pool + [ContextInfo.BENCHMARK_CODE]))
-        daily_data = ContextInfo.get_market_data_ex(
-            fields=["open", "close", "high", "low", "volume"],
-            stock_code=all_codes, 
-            period="1d", 
-            end_time=current_day,
-            count=ContextInfo.look_back_days, 
-            dividend_type='front'
-        )
+        # 1. ָ꣺ȶȡһյ̺Ԥûʱȡ (޳ T  bar) 
+        job = ContextInfo.get_precompute_job('ETFֶӼ')
+        table = None if ContextInfo.do_back_test else job.load_previous(ContextInfo, current_day)
+        if table is not None:
+            print(f"ʹ̺Ԥָ ( {table.as_of})")
+            values = table.values
+        else:
+            daily_data = ContextInfo.get_market_data_ex(
+                fields=["open", "close", "high", "low", "volume"],
+                stock_code=job.codes, 
+                period="1d", 
+                end_time=current_day,
+                count=ContextInfo.look_back_days, 
+                dividend_type='none'
+            )
+            values = job.compute(job.bars(daily_data, before=current_day))
+        row_of = {code: k for k, code in enumerate(job.codes)}
         
         ContextInfo.DAILY_DATA = {}
         ContextInfo.T_OPEN_PRICE = {} 
         valid_etf_for_daily = []
         
         # --- 1.1 ȫƹ˼ (MA120) ---
-        df_bench = daily_data.get(ContextInfo.BENCHMARK_CODE)
+        bench_bull = values['bull'][row_of[ContextInfo.BENCHMARK_CODE]]
         ContextInfo.IS_MARKET_BULL = False
-        if df_bench is not None and len(df_bench) > ContextInfo.MA120_LOOKBACK:
-            bench_close = pd.to_numeric(df_bench['close'], errors='coerce')
-            ma120 = bench_close.iloc[-ContextInfo.MA120_LOOKBACK - 1:-1].mean()
-            t_minus_1_close = bench_close.iloc[-2]
-            
-            if t_minus_1_close > ma120:
+        if not np.isnan(bench_bull):
+            if bench_bull > 0:
                 ContextInfo.IS_MARKET_BULL = True
                 print(f"ȫƼ飺׼ {ContextInfo.BENCHMARK_CODE} ڶͷ (C > MA120)")
             else:
@@ -185,44 +214,23 @@ def handlebar(ContextInfo):
             print("ȫƼ飺׼ݲ㡣")
 
 
-        # --- 1.2 ָ ---
+        # --- 1.2 ָ ---
         for etf in ContextInfo.etf_pool:
-            df_daily = daily_data.get(etf)
+            k = row_of[etf]
             
-            # ȷ㹻ݼָ
-            if df_daily is None or len(df_daily) < ContextInfo.look_back_days - 1: 
+            # ȷ㹻ݼָ ( T  bar)
+            if values['bars'][k] < ContextInfo.look_back_days - 2: 
                 continue
 
             valid_etf_for_daily.append(etf)
 
-            df_daily['close'] = pd.to_numeric(df_daily['close'], errors='coerce')
-            df_daily['volume'] = pd.to_numeric(df_daily['volume'], errors='coerce')
-            df_daily['high'] = pd.to_numeric(df_daily['high'], errors='coerce')
-            df_daily['low'] = pd.to_numeric(df_daily['low'], errors='coerce')
-
-            # --- ָ ---
-            # 1. 10ջر (R10)
-            r10_return = (df_daily['close'].iloc[-2] / df_daily['close'].iloc[-ContextInfo.R10_LOOKBACK - 2]) - 1
-            
-            # 2. 5վ (MA5)
-            ma5 = df_daily['close'].iloc[-6:-1].mean()
-            
-            # 3. 20վ (MA20)
-            ma20 = df_daily['close'].iloc[-ContextInfo.MA20_LOOKBACK - 1:-1].mean()
-            
-            # 4. 5վɽ
-            avg_volume_5d = df_daily['volume'].iloc[-6:-1].mean()
-            
-            # 5. ATR (14ƽʵ)
-            atr_14d = calculate_atr(df_daily.iloc[:-1], period=ContextInfo.ATR_PERIOD)
-
             ContextInfo.DAILY_DATA[etf] = {
-                'ma5': ma5,
-                'ma20': ma20,
-                'r10_return': r10_return, # ֶƸ
-                'avg_volume_5d': avg_volume_5d,
-                'atr_14d': atr_14d,
-                't_minus_1_close': df_daily['close'].iloc[-2] 
+                'ma5': values['ma5'][k],
+                'ma20': values['ma20'][k],
+                'r10_return': values['r10_return'][k], # ֶƸ
+                'avg_volume_5d': values['avg_volume_5d'][k],
+                'atr_14d': values['atr_14d'][k],
+                't_minus_1_close': values['t_minus_1_close'][k] 
             }
         
         # 3. ȡ T տ̼ۣ9:31 Open
@@ -232,7 +240,7 @@ def handlebar(ContextInfo):
             end_time=current_time_full,
             period="1m", 
             count=1,
-            dividend_type='front'
+            dividend_type='none'
         )
 
         for etf in valid_etf_for_daily:
@@ -242,6 +250,9 @@ def handlebar(ContextInfo):
             else:
                 ContextInfo.T_OPEN_PRICE[etf] = None # ʽΪNone
         
+        if not ContextInfo.do_back_test:
+            arm_stop_triggers(ContextInfo)
+        
     # --------------------------------------------------------
     # ׶ζ飨14:46
     # --------------------------------------------------------
@@ -258,15 +269,8 @@ def handlebar(ContextInfo):
             print("ȱʷݣ޷ִ顣")
             return
 
-        # A. ȡǰ 14:46 ļ۸ (close)  T ۼƳɽ (volume)
-        op_data = ContextInfo.get_market_data_ex(
-            fields=["close", "volume"], 
-            stock_code=etfs_to_check, 
-            period="1m", 
-            end_time=current_time_full,
-            count=1, 
-            dividend_type='front'
-        )
+        # A. ȡǰ 14:46 ļ۸ (ʵ̶ȡ黺)  T ۼƳɽ (volume)
+        op_prices = ContextInfo.get_last_prices(etfs_to_check, as_dict=True, dividend_type='none')
         
         t_day_volume_data = ContextInfo.get_market_data_ex(
             fields=["volume"], 
@@ -274,20 +278,19 @@ def handlebar(ContextInfo):
             period="1d", 
             end_time=current_day,
             count=1, 
-            dividend_type='front'
+            dividend_type='none'
         )
 
         qualified_candidates = []
         
         for etf in etfs_to_check:
             daily_info = ContextInfo.DAILY_DATA.get(etf)
-            op_close_bar = op_data.get(etf)
+            op_price = op_prices.get(etf, np.nan)
             t_day_vol_bar = t_day_volume_data.get(etf)
             
-            if daily_info is None or op_close_bar is None or op_close_bar.empty or t_day_vol_bar is None or t_day_vol_bar.empty:
+            if daily_info is None or np.isnan(op_price) or t_day_vol_bar is None or t_day_vol_bar.empty:
                 continue
 
-            op_price = op_close_bar['close'].iloc[-1]
             t_day_volume = t_day_vol_bar['volume'].iloc[-1]
             
             r10_return = daily_info['r10_return'] # ʹ R10
@@ -333,6 +336,7 @@ def handlebar(ContextInfo):
         
         target_per_stock = total_asset / ContextInfo.hold_num
         current_hold_count = len(curr_holdings_dict)
+        buy_orders = []
         
         for item in target_buys:
             etf = item['code']
@@ -342,9 +346,11 @@ def handlebar(ContextInfo):
                 amount = int(target_per_stock / buy_price / 100) * 100
                 
                 if amount >= 100:
-                    execute_trade(True, etf, amount, buy_price, ContextInfo, ContextInfo.account_id)
+                    buy_orders.append(make_order(True, etf, amount, buy_price))
                     current_hold_count += 1
             
+        if buy_orders:
+            execute_basket(buy_orders, ContextInfo, ContextInfo.account_id)
         print(f"ɡĿ루ǿ: {[item['code'] for item in target_buys]}")
 
     # --------------------------------------------------------
@@ -361,24 +367,16 @@ def handlebar(ContextInfo):
             return
 
         # ȡµ 1m 飨ڵǰ۸
-        latest_data = ContextInfo.get_market_data_ex(
-            fields=["close"], 
-            stock_code=list(curr_holdings_dict.keys()), 
-            period="1m", 
-            end_time=current_time_full,
-            count=1, 
-            dividend_type='front'
-        )
+        latest_prices = ContextInfo.get_last_prices(list(curr_holdings_dict.keys()), as_dict=True, dividend_type='none')
         
         for etf, volume in curr_holdings_dict.items():
             daily_info = ContextInfo.DAILY_DATA.get(etf)
-            latest_bar = latest_data.get(etf)
+            current_price = latest_prices.get(etf, np.nan)
 
             # ȷݺݴڣԼATRЧֵ
-            if daily_info is None or latest_bar is None or latest_bar.empty or np.isnan(daily_info.get('atr_14d', np.nan)):
+            if daily_info is None or np.isnan(current_price) or np.isnan(daily_info.get('atr_14d', np.nan)):
                 continue
 
-            current_price = latest_bar['close'].iloc[-1]
             ma5 = daily_info['ma5']
             atr_14d = daily_info['atr_14d']
             
@@ -395,4 +393,21 @@ def handlebar(ContextInfo):
                 
             if should_sell:
                 print(f" {etf}{sell_reason}۸ {current_price:.2f}")
-                execute_trade(False, etf, volume, current_price, ContextInfo, ContextInfo.account_id)
\ No newline at end of file
+                execute_trade(False, etf, volume, current_price, ContextInfo, ContextInfo.account_id)
+
+
+# ƻص³ֲֲ
+def deal_callback(ContextInfo, dealInfo):
+    ContextInfo.dispatch_trade_callback('deal', dealInfo)
+
+def order_callback(ContextInfo, orderInfo):
+    ContextInfo.dispatch_trade_callback('order', orderInfo)
+
+def orderError_callback(ContextInfo, orderArgs, errMsg):
+    ContextInfo.dispatch_trade_callback('order_error', orderArgs, errMsg)
+
+def position_callback(ContextInfo, positonInfo):
+    ContextInfo.dispatch_trade_callback('position', positonInfo)
+
+def account_callback(ContextInfo, accountInfo):
+    ContextInfo.dispatch_trade_callback('account', accountInfo)
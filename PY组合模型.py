@@ -15,11 +15,12 @@ def init(ContextInfo):
 	ContextInfo.money_distribution = ContextInfo.money_distribution_original
 	ContextInfo.buypoint = {}
 	ContextInfo.accountID='testS'
+	ContextInfo.get_position_book(ContextInfo.accountID,'STOCK',reconcile_interval=0 if ContextInfo.do_back_test else 60)
 
 def handlebar(ContextInfo):
 	d = ContextInfo.barpos
 	timetag = ContextInfo.get_bar_timetag(d)
-	ContextInfo.holdings = get_holdings(ContextInfo.accountID,"STOCK")
+	ContextInfo.holdings = get_holdings(ContextInfo,ContextInfo.accountID,"STOCK")
 	if ContextInfo.day == 0:
 		ContextInfo.benchmark_start = ContextInfo.get_market_data(['close'],period='1d')
 	benchmark = ContextInfo.get_market_data(['close'],period='1d')
@@ -79,10 +80,24 @@ def signal(ContextInfo):
 	#print sell
 	return buy,sell             #ѡ
 
-def get_holdings(accountid,datatype):
-	holdinglist={}
-	resultlist=get_trade_detail_data(accountid,datatype,"POSITION")
-	for obj in resultlist:
-		holdinglist[obj.m_strInstrumentID+"."+obj.m_strExchangeID]=obj.m_nVolume/100
-	return holdinglist
+def get_holdings(ContextInfo,accountid,datatype):
+	#ֲɳֲֲάλΪ
+	book=ContextInfo.get_position_book(accountid,datatype)
+	return {k:v/100 for k,v in book.holdings('volume').items()}
 
+
+#ƻصʵֲֲ̳ɻصάʱڳֲ
+def deal_callback(ContextInfo, dealInfo):
+	ContextInfo.dispatch_trade_callback('deal', dealInfo)
+
+def order_callback(ContextInfo, orderInfo):
+	ContextInfo.dispatch_trade_callback('order', orderInfo)
+
+def orderError_callback(ContextInfo, orderArgs, errMsg):
+	ContextInfo.dispatch_trade_callback('order_error', orderArgs, errMsg)
+
+def position_callback(ContextInfo, positonInfo):
+	ContextInfo.dispatch_trade_callback('position', positonInfo)
+
+def account_callback(ContextInfo, accountInfo):
+	ContextInfo.dispatch_trade_callback('account', accountInfo)
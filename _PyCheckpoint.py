@@ -0,0 +1,158 @@
+#coding:utf-8
+
+# Strategy state snapshots in a single .npz file.
+# Registered entries are stored as plain arrays where possible: numpy arrays as they are, {key: scalar} dicts as
+# key/value columns, {key: {field: scalar}} dicts as one column per field, objects through get_state/set_state.
+# Anything else is pickled into a byte array. Entries marked daily are only restored on the same trading day.
+
+import os
+import time
+import pickle
+import hashlib
+import numpy as np
+
+SCALAR_TYPES = (bool, int, float, str, np.generic)
+
+
+def _is_scalar(value):
+    return isinstance(value, SCALAR_TYPES)
+
+
+def _column(values):
+    column = np.array(values)
+    if column.dtype == object:
+        raise TypeError('mixed column')
+    return column
+
+
+def encode(value):
+    # -> (kind, {suffix: array})
+    try:
+        if isinstance(value, np.ndarray) and value.dtype != object:
+            return 'array', {'': value}
+        if hasattr(value, 'get_state'):
+            return 'object', {'.' + k: np.asarray(v) for k, v in value.get_state().items()}
+        if _is_scalar(value):
+            return 'scalar', {'': np.array(value)}
+        if isinstance(value, dict) and all(_is_scalar(v) for v in value.values()):
+            return 'mapping', {'.keys': _column(list(value.keys())), '.values': _column(list(value.values()))}
+        if isinstance(value, dict) and all(isinstance(v, dict) for v in value.values()):
+            keys = list(value.keys())
+            fields = list(value[keys[0]].keys()) if keys else []
+            if all(list(v.keys()) == fields for v in value.values()):
+                arrays = {'.keys': _column(keys), '.fields': _column(fields)}
+                for i, f in enumerate(fields):
+                    arrays['.f%d' % i] = _column([value[k][f] for k in keys])
+                return 'table', arrays
+        if isinstance(value, (list, tuple)) and all(_is_scalar(v) for v in value):
+            return 'list', {'': _column(list(value))}
+    except TypeError:
+        pass
+    return 'pickle', {'': np.frombuffer(pickle.dumps(value, protocol=2), dtype=np.uint8)}
+
+
+def decode(kind, arrays):
+    if kind == 'array':
+        return arrays['']
+    if kind == 'object':
+        return {k[1:]: v for k, v in arrays.items()}
+    if kind == 'scalar':
+        return arrays[''].item()
+    if kind == 'list':
+        return arrays[''].tolist()
+    if kind == 'mapping':
+        return dict(zip(arrays['.keys'].tolist(), arrays['.values'].tolist()))
+    if kind == 'table':
+        fields = arrays['.fields'].tolist()
+        columns = [arrays['.f%d' % i].tolist() for i in range(len(fields))]
+        return {k: dict(zip(fields, row)) for k, row in zip(arrays['.keys'].tolist(), zip(*columns))}
+    return pickle.loads(arrays[''].tobytes())
+
+
+class Checkpoint(object):
+    def __init__(self, path, interval=60):
+        # interval: seconds between change checks in maybe_save, 0 checks on every call
+        self.path = path
+        self.interval = interval
+        self.entries = {}
+        self.dirty = False
+        self.digest = None
+        self.checked_at = 0
+        self.saved_at = None
+
+    def register(self, name, get, set, daily=False):
+        # daily entries belong to one trading day and are dropped when restoring on another
+        self.entries[name] = (get, set, daily)
+
+    def register_object(self, name, obj, daily=False):
+        self.entries[name] = (lambda: obj, obj.set_state, daily)
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def _encode(self, trading_day):
+        arrays = {'_meta.trading_day': np.array(str(trading_day or '')), '_meta.saved_at': np.array(time.time())}
+        names, kinds = [], []
+        for name, (get, _, _) in self.entries.items():
+            kind, parts = encode(get())
+            names.append(name)
+            kinds.append(kind)
+            for suffix, v in parts.items():
+                arrays[name + suffix] = v
+        arrays['_meta.names'] = np.array(names)
+        arrays['_meta.kinds'] = np.array(kinds)
+        return arrays
+
+    @staticmethod
+    def _digest(arrays):
+        h = hashlib.sha1()
+        for k in sorted(arrays):
+            if k != '_meta.saved_at':
+                h.update(k.encode('utf-8'))
+                h.update(np.ascontiguousarray(arrays[k]).tobytes())
+        return h.hexdigest()
+
+    def save(self, trading_day, force=True):
+        arrays = self._encode(trading_day)
+        digest = self._digest(arrays)
+        self.dirty = False
+        if not force and digest == self.digest:
+            return False
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, self.path)
+        self.digest = digest
+        self.saved_at = time.time()
+        return True
+
+    def maybe_save(self, trading_day):
+        # writes only when marked dirty or, every `interval` seconds, when the encoded state changed
+        now = time.time()
+        if not self.dirty and now - self.checked_at < self.interval:
+            return False
+        self.checked_at = now
+        return self.save(trading_day, force=False)
+
+    def restore(self, trading_day):
+        # returns the names that were restored; daily entries need the same trading day
+        if not os.path.exists(self.path):
+            return []
+        restored = []
+        with np.load(self.path) as data:
+            same_day = str(data['_meta.trading_day']) == str(trading_day)
+            for name, kind in zip(data['_meta.names'].tolist(), data['_meta.kinds'].tolist()):
+                entry = self.entries.get(name)
+                if entry is None or (entry[2] and not same_day):
+                    continue
+                prefix = name if kind in ('array', 'scalar', 'list', 'pickle') else name + '.'
+                if prefix == name:
+                    parts = {'': data[name]}
+                else:
+                    parts = {k[len(name):]: data[k] for k in data.files if k.startswith(prefix)}
+                entry[1](decode(kind, parts))
+                restored.append(name)
+        return restored
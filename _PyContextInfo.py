@@ -19,6 +19,8 @@ class __PyContext(object):
         self.context = contextinfo
         self.z8sglma_last_version = None
         self.z8sglma_last_barpos = -1
+        # session-level caches and services, shared between bar versions instead of deep copied
+        self.z8sglma_shared = {}
         self.subMap = {}
 
     def set_account(self, account_id, account_type = ''):
@@ -87,6 +89,26 @@ class __PyContext(object):
     def get_risk_free_rate(self, index):
         return self.context.get_risk_free_rate(index)
 
+    def get_risk_free_rate_series(self, start, end):
+        import numpy as np
+        start = int(start)
+        end = int(end)
+        if end < start:
+            return np.empty(0)
+        cache = self.z8sglma_shared.get('risk_free_rate')
+        if cache is None or len(cache) <= end:
+            grown = np.full(max(end + 1, self.barpos + 1), np.nan)
+            if cache is not None:
+                grown[:len(cache)] = cache
+            cache = grown
+            self.z8sglma_shared['risk_free_rate'] = cache
+        lo = max(start, 0)
+        for index in np.flatnonzero(np.isnan(cache[lo:end + 1])) + lo:
+            cache[index] = self.context.get_risk_free_rate(int(index))
+        result = np.full(end - start + 1, np.nan)
+        result[lo - start:] = cache[lo:end + 1]
+        return result
+
     def get_contract_multiplier(self, stockcode):
         return self.context.get_contract_multiplier(stockcode)
 
@@ -874,7 +896,7 @@ class __PyContext(object):
         for k, v in list(self.__dict__.items()):
             #print "k: %s v: %s" %(k, v)
             # contextInfo variable is from c++, not copy
-            if k == "context":
+            if k == "context" or k == "z8sglma_shared":
                 setattr(new_obj, k, v)
             elif k == "z8sglma_last_version":
                 continue
@@ -1019,6 +1041,341 @@ class __PyContext(object):
     def cancel_schedule_run(self, key: Union[int, str]):
         return self.context.cancel_scheduled_run(key)
 
+    def get_model_fit_service(self, **kwargs):
+        service = self.z8sglma_shared.get('model_fit_service')
+        if service is None:
+            from _PyModel import ModelFitService
+            service = ModelFitService(**kwargs)
+            self.z8sglma_shared['model_fit_service'] = service
+        return service
+
+    def get_model_cache(self, root=None, max_bytes=None, max_age=None):
+        cache = self.z8sglma_shared.get('model_cache')
+        if cache is None:
+            from _PyModel import ModelCache
+            if root is None:
+                root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_cache')
+            cache = ModelCache(root, max_bytes, max_age)
+            self.z8sglma_shared['model_cache'] = cache
+        return cache
+
+    def get_inference_executor(self, name, model=None, **kwargs):
+        executors = self.z8sglma_shared.setdefault('inference_executor', {})
+        executor = executors.get(name)
+        if executor is None and model is not None:
+            from _PyModel import InferenceExecutor
+            executor = InferenceExecutor(model, **kwargs)
+            executors[name] = executor
+            if not self.do_back_test and 'inference_pump' not in self.z8sglma_shared:
+                # live: requests queued by handlebar are sent to the pool, and finished batches delivered to their
+                # callbacks, by a timer that fires once handlebar returns; backtests read them with result()
+                self.z8sglma_shared['inference_pump'] = self.schedule_run(self.pump_inference_executors
+                    , dt.datetime.now(), 0, dt.timedelta(milliseconds=200), 'inference_pump')
+        return executor
+
+    def pump_inference_executors(self, ContextInfo = None):
+        # flush queued requests and deliver finished batches; returns the number of requests still in flight
+        executors = self.z8sglma_shared.get('inference_executor', {}).values()
+        for executor in executors:
+            executor.poll()
+        return sum(len(executor.pending) for executor in executors)
+
+    def get_position_book(self, account_id, account_type = 'STOCK', **kwargs):
+        books = self.z8sglma_shared.setdefault('position_book', {})
+        key = (account_id, account_type)
+        book = books.get(key)
+        if book is None:
+            from _PyTrade import PositionBook
+            kwargs.setdefault('bar_key', lambda: self.barpos)
+            book = PositionBook(account_id, account_type, get_trade_detail_data, **kwargs)
+            books[key] = book
+            self.z8sglma_shared.setdefault('trade_listeners', []).append(book)
+        return book
+
+    def get_basket_trader(self, account_id, strategy_name = '', **kwargs):
+        traders = self.z8sglma_shared.setdefault('basket_trader', {})
+        key = (account_id, strategy_name)
+        trader = traders.get(key)
+        if trader is None:
+            from _PyTrade import BasketTrader
+            kwargs.setdefault('manager', self.get_order_manager())
+            if self.do_back_test:
+                # backtests send every order of the bar at once and fire no order callbacks, so orders are closed
+                # as soon as they are sent instead of staying open in the order manager
+                kwargs['rate'] = 0
+                kwargs['confirm_on_send'] = True
+            elif 'basket_pump' not in self.z8sglma_shared:
+                # live: orders over the rate are sent by a one-second timer instead of sleeping in handlebar
+                self.z8sglma_shared['basket_pump'] = self.schedule_run(self.pump_basket_traders, dt.datetime.now(), 0
+                    , dt.timedelta(seconds=1), 'basket_pump')
+            trader = BasketTrader(account_id, strategy_name, passorder, **kwargs)
+            traders[key] = trader
+            self.z8sglma_shared.setdefault('trade_listeners', []).append(trader)
+        return trader
+
+    def pump_basket_traders(self, ContextInfo = None):
+        # send queued basket orders the rate allows now; returns the number still queued
+        return sum(trader.pump(ContextInfo or self) for trader in self.z8sglma_shared.get('basket_trader', {}).values())
+
+    def get_order_manager(self, **kwargs):
+        manager = self.z8sglma_shared.get('order_manager')
+        if manager is None:
+            from _PyTrade import OrderManager
+            manager = OrderManager(cancel, **kwargs)
+            self.z8sglma_shared['order_manager'] = manager
+            self.z8sglma_shared.setdefault('trade_listeners', []).append(manager)
+        return manager
+
+    def get_indicator_engine(self, period, codes = None, **kwargs):
+        engines = self.z8sglma_shared.setdefault('indicator_engine', {})
+        engine = engines.get(period)
+        if engine is None:
+            from _PyIndicator import IndicatorEngine
+            engine = IndicatorEngine(codes or [], **kwargs)
+            engines[period] = engine
+        elif codes:
+            engine.add_codes(codes)
+        return engine
+
+    def get_logger(self, name, root = None, mode = None, **kwargs):
+        # mode defaults to backtest/prod so the two never share files
+        if mode is None:
+            mode = 'backtest' if self.do_back_test else 'prod'
+        loggers = self.z8sglma_shared.setdefault('logger', {})
+        logger = loggers.get((name, mode))
+        if logger is None:
+            from _PyLog import AsyncLogger
+            if root is None:
+                root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+            logger = AsyncLogger(root, name, mode, **kwargs)
+            loggers[(name, mode)] = logger
+        return logger
+
+    def close_loggers(self):
+        for logger in self.z8sglma_shared.pop('logger', {}).values():
+            logger.close()
+
+    def get_checkpoint(self, name, path = None, **kwargs):
+        checkpoints = self.z8sglma_shared.setdefault('checkpoint', {})
+        checkpoint = checkpoints.get(name)
+        if checkpoint is None:
+            from _PyCheckpoint import Checkpoint
+            if path is None:
+                path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'checkpoint', name + '.npz')
+            checkpoint = Checkpoint(path, **kwargs)
+            checkpoints[name] = checkpoint
+        return checkpoint
+
+    def get_precompute_job(self, name, codes = None, root = None, **kwargs):
+        jobs = self.z8sglma_shared.setdefault('precompute_job', {})
+        job = jobs.get(name)
+        if job is None:
+            from _PyPrecompute import PrecomputeJob
+            if root is None:
+                root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'precompute')
+            job = PrecomputeJob(name, codes or [], root, **kwargs)
+            jobs[name] = job
+        return job
+
+    def get_grid_book(self, account_id, **kwargs):
+        books = self.z8sglma_shared.setdefault('grid_book', {})
+        book = books.get(account_id)
+        if book is None:
+            from _PyGrid import GridBook
+            kwargs.setdefault('manager', self.get_order_manager())
+            kwargs.setdefault('account_id', account_id)
+            book = GridBook(**kwargs)
+            books[account_id] = book
+        return book
+
+    def get_roll_manager(self):
+        manager = self.z8sglma_shared.get('roll_manager')
+        if manager is None:
+            from _PyFutures import RollManager, FUTURE_SECTORS
+            def list_contracts(market):
+                listed = self.get_stock_list_in_sector(FUTURE_SECTORS.get(market, market))
+                return list(listed or []) + list(self.get_his_contract_list(market) or [])
+            manager = RollManager(self.get_main_contract, list_contracts)
+            self.z8sglma_shared['roll_manager'] = manager
+        return manager
+
+    def load_roll_schedule(self, product, start_time, end_time = '', fields = ('open', 'high', 'low', 'close', 'openInterest'), **kwargs):
+        # daily bars of every contract of product ('rb.SF') -> roll schedule (kept by the roll manager) and the bars,
+        # which _PyFutures.continuous stitches into a back-adjusted series
+        from _PyFutures import roll_schedule
+        manager = self.get_roll_manager()
+        contracts = manager.contracts(product)
+        data = self.get_market_data_ex(list(fields), contracts, period='1d', start_time=start_time, end_time=end_time
+            , dividend_type='none')
+        dates = sorted(set(str(d)[:8] for df in data.values() for d in df.index))
+        schedule = manager.set_schedule(roll_schedule(product, data, contracts, dates, **kwargs))
+        return schedule, data
+
+    def get_contract_specs(self, codes = None):
+        # multiplier / margin ratio / price tick table, rebuilt on the first call of each trading day
+        trading_day = time.strftime('%Y%m%d')
+        specs = self.z8sglma_shared.get('contract_specs')
+        if specs is None or specs.trading_day != trading_day:
+            from _PyFutures import ContractSpecs
+            specs = ContractSpecs(trading_day, self.get_instrumentdetail, self.get_contract_multiplier)
+            self.z8sglma_shared['contract_specs'] = specs
+        if codes:
+            specs.ensure(codes)
+        return specs
+
+    def get_option_chain(self, undl_code, opt_codes = None):
+        # strike / type / expiry index of undl_code's options, rebuilt on the first call of each trading day
+        # opt_codes: contracts to index instead of the currently listed ones (e.g. get_option_list in backtests)
+        trading_day = time.strftime('%Y%m%d')
+        chains = self.z8sglma_shared.setdefault('option_chain', {})
+        chain = chains.get(undl_code)
+        if chain is None or chain.trading_day != trading_day or (opt_codes is not None and set(opt_codes) != set(chain.codes)):
+            from _PyOption import OptionChain
+            if opt_codes is None:
+                opt_codes = self.get_option_undl_data(undl_code)
+            chain = OptionChain.from_details(undl_code, opt_codes, self.context.get_instrumentdetail, trading_day)
+            chains[undl_code] = chain
+        return chain
+
+    def get_iv_surface(self, undl_code, **kwargs):
+        # live: fed by whole-quote pushes of the underlying and its chain, seeded once from get_full_tick
+        # backtest: call surface.refresh(spot, prices, codes, today) with the bar's prices
+        # a surface built on an earlier day's chain moves to the current chain on the first call of the day
+        surfaces = self.z8sglma_shared.setdefault('iv_surface', {})
+        surface = surfaces.get(undl_code)
+        chain = self.get_option_chain(undl_code)
+        if surface is None:
+            from _PyOption import IVSurface
+            surface = IVSurface(chain, **kwargs)
+            surfaces[undl_code] = surface
+            new_codes = chain.codes
+        elif surface.chain is not chain:
+            new_codes = [c for c in chain.codes if c not in surface.chain.index]
+            surface.set_chain(chain)
+        else:
+            return surface
+        if not self.do_back_test:
+            codes = [undl_code] + new_codes
+            self.add_quote_listener(surface, codes)
+            surface.on_quote(self.get_full_tick(codes))
+        return surface
+
+    def get_portfolio_greeks(self, account_id, undl_code, **kwargs):
+        # option positions of account_id on undl_code, seeded from get_trade_detail_data and kept by position callbacks;
+        # live runs re-price the book on every whole-quote push of the underlying, backtests (which send no callbacks)
+        # reload the positions on the first call of each bar and are priced by greeks.update(spot, bar date)
+        books = self.z8sglma_shared.setdefault('portfolio_greeks', {})
+        loaded = self.z8sglma_shared.setdefault('portfolio_greeks_bar', {})
+        key = (account_id, undl_code)
+        greeks = books.get(key)
+        chain = self.get_option_chain(undl_code)
+        if greeks is not None and greeks.chain is not chain:
+            # first call of a new trading day: follow the rebuilt chain (and its surface) and reload the positions,
+            # which may include contracts listed since the book was built
+            if greeks.surface is not None:
+                self.get_iv_surface(undl_code)
+            greeks.set_chain(chain)
+            greeks.load(get_trade_detail_data(account_id, 'STOCK_OPTION', 'POSITION'))
+            loaded[key] = self.barpos
+        if greeks is None:
+            from _PyOption import PortfolioGreeks
+            if not self.do_back_test:
+                kwargs.setdefault('surface', self.get_iv_surface(undl_code))
+            kwargs.setdefault('account_id', account_id)
+            greeks = PortfolioGreeks(chain, **kwargs)
+            greeks.load(get_trade_detail_data(account_id, 'STOCK_OPTION', 'POSITION'))
+            loaded[key] = self.barpos
+            books[key] = greeks
+            self.z8sglma_shared.setdefault('trade_listeners', []).append(greeks)
+            if not self.do_back_test:
+                self.add_quote_listener(greeks, [undl_code])
+        elif self.do_back_test and loaded.get(key) != self.barpos:
+            greeks.load(get_trade_detail_data(account_id, 'STOCK_OPTION', 'POSITION'))
+            loaded[key] = self.barpos
+        return greeks
+
+    def get_trigger_engine(self, name = 'default'):
+        engines = self.z8sglma_shared.setdefault('trigger_engine', {})
+        engine = engines.get(name)
+        if engine is None:
+            from _PyQuote import TriggerEngine
+            engine = TriggerEngine()
+            engines[name] = engine
+            self.add_quote_listener(engine)
+        return engine
+
+    def add_quote_listener(self, listener, codes = None):
+        listeners = self.z8sglma_shared.setdefault('quote_listeners', [])
+        if listener not in listeners:
+            listeners.append(listener)
+        if codes:
+            self.watch_quotes(codes)
+
+    def watch_quotes(self, codes):
+        # a single whole-quote subscription for the union of watched codes, renewed only when codes are added
+        watched = self.z8sglma_shared.setdefault('quote_codes', set())
+        sub_id = self.z8sglma_shared.get('quote_sub_id')
+        if set(codes) <= watched:
+            return sub_id
+        watched.update(codes)
+        if sub_id:
+            self.unsubscribe_quote(sub_id)
+        sub_id = self.subscribe_whole_quote(sorted(watched), self.dispatch_quote)
+        self.z8sglma_shared['quote_sub_id'] = sub_id
+        return sub_id
+
+    def get_full_tick_snapshot(self, stock_code = None, name = 'default', **kwargs):
+        # get_full_tick as numpy columns; snapshots with the same name share (and overwrite) their buffers
+        snapshots = self.z8sglma_shared.setdefault('tick_snapshot', {})
+        snapshot = snapshots.get(name)
+        if snapshot is None:
+            from _PyQuote import TickSnapshot
+            snapshot = TickSnapshot(**kwargs)
+            snapshots[name] = snapshot
+        return snapshot.refresh(self.get_full_tick, stock_code)
+
+    def get_price_cache(self):
+        cache = self.z8sglma_shared.get('price_cache')
+        if cache is None:
+            from _PyQuote import PriceCache
+            cache = PriceCache()
+            self.z8sglma_shared['price_cache'] = cache
+            self.add_quote_listener(cache)
+        return cache
+
+    def get_last_prices(self, stock_code, as_dict = False, dividend_type = 'none'):
+        # live: latest pushed prices, codes are watched on first use and seeded once from get_full_tick
+        # backtest: close of the current 1m bar, adjusted by dividend_type
+        import numpy as np
+        stock_code = list(stock_code)
+        if self.do_back_test:
+            end_time = timetag_to_datetime(self.get_bar_timetag(self.barpos), '%Y%m%d%H%M%S')
+            data = self.get_market_data_ex(['close'], stock_code, period='1m', end_time=end_time, count=1
+                , dividend_type=dividend_type)
+            prices = np.array([data[c]['close'].iloc[-1] if c in data and not data[c].empty else np.nan
+                for c in stock_code], dtype=float)
+        else:
+            cache = self.get_price_cache()
+            self.watch_quotes(stock_code)
+            missing = cache.missing(stock_code)
+            if missing:
+                cache.on_quote(self.get_full_tick(missing))
+            prices = cache.prices(stock_code)
+        if as_dict:
+            return dict(zip(stock_code, prices.tolist()))
+        return prices
+
+    def dispatch_quote(self, datas):
+        for listener in self.z8sglma_shared.get('quote_listeners', []):
+            listener.on_quote(datas)
+
+    def dispatch_trade_callback(self, kind, *data):
+        # forward deal/order/position/account/order_error callbacks to every registered listener
+        for listener in self.z8sglma_shared.get('trade_listeners', []):
+            handler = getattr(listener, 'on_' + kind, None)
+            if handler is not None:
+                handler(*data)
+
 
 
 def timetag_to_datetime(timetag, format):
@@ -1032,7 +1389,7 @@ def resume_context_info(context_info):
     last_barpos = context_info.z8sglma_last_barpos
     if context_info.barpos == last_barpos:
         for k, v in list(context_info.z8sglma_last_version.__dict__.items()):
-            if k == "context":
+            if k == "context" or k == "z8sglma_shared":
                 continue
             elif k == "z8sglma_last_version":
                 continue
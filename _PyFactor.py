@@ -0,0 +1,573 @@
+#coding:utf-8
+
+# Barra-style risk factors computed for a whole stock pool at once.
+# Inputs are (stocks x days) float arrays aligned on one trading calendar, NaN for missing bars.
+
+import numpy as np
+
+DEFAULT_RISK_FREE = 3.5
+FACTOR_NAMES = ['CMRA', 'DASTD', 'BETA', 'HSIGMA', 'STOM', 'STOQ', 'STOA']
+WLS_SUMS = ('w', 'y', 'yy', 'x', 'xx', 'xy')
+
+
+def half_life_decay(half_life):
+    if not half_life:
+        return 1.0
+    return pow(0.5, 1 / float(half_life))
+
+
+def decay_weights(window, half_life):
+    # oldest first, the newest point has weight 1
+    return pow(half_life_decay(half_life), np.arange(window - 1, -1, -1, dtype=float))
+
+
+def window_decay_sum(values, window, decay):
+    # sum(decay ** k * values[:, t - k] for k in range(window)) for every t, NaN before a full window
+    values = np.asarray(values, dtype=float)
+    n, t = values.shape
+    result = np.full((n, t), np.nan)
+    if t < window:
+        return result
+    tail = pow(decay, window)
+    acc = np.zeros(n)
+    for i in range(t):
+        acc = acc * decay + values[:, i]
+        if i >= window:
+            acc -= tail * values[:, i - window]
+        if i >= window - 1:
+            result[:, i] = acc
+    return result
+
+
+def rolling_sum(values, window):
+    values = np.asarray(values, dtype=float)
+    n, t = values.shape
+    result = np.full((n, t), np.nan)
+    if t < window:
+        return result
+    csum = np.cumsum(np.hstack([np.zeros((n, 1)), values]), axis=1)
+    result[:, window - 1:] = csum[:, window:] - csum[:, :-window]
+    return result
+
+
+def shift(values, periods):
+    result = np.full(values.shape, np.nan)
+    if periods < values.shape[-1]:
+        result[..., periods:] = values[..., :values.shape[-1] - periods]
+    return result
+
+
+def simple_returns(close):
+    close = np.asarray(close, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return close / shift(close, 1) - 1
+
+
+def risk_free_daily(risk_free, days):
+    if risk_free is None:
+        rate = np.full(days, DEFAULT_RISK_FREE)
+    else:
+        rate = np.array(risk_free, dtype=float).reshape(-1)
+        rate = np.where(rate > 0, rate, DEFAULT_RISK_FREE)
+    return rate / 100
+
+
+def _safe_log(values):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.log(values)
+    result[~np.isfinite(result)] = np.nan
+    return result
+
+
+class FactorInputs(object):
+    def __init__(self, close, volume=None, float_shares=None, index_close=None, risk_free=None):
+        self.close = np.asarray(close, dtype=float)
+        n, t = self.close.shape
+        self.volume = None if volume is None else np.asarray(volume, dtype=float)
+        if float_shares is None:
+            self.float_shares = None
+        else:
+            shares = np.asarray(float_shares, dtype=float)
+            self.float_shares = np.broadcast_to(shares.reshape(n, -1), (n, t))
+        self.index_close = None if index_close is None else np.asarray(index_close, dtype=float).reshape(-1)
+        self.annual_rf = risk_free_daily(risk_free, t)
+        self._cache = {}
+
+    def get(self, name, func):
+        if name not in self._cache:
+            self._cache[name] = func()
+        return self._cache[name]
+
+    @property
+    def returns(self):
+        return self.get('returns', lambda: simple_returns(self.close))
+
+    @property
+    def excess_returns(self):
+        return self.get('excess_returns', lambda: self.returns - self.annual_rf / 365)
+
+    @property
+    def index_excess_returns(self):
+        return self.get('index_excess_returns'
+            , lambda: simple_returns(self.index_close.reshape(1, -1))[0] - self.annual_rf / 365)
+
+    @property
+    def turnover(self):
+        def calc():
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result = self.volume / self.float_shares
+            result[~np.isfinite(result)] = 0.0
+            return result
+        return self.get('turnover', calc)
+
+    def weighted_sums(self, window, decay):
+        # decayed window sums shared by DASTD and HSIGMA, suspended days get zero weight
+        def calc():
+            y = self.excess_returns
+            mask = np.isfinite(y)
+            if self.index_close is not None:
+                x = np.broadcast_to(self.index_excess_returns, y.shape)
+                mask &= np.isfinite(x)
+                x = np.where(mask, x, 0.0)
+            else:
+                x = None
+            y = np.where(mask, y, 0.0)
+            sums = {
+                'w': window_decay_sum(mask.astype(float), window, decay),
+                'y': window_decay_sum(y, window, decay),
+                'yy': window_decay_sum(y * y, window, decay),
+            }
+            if x is not None:
+                sums['x'] = window_decay_sum(x, window, decay)
+                sums['xx'] = window_decay_sum(x * x, window, decay)
+                sums['xy'] = window_decay_sum(x * y, window, decay)
+            return sums
+        return self.get(('weighted_sums', window, decay), calc)
+
+
+def dastd_from_sums(s):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = s['y'] / s['w']
+        var = s['yy'] / s['w'] - mean * mean
+    return np.sqrt(np.maximum(var, 0.0))
+
+
+def wls_from_sums(s):
+    # closed-form weighted least squares y = alpha + beta * x from the weighted sums in WLS_SUMS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta = (s['w'] * s['xy'] - s['x'] * s['y']) / (s['w'] * s['xx'] - s['x'] * s['x'])
+        alpha = (s['y'] - beta * s['x']) / s['w']
+        rss = s['yy'] - alpha * s['y'] - beta * s['xy']
+        sigma = np.sqrt(np.maximum(rss, 0.0) / s['w'])
+    return alpha, beta, sigma
+
+
+def hsigma_from_sums(s):
+    return wls_from_sums(s)[2]
+
+
+def wls_regress(y, x, weights=None):
+    # regress every row of y (stocks x points) on the shared series x (points,) in one matrix pass
+    y = np.asarray(y, dtype=float)
+    x = np.asarray(x, dtype=float).reshape(-1)
+    w = np.ones(len(x)) if weights is None else np.asarray(weights, dtype=float)
+    mask = np.isfinite(y) & np.isfinite(x)
+    m = mask.astype(float)
+    x0 = np.where(np.isfinite(x), x, 0.0)
+    y0 = np.where(mask, y, 0.0)
+    wx = w * x0
+    s = {
+        'w': m.dot(w),
+        'x': m.dot(wx),
+        'xx': m.dot(wx * x0),
+        'y': y0.dot(w),
+        'yy': (y0 * y0).dot(w),
+        'xy': y0.dot(wx),
+    }
+    return wls_from_sums(s)
+
+
+def calc_dastd(inputs, window=252, half_life=252):
+    return dastd_from_sums(inputs.weighted_sums(window, half_life_decay(half_life)))
+
+
+def calc_hsigma(inputs, window=252, half_life=252):
+    return hsigma_from_sums(inputs.weighted_sums(window, half_life_decay(half_life)))
+
+
+def calc_beta(inputs, window=252, half_life=252):
+    return wls_from_sums(inputs.weighted_sums(window, half_life_decay(half_life)))[1]
+
+
+def calc_cmra(inputs, months=12, month_days=21):
+    log_close = _safe_log(inputs.close)
+    log_rf = np.log(1 + inputs.annual_rf / 12)
+    z_max = np.full(log_close.shape, -np.inf)
+    z_min = np.full(log_close.shape, np.inf)
+    rf_sum = np.zeros(log_close.shape[1])
+    for m in range(1, months + 1):
+        rf_sum = rf_sum + shift(log_rf, (m - 1) * month_days)
+        z = log_close - shift(log_close, m * month_days) - rf_sum
+        z_max = np.fmax(z_max, z)
+        z_min = np.fmin(z_min, z)
+    full = np.isfinite(shift(log_close, months * month_days)) & np.isfinite(log_close)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.log((1 + z_max) / (1 + z_min))
+    result[~full] = np.nan
+    return result
+
+
+def calc_share_turnover(inputs, months, month_days=21):
+    return _safe_log(rolling_sum(inputs.turnover, months * month_days) / months)
+
+
+def calc_stom(inputs, month_days=21):
+    return calc_share_turnover(inputs, 1, month_days)
+
+
+def calc_stoq(inputs, month_days=21):
+    return calc_share_turnover(inputs, 3, month_days)
+
+
+def calc_stoa(inputs, month_days=21):
+    return calc_share_turnover(inputs, 12, month_days)
+
+
+def compute_risk_factors(inputs, factors=None, window=252, half_life=252, month_days=21):
+    factors = FACTOR_NAMES if factors is None else factors
+    result = {}
+    for name in factors:
+        if name == 'CMRA':
+            result[name] = calc_cmra(inputs, window // month_days, month_days)
+        elif name == 'DASTD':
+            result[name] = calc_dastd(inputs, window, half_life)
+        elif name in ('BETA', 'HSIGMA'):
+            if inputs.index_close is None:
+                raise ValueError(name + ' needs index_close')
+            result[name] = (calc_beta if name == 'BETA' else calc_hsigma)(inputs, window, half_life)
+        elif name in ('STOM', 'STOQ', 'STOA'):
+            if inputs.volume is None or inputs.float_shares is None:
+                raise ValueError(name + ' needs volume and float_shares')
+            result[name] = calc_share_turnover(inputs, {'STOM': 1, 'STOQ': 3, 'STOA': 12}[name], month_days)
+        else:
+            raise ValueError('unknown factor: ' + str(name))
+    return result
+
+
+class FactorPanel(object):
+    def __init__(self, codes, dates, values):
+        self.codes = list(codes)
+        self.dates = [str(d) for d in dates]
+        self.values = values
+
+    @property
+    def factors(self):
+        return list(self.values.keys())
+
+    def cross_section(self, date=None):
+        import pandas as pd
+        pos = -1 if date is None else self.dates.index(str(date))
+        return pd.DataFrame({k: v[:, pos] for k, v in self.values.items()}, index=self.codes, columns=self.factors)
+
+    def save(self, path):
+        arrays = {'f_' + k: v for k, v in self.values.items()}
+        np.savez_compressed(path, codes=np.array(self.codes), dates=np.array(self.dates)
+            , factors=np.array(self.factors), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            values = {str(k): data['f_' + str(k)] for k in data['factors']}
+            return cls([str(c) for c in data['codes']], [str(d) for d in data['dates']], values)
+
+
+# online mode: the same factors kept as running state and updated from the newest bar only.
+# pushing a bar for the date already applied replaces it, so intraday reruns of a bar are safe.
+
+class RingBuffer(object):
+    def __init__(self, n, size):
+        self.data = np.full((size, n), np.nan)
+        self.pos = 0
+        self.count = 0
+        self._undo = None
+
+    @property
+    def full(self):
+        return self.count >= len(self.data)
+
+    def push(self, values):
+        old = self.data[self.pos].copy()
+        self._undo = (self.pos, self.count, old)
+        self.data[self.pos] = values
+        self.pos = (self.pos + 1) % len(self.data)
+        self.count += 1
+        return old
+
+    def rollback(self):
+        if self._undo is not None:
+            self.pos, self.count, old = self._undo
+            self.data[self.pos] = old
+            self._undo = None
+
+    def lag(self, k):
+        # k = 0 is the newest value
+        if k >= min(self.count, len(self.data)):
+            return np.full(self.data.shape[1], np.nan)
+        return self.data[(self.pos - 1 - k) % len(self.data)]
+
+    def get_state(self):
+        state = {'data': self.data, 'pos': np.array(self.pos), 'count': np.array(self.count)}
+        if self._undo is not None:
+            state['undo_pos'] = np.array(self._undo[0])
+            state['undo_count'] = np.array(self._undo[1])
+            state['undo_old'] = self._undo[2]
+        return state
+
+    def set_state(self, state):
+        self.data = np.array(state['data'], dtype=float)
+        self.pos = int(state['pos'])
+        self.count = int(state['count'])
+        self._undo = None
+        if 'undo_old' in state:
+            self._undo = (int(state['undo_pos']), int(state['undo_count']), np.array(state['undo_old']))
+
+
+class DecayWindow(object):
+    # online counterpart of window_decay_sum
+    def __init__(self, n, window, decay=1.0):
+        self.ring = RingBuffer(n, window)
+        self.decay = decay
+        self.tail = pow(decay, window)
+        self.acc = np.zeros(n)
+        self._undo = None
+
+    def push(self, values):
+        full = self.ring.full
+        old = self.ring.push(values)
+        self._undo = self.acc
+        self.acc = self.acc * self.decay + values
+        if full:
+            self.acc = self.acc - self.tail * old
+
+    def rollback(self):
+        if self._undo is not None:
+            self.acc = self._undo
+            self._undo = None
+            self.ring.rollback()
+
+    @property
+    def value(self):
+        if not self.ring.full:
+            return np.full(len(self.acc), np.nan)
+        return self.acc
+
+    def get_state(self):
+        state = {'ring_' + k: v for k, v in self.ring.get_state().items()}
+        state['acc'] = self.acc
+        if self._undo is not None:
+            state['undo_acc'] = self._undo
+        return state
+
+    def set_state(self, state):
+        self.ring.set_state({k[5:]: v for k, v in state.items() if k.startswith('ring_')})
+        self.acc = np.array(state['acc'], dtype=float)
+        self._undo = np.array(state['undo_acc'], dtype=float) if 'undo_acc' in state else None
+
+
+class RollingWLS(object):
+    # y = alpha + beta * x over the last `window` points, updated from decayed window sums
+    def __init__(self, n, window=252, half_life=252):
+        decay = half_life_decay(half_life)
+        self.sums = {k: DecayWindow(n, window, decay) for k in WLS_SUMS}
+
+    def update(self, x, y):
+        y = np.asarray(y, dtype=float).reshape(-1)
+        x = np.broadcast_to(np.asarray(x, dtype=float), y.shape)
+        mask = np.isfinite(x) & np.isfinite(y)
+        x = np.where(mask, x, 0.0)
+        y = np.where(mask, y, 0.0)
+        for k, v in (('w', mask.astype(float)), ('y', y), ('yy', y * y), ('x', x), ('xx', x * x), ('xy', x * y)):
+            self.sums[k].push(v)
+        return self.result()
+
+    def rollback(self):
+        for v in self.sums.values():
+            v.rollback()
+
+    def window_sums(self):
+        return {k: v.value for k, v in self.sums.items()}
+
+    def result(self):
+        return wls_from_sums(self.window_sums())
+
+
+class OnlineFactors(object):
+    def __init__(self, codes, window=252, half_life=252, month_days=21):
+        self.codes = list(codes)
+        self.window = window
+        self.half_life = half_life
+        self.month_days = month_days
+        self.months = window // month_days
+        self.date = None
+        self._undo_date = None
+        n = len(self.codes)
+        self.regression = RollingWLS(n, window, half_life)
+        self.turnover = {name: DecayWindow(n, m * month_days) for name, m in (('STOM', 1), ('STOQ', 3), ('STOA', 12))}
+        self.close = RingBuffer(n, self.months * month_days + 1)
+        self.index_close = RingBuffer(1, 2)
+        self.log_rf = RingBuffer(1, self.months * month_days)
+        # index_close is only pushed on bars that carry it, so its undo is a snapshot taken before every commit
+        self._undo_index = None
+
+    def _components(self):
+        result = {'close': self.close, 'index_close': self.index_close, 'log_rf': self.log_rf}
+        result.update({'sum_' + k: v for k, v in self.regression.sums.items()})
+        result.update({'turnover_' + k: v for k, v in self.turnover.items()})
+        return result
+
+    def _index_state(self):
+        return {k: np.array(v) for k, v in self.index_close.get_state().items() if not k.startswith('undo_')}
+
+    def rollback(self):
+        if self._undo_date is not None:
+            for name, c in self._components().items():
+                if name != 'index_close':
+                    c.rollback()
+            if self._undo_index is not None:
+                self.index_close.set_state(self._undo_index)
+            self.date = self._undo_date[0]
+            self._undo_date = None
+            self._undo_index = None
+
+    def update(self, date, close, volume=None, float_shares=None, index_close=None, risk_free=None):
+        date = str(date)
+        if self.date is not None:
+            if date < self.date:
+                return self.values()
+            if date == self.date:
+                self.rollback()
+        close = np.asarray(close, dtype=float).reshape(-1)
+        n = len(close)
+        rf = risk_free_daily(risk_free, 1)
+        self._undo_index = self._index_state()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y = close / self.close.lag(0) - 1 - rf / 365
+            if index_close is None:
+                x = np.zeros(n)
+            else:
+                x = np.full(n, index_close / self.index_close.lag(0)[0] - 1 - rf[0] / 365)
+                self.index_close.push(index_close)
+            if volume is None or float_shares is None:
+                turnover = np.zeros(n)
+            else:
+                turnover = np.asarray(volume, dtype=float) / np.asarray(float_shares, dtype=float)
+                turnover[~np.isfinite(turnover)] = 0.0
+        self.regression.update(x, y)
+        for w in self.turnover.values():
+            w.push(turnover)
+        self.close.push(close)
+        self.log_rf.push(np.log(1 + rf / 12))
+        self._undo_date = (self.date,)
+        self.date = date
+        return self.values()
+
+    def calc_cmra(self):
+        log_close = _safe_log(self.close.lag(0))
+        z_max = np.full(log_close.shape, -np.inf)
+        z_min = np.full(log_close.shape, np.inf)
+        rf_sum = 0.0
+        for m in range(1, self.months + 1):
+            rf_sum = rf_sum + self.log_rf.lag((m - 1) * self.month_days)
+            z = log_close - _safe_log(self.close.lag(m * self.month_days)) - rf_sum
+            z_max = np.fmax(z_max, z)
+            z_min = np.fmin(z_min, z)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = np.log((1 + z_max) / (1 + z_min))
+        result[~(np.isfinite(log_close) & np.isfinite(self.close.lag(self.months * self.month_days)))] = np.nan
+        return result
+
+    def values(self):
+        s = self.regression.window_sums()
+        _, beta, sigma = wls_from_sums(s)
+        result = {'CMRA': self.calc_cmra(), 'DASTD': dastd_from_sums(s), 'BETA': beta, 'HSIGMA': sigma}
+        for name, m in (('STOM', 1), ('STOQ', 3), ('STOA', 12)):
+            result[name] = _safe_log(self.turnover[name].value / m)
+        return result
+
+    def warm_up(self, dates, inputs):
+        index_close = inputs.index_close
+        for i, date in enumerate(dates):
+            self.update(date, inputs.close[:, i]
+                , None if inputs.volume is None else inputs.volume[:, i]
+                , None if inputs.float_shares is None else inputs.float_shares[:, i]
+                , None if index_close is None else index_close[i]
+                , inputs.annual_rf[i] * 100)
+        return self.values()
+
+    def save(self, path):
+        arrays = {}
+        for name, c in self._components().items():
+            for k, v in c.get_state().items():
+                arrays[name + '.' + k] = v
+        meta = np.array([self.window, self.half_life, self.month_days])
+        dates = [self.date or '', '' if self._undo_date is None else (self._undo_date[0] or '')]
+        if self._undo_index is not None:
+            arrays.update({'undo_index.' + k: v for k, v in self._undo_index.items()})
+        np.savez(path, codes=np.array(self.codes), meta=meta, dates=np.array(dates)
+            , has_undo=np.array(self._undo_date is not None), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            window, half_life, month_days = [int(v) for v in data['meta']]
+            obj = cls([str(c) for c in data['codes']], window, half_life, month_days)
+            for name, c in obj._components().items():
+                prefix = name + '.'
+                c.set_state({k[len(prefix):]: data[k] for k in data.files if k.startswith(prefix)})
+            date, undo_date = [str(d) for d in data['dates']]
+            obj.date = date or None
+            obj._undo_date = (undo_date or None,) if bool(data['has_undo']) else None
+            undo_index = {k[len('undo_index.'):]: data[k] for k in data.files if k.startswith('undo_index.')}
+            obj._undo_index = undo_index or None
+        return obj
+
+
+def market_data_to_array(data, codes, dates, field):
+    pos = {d: i for i, d in enumerate(dates)}
+    result = np.full((len(codes), len(dates)), np.nan)
+    for i, code in enumerate(codes):
+        df = data.get(code)
+        if df is None or df.empty or field not in df:
+            continue
+        cols = [pos.get(str(d), -1) for d in df.index]
+        keep = [k for k, c in enumerate(cols) if c >= 0]
+        result[i, [cols[k] for k in keep]] = df[field].values[keep].astype(float)
+    return result
+
+
+def load_factor_inputs(ContextInfo, stock_list, index_code='000300.SH', end_time='', count=300
+        , risk_free=None, dividend_type='front'):
+    index_data = ContextInfo.get_market_data_ex(['close'], [index_code], period='1d', end_time=end_time
+        , count=count, dividend_type=dividend_type)
+    index_df = index_data.get(index_code)
+    if index_df is None or index_df.empty:
+        return None, []
+    dates = [str(d) for d in index_df.index]
+    data = ContextInfo.get_market_data_ex(['close', 'volume'], stock_list, period='1d', end_time=end_time
+        , count=count, dividend_type=dividend_type)
+    close = market_data_to_array(data, stock_list, dates, 'close')
+    volume = market_data_to_array(data, stock_list, dates, 'volume')
+    float_shares = np.array([ContextInfo.get_float_caps(s) or np.nan for s in stock_list], dtype=float)
+    inputs = FactorInputs(close, volume, float_shares, index_df['close'].values, risk_free)
+    return inputs, dates
+
+
+def build_factor_panel(ContextInfo, stock_list, index_code='000300.SH', end_time='', count=300
+        , risk_free=None, factors=None, path=None):
+    inputs, dates = load_factor_inputs(ContextInfo, stock_list, index_code, end_time, count, risk_free)
+    if inputs is None:
+        return None
+    panel = FactorPanel(stock_list, dates, compute_risk_factors(inputs, factors))
+    if path:
+        panel.save(path)
+    return panel
@@ -0,0 +1,75 @@
+#coding:utf-8
+
+# Rolling-window training features built from one data request.
+# Windows are strided views over the fetched columns, so no per-day copies or requests are made.
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+FEATURE_NAMES = ['close_mean', 'volume_mean', 'high_mean', 'low_mean', 'volume', 'return', 'close_std']
+
+
+def rolling_window(values, window):
+    # (len - window + 1, window) read-only view, row i covers values[i:i + window]
+    values = np.ascontiguousarray(values, dtype=float)
+    count = len(values) - window + 1
+    if count <= 0:
+        return np.empty((0, window))
+    stride = values.strides[0]
+    return as_strided(values, shape=(count, window), strides=(stride, stride), writeable=False)
+
+
+def window_features(high, low, close, volume, window=15):
+    # one row per window end, same features as the single-window calculation in the ML example
+    close_w = rolling_window(close, window)
+    high_w = rolling_window(high, window)
+    low_w = rolling_window(low, window)
+    volume_w = rolling_window(volume, window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.column_stack([
+            close_w[:, -1] / close_w.mean(axis=1),
+            volume_w[:, -1] / volume_w.mean(axis=1),
+            high_w[:, -1] / high_w.mean(axis=1),
+            low_w[:, -1] / low_w.mean(axis=1),
+            volume_w[:, -1],
+            close_w[:, -1] / close_w[:, 0],
+            close_w.std(axis=1),
+        ])
+
+
+def forward_labels(close, horizon=5):
+    # 1 when the close `horizon` bars later is higher, NaN where the future is not known yet
+    close = np.asarray(close, dtype=float)
+    labels = np.full(len(close), np.nan)
+    if len(close) > horizon:
+        labels[:-horizon] = (close[horizon:] > close[:-horizon]).astype(float)
+    return labels
+
+
+def build_xy(df, window=15, horizon=5):
+    # X rows end at bars window - 1 .. len - horizon - 1, y compares each end with horizon bars later
+    df = df.sort_index()
+    values = {f: df[f].values.astype(float) for f in ('high', 'low', 'close', 'volume')}
+    x = window_features(values['high'], values['low'], values['close'], values['volume'], window)
+    y = forward_labels(values['close'], horizon)[window - 1:]
+    index = [str(d) for d in df.index[window - 1:]]
+    known = len(y) - horizon if len(y) > horizon else 0
+    return x[:known], y[:known].astype(int), index[:known]
+
+
+def load_training_set(ContextInfo, stock_list, start_time, end_time, window=15, horizon=5
+        , period='1d', dividend_type='front'):
+    data = ContextInfo.get_market_data_ex(['high', 'low', 'close', 'volume'], stock_list
+        , period=period, start_time=start_time, end_time=end_time, dividend_type=dividend_type)
+    xs, ys, keys = [], [], []
+    for code in stock_list:
+        df = data.get(code)
+        if df is None or len(df) < window + horizon:
+            continue
+        x, y, index = build_xy(df, window, horizon)
+        xs.append(x)
+        ys.append(y)
+        keys += [(code, d) for d in index]
+    if not xs:
+        return np.empty((0, len(FEATURE_NAMES))), np.empty(0, dtype=int), keys
+    return np.vstack(xs), np.concatenate(ys), keys
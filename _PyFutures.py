@@ -0,0 +1,306 @@
+#coding:utf-8
+
+# Futures helpers.
+# RollManager caches the main contract of each product per trading day, so get_main_contract is called once a day per
+# product. Roll schedules are derived from per-contract daily bars: the main contract of a day is the contract with the
+# largest open interest on the previous day, and the main never moves back to an earlier-expiring contract. Continuous
+# series are stitched from the same bars and back-adjusted, so the latest contract keeps its real prices.
+# ContractSpecs holds multiplier, margin ratios and price tick as numpy columns loaded once per trading day, so basket
+# sizing, margin and tick rounding are array operations instead of per-order instrument queries.
+
+import re
+import bisect
+import numpy as np
+from _PyFactor import market_data_to_array
+
+_CODE = re.compile(r'^([A-Za-z]+)(\d+)\.([A-Za-z]+)$')
+
+# market suffix -> sector listing its active contracts
+FUTURE_SECTORS = {
+    'SF': '上期所',
+    'DF': '大商所',
+    'ZF': '郑商所',
+    'IF': '中金所',
+    'INE': '能源中心',
+    'GF': '广期所',
+}
+
+
+def split_code(code):
+    # 'rb2405.SF' -> ('rb', '2405', 'SF'); None for codes that are not dated contracts
+    m = _CODE.match(code)
+    return m.groups() if m else None
+
+
+def product_of(code):
+    # 'rb2405.SF' -> 'rb.SF'
+    parts = split_code(code)
+    return parts[0] + '.' + parts[2] if parts else None
+
+
+def continuous_code(product):
+    # 'rb.SF' -> 'rb00.SF', the code get_main_contract expects
+    name, market = product.split('.')
+    return name + '00.' + market
+
+
+def product_contracts(product, codes):
+    return [c for c in codes if product_of(c) == product]
+
+
+class RollSchedule(object):
+    def __init__(self, product, dates, contracts, main, sub_main):
+        # main / sub_main: contract index per date, -1 where no contract traded
+        self.product = product
+        self.dates = list(dates)
+        self.contracts = list(contracts)
+        self.main = np.asarray(main, dtype=np.int64)
+        self.sub_main = np.asarray(sub_main, dtype=np.int64)
+
+    def _code(self, index):
+        return self.contracts[index] if index >= 0 else None
+
+    def _position(self, date):
+        # last schedule date on or before date
+        return bisect.bisect_right(self.dates, str(date)) - 1
+
+    def main_on(self, date):
+        i = self._position(date)
+        return self._code(self.main[i]) if i >= 0 else None
+
+    def sub_main_on(self, date):
+        i = self._position(date)
+        return self._code(self.sub_main[i]) if i >= 0 else None
+
+    def roll_dates(self):
+        # [(date, old contract, new contract)] for every day the main contract changes
+        changed = np.flatnonzero((self.main[1:] != self.main[:-1]) & (self.main[:-1] >= 0)) + 1
+        return [(self.dates[t], self.contracts[self.main[t - 1]], self._code(self.main[t])) for t in changed]
+
+    def contract_per_date(self):
+        return [self._code(i) for i in self.main]
+
+
+def roll_schedule(product, data, contracts, dates, field='openInterest', confirm_days=1):
+    # data: get_market_data_ex style {contract: DataFrame} daily bars with `field`
+    # confirm_days: days a later contract must lead before the main rolls to it
+    dates = [str(d) for d in dates]
+    oi = market_data_to_array(data, contracts, dates, field)
+    traded = np.isfinite(oi)
+    # expiry order from the data: contracts listed earlier expire earlier, ties broken by the last traded day
+    first = np.where(traded.any(axis=1), traded.argmax(axis=1), len(dates))
+    last = np.where(traded.any(axis=1), len(dates) - 1 - traded[:, ::-1].argmax(axis=1), -1)
+    order = np.lexsort((last, first))
+    contracts = [contracts[i] for i in order]
+    oi = oi[order]
+    traded = traded[order]
+    # previous day's open interest decides today's main (the first day uses its own)
+    prev = np.empty_like(oi)
+    prev[:, 1:] = oi[:, :-1]
+    prev[:, 0] = oi[:, 0]
+    prev = np.where(traded, prev, np.nan)
+    has = np.isfinite(prev).any(axis=0)
+    best = np.where(has, np.argmax(np.where(np.isfinite(prev), prev, -np.inf), axis=0), -1)
+    main = np.full(len(dates), -1, dtype=np.int64)
+    sub_main = np.full(len(dates), -1, dtype=np.int64)
+    current, lead = -1, 0
+    for t in range(len(dates)):
+        candidate = best[t]
+        if current < 0 or not traded[current, t]:
+            current, lead = candidate, 0
+        elif candidate > current:
+            lead += 1
+            if lead >= confirm_days:
+                current, lead = candidate, 0
+        else:
+            lead = 0
+        main[t] = current
+        if current >= 0:
+            later = prev[current + 1:, t]
+            if np.isfinite(later).any():
+                sub_main[t] = current + 1 + int(np.nanargmax(later))
+    return RollSchedule(product, dates, contracts, main, sub_main)
+
+
+def continuous(data, schedule, fields=('open', 'high', 'low', 'close'), method='ratio', anchor='close'):
+    # back-adjusted continuous bars -> {'dates', 'contract', 'factor', field: array}
+    # at each roll the earlier history is scaled (ratio) or shifted (diff) by the gap between the new and the old
+    # contract's `anchor` on the day before the roll
+    contracts, dates = schedule.contracts, schedule.dates
+    n = len(dates)
+    rows = np.maximum(schedule.main, 0)
+    valid = schedule.main >= 0
+    cols = np.arange(n)
+    ref = market_data_to_array(data, contracts, dates, anchor)
+    step = np.ones(n) if method == 'ratio' else np.zeros(n)
+    for date, old, new in schedule.roll_dates():
+        t = dates.index(date)
+        if new is None:
+            continue
+        a, b = ref[contracts.index(old), t - 1], ref[contracts.index(new), t - 1]
+        if np.isfinite(a) and np.isfinite(b) and a > 0:
+            step[t - 1] = b / a if method == 'ratio' else b - a
+    # factor[t] combines every roll after day t
+    if method == 'ratio':
+        factor = np.cumprod(step[::-1])[::-1]
+    else:
+        factor = np.cumsum(step[::-1])[::-1]
+    result = {'dates': dates, 'contract': schedule.contract_per_date(), 'factor': factor}
+    for f in fields:
+        raw = market_data_to_array(data, contracts, dates, f)[rows, cols]
+        raw = np.where(valid, raw, np.nan)
+        result[f] = raw * factor if method == 'ratio' else raw + factor
+    return result
+
+
+class RollManager(object):
+    def __init__(self, resolve_main, list_contracts=None):
+        # resolve_main(continuous code) -> current main contract; list_contracts(market) -> contract codes
+        self.resolve_main = resolve_main
+        self.list_contracts = list_contracts
+        self.mains = {}
+        self.schedules = {}
+
+    def main(self, product, trading_day):
+        # live main contract, resolved once per product and trading day
+        key = (product, str(trading_day))
+        code = self.mains.get(key)
+        if code is None:
+            code = self.resolve_main(continuous_code(product))
+            if code and '.' not in code:
+                code = code + '.' + product.split('.')[1]
+            self.mains[key] = code
+        return code
+
+    def contracts(self, product):
+        if self.list_contracts is None:
+            return []
+        return sorted(set(product_contracts(product, self.list_contracts(product.split('.')[1]))))
+
+    def set_schedule(self, schedule):
+        self.schedules[schedule.product] = schedule
+        return schedule
+
+    def schedule(self, product):
+        return self.schedules.get(product)
+
+    def main_on(self, product, date):
+        # scheduled main when a schedule covers the date (backtests), otherwise the cached live main
+        schedule = self.schedules.get(product)
+        if schedule is not None and schedule.dates and schedule.dates[0] <= str(date) <= schedule.dates[-1]:
+            return schedule.main_on(date)
+        return self.main(product, date)
+
+    def sub_main_on(self, product, date):
+        schedule = self.schedules.get(product)
+        return schedule.sub_main_on(date) if schedule is not None else None
+
+    def roll_dates(self, product):
+        schedule = self.schedules.get(product)
+        return schedule.roll_dates() if schedule is not None else []
+
+    def should_roll(self, held_code, date):
+        # -> the contract to roll into, None when held_code is still the main
+        main = self.main_on(product_of(held_code), date)
+        return main if main and main != held_code else None
+
+
+# ContractSpecs column -> get_instrumentdetail field
+SPEC_FIELDS = {
+    'multiplier': 'VolumeMultiple',
+    'long_margin': 'LongMarginRatio',
+    'short_margin': 'ShortMarginRatio',
+    'price_tick': 'PriceTick',
+    'up_stop': 'UpStopPrice',
+    'down_stop': 'DownStopPrice',
+    'expire_date': 'ExpireDate',
+}
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return np.nan
+    return value if np.isfinite(value) else np.nan
+
+
+class ContractSpecs(object):
+    def __init__(self, trading_day, detail, multiplier=None):
+        # detail(code) -> get_instrumentdetail dict; multiplier(code) is the fallback when VolumeMultiple is missing
+        self.trading_day = trading_day
+        self.detail = detail
+        self.multiplier_func = multiplier
+        self.codes = []
+        self.index = {}
+        self.columns = {name: np.empty(0) for name in SPEC_FIELDS}
+
+    def ensure(self, codes):
+        # query only codes not loaded yet for this trading day
+        new = [c for c in dict.fromkeys(codes) if c not in self.index]
+        if not new:
+            return self
+        rows = {name: [] for name in SPEC_FIELDS}
+        for code in new:
+            info = self.detail(code) or {}
+            for name, field in SPEC_FIELDS.items():
+                rows[name].append(_number(info.get(field)))
+            if not rows['multiplier'][-1] > 0:
+                rows['multiplier'][-1] = _number(self.multiplier_func(code)) if self.multiplier_func else 1.0
+        for name in SPEC_FIELDS:
+            self.columns[name] = np.concatenate([self.columns[name], np.array(rows[name], dtype=float)])
+        for code in new:
+            self.index[code] = len(self.codes)
+            self.codes.append(code)
+        return self
+
+    def rows(self, codes):
+        self.ensure(codes)
+        return np.array([self.index[c] for c in codes], dtype=np.int64)
+
+    def get(self, codes, name):
+        rows = self.rows(codes)
+        return self.columns[name][rows]
+
+    def notional(self, codes, prices, volumes):
+        return np.asarray(prices, dtype=float) * np.asarray(volumes, dtype=float) * self.get(codes, 'multiplier')
+
+    def margin(self, codes, prices, volumes, long=True):
+        # long: bool or per-order bool array (True uses LongMarginRatio, False ShortMarginRatio)
+        rows = self.rows(codes)
+        ratio = np.where(long, self.columns['long_margin'][rows], self.columns['short_margin'][rows])
+        return (np.asarray(prices, dtype=float) * np.asarray(volumes, dtype=float)
+            * self.columns['multiplier'][rows] * ratio)
+
+    def round_price(self, codes, prices, mode='nearest'):
+        # to each contract's PriceTick; mode 'down' / 'up' rounds buys / sells away from crossing the book
+        ticks = self.get(codes, 'price_tick')
+        ticks = np.where(ticks > 0, ticks, 0.01)
+        steps = np.asarray(prices, dtype=float) / ticks
+        if mode == 'down':
+            steps = np.floor(steps + 1e-9)
+        elif mode == 'up':
+            steps = np.ceil(steps - 1e-9)
+        else:
+            steps = np.round(steps)
+        return np.round(steps * ticks, 8)
+
+    def clip_price(self, codes, prices):
+        # inside today's limit band where the band is known
+        rows = self.rows(codes)
+        low, high = self.columns['down_stop'][rows], self.columns['up_stop'][rows]
+        prices = np.asarray(prices, dtype=float)
+        prices = np.where(np.isfinite(high) & (high > 0), np.minimum(prices, high), prices)
+        return np.where(np.isfinite(low) & (low > 0), np.maximum(prices, low), prices)
+
+    def max_volume(self, codes, prices, budgets, long=True):
+        # whole lots affordable with each budget at the given margin
+        per_lot = self.margin(codes, prices, np.ones(len(codes)), long)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lots = np.floor(np.asarray(budgets, dtype=float) / per_lot)
+        return np.where(np.isfinite(lots) & (lots > 0), lots, 0).astype(np.int64)
+
+    def basket(self, orders):
+        # orders: BasketTrader style dicts (code, price, volume, op_type) -> (codes, prices, volumes)
+        return ([o['code'] for o in orders], np.array([o['price'] for o in orders], dtype=float)
+            , np.array([o['volume'] for o in orders], dtype=float))
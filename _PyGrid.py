@@ -0,0 +1,400 @@
+#coding:utf-8
+
+# Price-ladder grid engine.
+# A grid keeps its price levels in one sorted array (min_buy_price .. max_sell_price, grid_interval apart, anchored
+# on base_buy_price) and two anchors: the highest resting buy and the lowest resting sell. Ticks are mapped to levels
+# by bisect and fills only move the anchors, so the resting orders per level are derived, never rebuilt.
+# Parameter names follow formulaLayout/网格策略.xml.
+# The offline backtester below replays tick arrays through the same ladder rules (touch mode): ticks are mapped to
+# levels with one searchsorted, only ticks that move to another level are kept, and the remaining events run through
+# a small loop that is compiled with numba when it is installed. Parameter sweeps are spread over processes.
+
+import math
+import bisect
+import itertools
+import multiprocessing
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+SIDE_BUY = 'buy'
+SIDE_SELL = 'sell'
+
+# formulaLayout/网格策略.xml bind name -> Grid argument
+LAYOUT_PARAMS = {
+    'base_buy_price': 'base_buy_price',
+    'base_sell_price': 'base_sell_price',
+    'min_buy_price': 'min_buy_price',
+    'max_sell_price': 'max_sell_price',
+    'min_buy_singlevolume': 'buy_count',
+    'max_sell_singlevolume': 'sell_count',
+    'min_buy_volume': 'buy_volume',
+    'max_sell_volume': 'sell_volume',
+    'grid_interval': 'grid_interval',
+    'reference_price': 'reference_price',
+    'max_warp': 'max_warp',
+}
+
+
+def ladder(base_price, grid_interval, min_price, max_price, price_tick=0.001):
+    # every base_price + k * grid_interval inside [min_price, max_price], rounded to price_tick
+    eps = 1e-9
+    k_lo = int(math.ceil((min_price - base_price) / grid_interval - eps))
+    k_hi = int(math.floor((max_price - base_price) / grid_interval + eps))
+    levels = base_price + np.arange(k_lo, k_hi + 1) * grid_interval
+    return np.round(np.round(levels / price_tick) * price_tick, 8)
+
+
+class Grid(object):
+    def __init__(self, code, base_buy_price, base_sell_price, min_buy_price, max_sell_price, grid_interval
+            , reference_price=None, buy_count=3, sell_count=3, buy_volume=100, sell_volume=100, max_warp=3
+            , price_tick=0.001):
+        self.code = code
+        self.grid_interval = grid_interval
+        self.buy_count = int(buy_count)
+        self.sell_count = int(sell_count)
+        self.buy_volume = int(buy_volume)
+        self.sell_volume = int(sell_volume)
+        self.max_warp = int(max_warp)
+        self.price_tick = price_tick
+        self.levels = ladder(base_buy_price, grid_interval, min_buy_price, max_sell_price, price_tick)
+        if not len(self.levels):
+            raise ValueError('empty grid ladder for %s' % code)
+        self._levels = self.levels.tolist()
+        # levels between a fill and the opposite order placed after it
+        self.ref_steps = max(1, int(round((reference_price or grid_interval) / grid_interval)))
+        self.buy_anchor = self.index(base_buy_price)
+        self.sell_anchor = self.index(base_sell_price)
+        self.buy_fills = 0
+        self.sell_fills = 0
+        self.position = 0
+        self.last_price = None
+
+    @classmethod
+    def from_layout(cls, code, params, **kwargs):
+        # params: {bind name: value} as configured in formulaLayout/网格策略.xml
+        args = {LAYOUT_PARAMS[k]: float(v) for k, v in params.items() if k in LAYOUT_PARAMS}
+        args.update(kwargs)
+        return cls(code, **args)
+
+    def index(self, price):
+        # nearest level
+        i = bisect.bisect_left(self._levels, price)
+        if i > 0 and (i == len(self._levels) or price - self._levels[i - 1] <= self._levels[i] - price):
+            i -= 1
+        return i
+
+    @property
+    def warp(self):
+        return self.buy_fills - self.sell_fills
+
+    def buy_levels(self):
+        # resting buy level indexes, lowest first; none once buys lead sells by max_warp fills
+        if self.warp >= self.max_warp:
+            return range(0)
+        hi = min(self.buy_anchor, self.sell_anchor - 1, len(self._levels) - 1)
+        return range(max(hi - self.buy_count + 1, 0), hi + 1)
+
+    def sell_levels(self):
+        if -self.warp >= self.max_warp:
+            return range(0)
+        lo = max(self.sell_anchor, self.buy_anchor + 1, 0)
+        return range(lo, min(lo + self.sell_count, len(self._levels)))
+
+    def targets(self):
+        # [(side, price, volume)] the grid wants resting now
+        return ([(SIDE_BUY, self._levels[i], self.buy_volume) for i in self.buy_levels()]
+            + [(SIDE_SELL, self._levels[i], self.sell_volume) for i in self.sell_levels()])
+
+    def on_fill(self, side, price, volume=None):
+        # a level order filled completely: the ladder follows the fill
+        i = self.index(price)
+        if side == SIDE_BUY:
+            self.buy_fills += 1
+            self.position += self.buy_volume if volume is None else volume
+            self.buy_anchor = i - 1
+            self.sell_anchor = i + self.ref_steps
+        else:
+            self.sell_fills += 1
+            self.position -= self.sell_volume if volume is None else volume
+            self.sell_anchor = i + 1
+            self.buy_anchor = i - self.ref_steps
+
+    def on_tick(self, price):
+        # touch mode: levels crossed by the move to price, filled in order -> [(side, level price, volume)]
+        self.last_price = price
+        fills = []
+        below = bisect.bisect_left(self._levels, price)        # buys at index >= below are crossed
+        above = bisect.bisect_right(self._levels, price) - 1   # sells at index <= above are crossed
+        while True:
+            buys = self.buy_levels()
+            if buys and buys[-1] >= below:
+                level = self._levels[buys[-1]]
+                fills.append((SIDE_BUY, level, self.buy_volume))
+                self.on_fill(SIDE_BUY, level)
+                continue
+            sells = self.sell_levels()
+            if sells and sells[0] <= above:
+                level = self._levels[sells[0]]
+                fills.append((SIDE_SELL, level, self.sell_volume))
+                self.on_fill(SIDE_SELL, level)
+                continue
+            return fills
+
+    def diff(self, resting_buy, resting_sell):
+        # resting_*: {price level: unfilled volume} -> ([(side, price, volume) to place], [(side, price) to cancel])
+        place, cancel = [], []
+        for side, resting, levels, volume in (
+                (SIDE_BUY, resting_buy, self.buy_levels(), self.buy_volume),
+                (SIDE_SELL, resting_sell, self.sell_levels(), self.sell_volume)):
+            wanted = set()
+            for i in levels:
+                price = round(self._levels[i], 4)
+                wanted.add(price)
+                missing = volume - resting.get(price, 0)
+                if missing > 0:
+                    place.append((side, self._levels[i], missing))
+            cancel += [(side, price) for price in resting if price not in wanted]
+        return place, cancel
+
+    def get_state(self):
+        return {
+            'anchors': np.array([self.buy_anchor, self.sell_anchor]),
+            'fills': np.array([self.buy_fills, self.sell_fills, self.position]),
+        }
+
+    def set_state(self, state):
+        self.buy_anchor, self.sell_anchor = [int(v) for v in state['anchors']]
+        self.buy_fills, self.sell_fills, self.position = [int(v) for v in state['fills']]
+
+
+class GridBook(object):
+    # one grid per code for an account; resting-order mode reconciles against the OrderManager,
+    # touch mode calls on_cross(code, fills) from whole-quote pushes (see ContextInfo.add_quote_listener)
+    def __init__(self, manager=None, on_cross=None, account_id=None):
+        # account_id: only orders of this account move the ladders (None follows every account)
+        self.grids = {}
+        self.manager = manager
+        self.on_cross = on_cross
+        self.account_id = account_id
+        self.settled = {}
+        if manager is not None:
+            manager.add_fill_listener(self.on_fill)
+
+    def add(self, grid):
+        self.grids[grid.code] = grid
+        return grid
+
+    def remove(self, code):
+        return self.grids.pop(code, None)
+
+    def on_fill(self, fill):
+        # OrderManager fill listener: a level counts as filled once its order is closed, completely traded or
+        # cancelled after a partial fill, with the volume actually traded
+        grid = self.grids.get(fill['code'])
+        if grid is None or fill['remaining'] > 0:
+            return
+        order = self.manager.get(fill['user_order_id'])
+        if self.account_id is not None and order.account_id != self.account_id:
+            return
+        counted = self.settled.get(order.user_order_id)
+        if counted is None:
+            if order.traded:
+                grid.on_fill(fill['side'], order.price, order.traded)
+        elif order.traded > counted:
+            # deals of an already closed order arriving late only move the position
+            extra = order.traded - counted
+            grid.position += extra if fill['side'] == SIDE_BUY else -extra
+        self.settled[order.user_order_id] = order.traded
+
+    def on_quote(self, datas):
+        # touch mode over a whole-quote push -> {code: [(side, price, volume)]}
+        result = {}
+        for code, grid in self.grids.items():
+            tick = datas.get(code)
+            price = tick.get('lastPrice', 0) if tick else 0
+            if not price or price <= 0:
+                continue
+            fills = grid.on_tick(price)
+            if fills:
+                result[code] = fills
+                if self.on_cross is not None:
+                    self.on_cross(code, fills)
+        return result
+
+    def reconcile(self, ContextInfo, code=None):
+        # cancels resting orders that left the ladder and returns {code: [(side, price, volume)]} still to place
+        result = {}
+        for c in ([code] if code else list(self.grids)):
+            grid = self.grids.get(c)
+            if grid is None:
+                continue
+            place, cancel = grid.diff(self.manager.levels(c, SIDE_BUY, self.account_id)
+                , self.manager.levels(c, SIDE_SELL, self.account_id))
+            for side, price in cancel:
+                self.manager.cancel_level(c, side, price, ContextInfo, self.account_id)
+            if place:
+                result[c] = place
+        return result
+
+
+# ---------------------------------------------------------------- offline backtest
+
+GRID_STATS = ('buy_fills', 'sell_fills', 'position', 'cash', 'fees', 'pnl', 'max_position', 'min_position'
+    , 'restore_volume')
+
+
+class TickSeries(object):
+    # ticks of one instrument prepared for simulation: traded ticks only, day starts and restore ticks marked
+    def __init__(self, prices, timetags, volumes=None, position_back_time='145000', tz_hours=8):
+        # timetags: tick times in ms since the epoch; volumes: traded volume per tick (not cumulative)
+        prices = np.asarray(prices, dtype=float)
+        timetags = np.asarray(timetags, dtype=np.int64)
+        keep = np.isfinite(prices) & (prices > 0)
+        if volumes is not None:
+            keep &= np.asarray(volumes) > 0
+        self.prices = prices[keep]
+        local = timetags[keep] // 1000 + int(tz_hours * 3600)
+        day = local // 86400
+        seconds = local % 86400
+        back = str(position_back_time).replace(':', '')
+        back = int(back[:2]) * 3600 + int(back[2:4]) * 60 + int(back[4:6] or 0)
+        self.new_day = np.ones(len(day), dtype=bool)
+        self.new_day[1:] = day[1:] != day[:-1]
+        # first tick of each day at or after position_back_time
+        late = seconds >= back
+        first_late = late.copy()
+        first_late[1:] &= ~(late[:-1] & (day[1:] == day[:-1]))
+        self.restore = first_late
+
+    def __len__(self):
+        return len(self.prices)
+
+
+def _grid_loop(levels, below, above, prices, new_day, restore, b0, s0, buy_count, sell_count, buy_volume
+        , sell_volume, ref_steps, max_warp, fee_rate, end_restore):
+    n = len(levels)
+    buy_anchor, sell_anchor = b0, s0
+    day_buys, day_sells = 0, 0
+    buys, sells = 0, 0
+    position, day_position = 0.0, 0.0
+    cash, fees = 0.0, 0.0
+    max_position, min_position, restore_volume = 0.0, 0.0, 0.0
+    halted = False
+    for t in range(len(prices)):
+        if new_day[t]:
+            day_position = position
+            halted = False
+            if end_restore:
+                buy_anchor, sell_anchor = b0, s0
+                day_buys, day_sells = 0, 0
+        if halted:
+            continue
+        if end_restore and restore[t]:
+            delta = day_position - position
+            if delta != 0:
+                cash -= delta * prices[t]
+                fees += abs(delta) * prices[t] * fee_rate
+                restore_volume += abs(delta)
+                position = day_position
+            halted = True
+            continue
+        while True:
+            warp = day_buys - day_sells
+            if buy_count > 0 and warp < max_warp:
+                hi = min(buy_anchor, sell_anchor - 1, n - 1)
+                if hi >= 0 and hi >= below[t]:
+                    # a gap through the level fills at the better tick price
+                    price = min(levels[hi], prices[t])
+                    position += buy_volume
+                    cash -= price * buy_volume
+                    fees += price * buy_volume * fee_rate
+                    day_buys += 1
+                    buys += 1
+                    buy_anchor, sell_anchor = hi - 1, hi + ref_steps
+                    continue
+            if sell_count > 0 and -warp < max_warp:
+                lo = max(sell_anchor, buy_anchor + 1, 0)
+                if lo < n and lo <= above[t]:
+                    price = max(levels[lo], prices[t])
+                    position -= sell_volume
+                    cash += price * sell_volume
+                    fees += price * sell_volume * fee_rate
+                    day_sells += 1
+                    sells += 1
+                    buy_anchor, sell_anchor = lo - ref_steps, lo + 1
+                    continue
+            break
+        max_position = max(max_position, position)
+        min_position = min(min_position, position)
+    last = prices[len(prices) - 1] if len(prices) else 0.0
+    result = np.empty(9)
+    result[0] = buys
+    result[1] = sells
+    result[2] = position
+    result[3] = cash
+    result[4] = fees
+    result[5] = cash - fees + position * last
+    result[6] = max_position
+    result[7] = min_position
+    result[8] = restore_volume
+    return result
+
+
+_grid_kernel = numba.njit(cache=True)(_grid_loop) if numba is not None else _grid_loop
+
+
+def simulate(series, base_buy_price, base_sell_price, min_buy_price, max_sell_price, grid_interval
+        , reference_price=None, buy_count=3, sell_count=3, buy_volume=100, sell_volume=100, max_warp=3
+        , price_tick=0.001, fee_rate=0.0, end_restore=True):
+    # -> {stat: value} for one parameter set, see GRID_STATS
+    grid = Grid('', base_buy_price, base_sell_price, min_buy_price, max_sell_price, grid_interval, reference_price
+        , buy_count, sell_count, buy_volume, sell_volume, max_warp, price_tick)
+    levels = grid.levels
+    below = np.searchsorted(levels, series.prices, 'left')
+    above = np.searchsorted(levels, series.prices, 'right') - 1
+    # only ticks that reach another level (plus day starts and restore ticks) can change the state
+    keep = series.new_day | series.restore
+    keep[1:] |= (below[1:] != below[:-1]) | (above[1:] != above[:-1])
+    if len(keep):
+        keep[-1] = True
+    stats = _grid_kernel(levels, below[keep], above[keep], series.prices[keep], series.new_day[keep]
+        , series.restore[keep], grid.buy_anchor, grid.sell_anchor, grid.buy_count, grid.sell_count
+        , float(grid.buy_volume), float(grid.sell_volume), grid.ref_steps, grid.max_warp, float(fee_rate)
+        , bool(end_restore))
+    return dict(zip(GRID_STATS, stats.tolist()))
+
+
+def param_grid(**choices):
+    # param_grid(grid_interval=[0.05, 0.1], base_buy_price=[11.9, 12.0], ...) -> list of parameter dicts
+    names = list(choices)
+    return [dict(zip(names, values)) for values in itertools.product(*[choices[k] for k in names])]
+
+
+_sweep_series = None
+
+
+def _sweep_init(series):
+    global _sweep_series
+    _sweep_series = series
+
+
+def _sweep_one(params):
+    return simulate(_sweep_series, **params)
+
+
+def sweep(series, params, processes=None, chunksize=16):
+    # simulate every parameter dict; processes=1 runs in this process -> {stat: array} aligned with params
+    if processes == 1 or len(params) < 2:
+        results = [simulate(series, **p) for p in params]
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_sweep_init, initargs=(series,))
+        try:
+            results = pool.map(_sweep_one, params, chunksize)
+        finally:
+            pool.close()
+            pool.join()
+    return {k: np.array([r[k] for r in results]) for k in GRID_STATS}
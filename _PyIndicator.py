@@ -0,0 +1,360 @@
+#coding:utf-8
+
+# Technical indicators for a whole pool at once.
+# Kernels take (codes x bars) float arrays, work along the time axis and never modify their inputs.
+# IndicatorEngine keeps the same indicators incrementally: state is committed once per finished bar (the daily
+# close for '1d') and intraday values are evaluated from a hypothetical current price without modifying it.
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from _PyFactor import rolling_sum, shift
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def ema_alpha(span):
+    return 2.0 / (span + 1)
+
+
+def as_matrix(values):
+    # a single series becomes one row
+    values = np.asarray(values, dtype=float)
+    return values.reshape(1, -1) if values.ndim == 1 else values
+
+
+def market_data_matrix(data, codes, field, length=None):
+    # get_market_data_ex result -> (codes x length) array, each code's own bars right-aligned, NaN padded on the left
+    series = [data.get(code) for code in codes]
+    if length is None:
+        length = max([0] + [len(df) for df in series if df is not None])
+    result = np.full((len(codes), length), np.nan)
+    for i, df in enumerate(series):
+        if df is None or df.empty or field not in df:
+            continue
+        values = np.asarray(df[field].values, dtype=float)[-length:]
+        if len(values):
+            result[i, length - len(values):] = values
+    return result
+
+
+def _ema_numpy(values, alpha):
+    result = np.empty(values.shape)
+    prev = np.full(values.shape[0], np.nan)
+    for t in range(values.shape[1]):
+        x = values[:, t]
+        prev = np.where(np.isnan(x), prev, np.where(np.isnan(prev), x, prev + alpha * (x - prev)))
+        result[:, t] = prev
+    return result
+
+
+def _ema_loop(values, alpha):
+    n, t = values.shape
+    result = np.empty((n, t))
+    for i in range(n):
+        prev = np.nan
+        for j in range(t):
+            x = values[i, j]
+            if not np.isnan(x):
+                prev = x if np.isnan(prev) else prev + alpha * (x - prev)
+            result[i, j] = prev
+    return result
+
+
+_ema_kernel = numba.njit(cache=True)(_ema_loop) if numba is not None else _ema_numpy
+
+
+def ma(values, window):
+    return rolling_sum(as_matrix(values), window) / window
+
+
+def ema(values, span):
+    # pandas ewm(span, adjust=False) per row; missing bars carry the previous average
+    return _ema_kernel(as_matrix(values), ema_alpha(span))
+
+
+def macd(close, short=12, long=26, signal=9):
+    dif = ema(close, short) - ema(close, long)
+    dea = ema(dif, signal)
+    return dif, dea, 2 * (dif - dea)
+
+
+def true_range(high, low, close):
+    high, low, close = as_matrix(high), as_matrix(low), as_matrix(close)
+    prev_close = shift(close, 1)
+    with np.errstate(invalid='ignore'):
+        return np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+
+def atr(high, low, close, period=14):
+    # simple average of the true range, as the strategy scripts compute it
+    return ma(true_range(high, low, close), period)
+
+
+def _windows(values, window):
+    n, t = values.shape
+    values = np.ascontiguousarray(values)
+    return as_strided(values, shape=(n, t - window + 1, window)
+        , strides=(values.strides[0], values.strides[1], values.strides[1]), writeable=False)
+
+
+def _rolling(values, window, func):
+    values = as_matrix(values)
+    result = np.full(values.shape, np.nan)
+    if values.shape[1] >= window:
+        result[:, window - 1:] = func(_windows(values, window), axis=2)
+    return result
+
+
+def rolling_max(values, window):
+    return _rolling(values, window, np.max)
+
+
+def rolling_min(values, window):
+    return _rolling(values, window, np.min)
+
+
+def returns(close, periods=1):
+    close = as_matrix(close)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return close / shift(close, periods) - 1
+
+
+def zscore(values, window):
+    # (x - rolling mean) / rolling sample std over the last `window` bars
+    values = as_matrix(values)
+    mean = rolling_sum(values, window) / window
+    var = (rolling_sum(values * values, window) - window * mean * mean) / (window - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (values - mean) / np.sqrt(np.maximum(var, 0))
+
+
+def ema_step(prev, value, alpha):
+    # same recursion as pandas ewm(adjust=False): the first valid value seeds the average
+    return np.where(np.isnan(prev), value, prev + alpha * (value - prev))
+
+
+class CodeRing(object):
+    # one ring per code; rows without a new value (suspended, no data) keep their position
+    def __init__(self, n, size):
+        self.data = np.full((n, size), np.nan)
+        self.pos = np.zeros(n, dtype=int)
+        self.count = np.zeros(n, dtype=int)
+
+    def push(self, values, mask):
+        rows = np.flatnonzero(mask)
+        self.data[rows, self.pos[rows]] = values[rows]
+        self.pos[rows] = (self.pos[rows] + 1) % self.data.shape[1]
+        self.count[rows] += 1
+
+    def lag(self, k, rows=None):
+        # k = 0 is the newest value
+        rows = np.arange(len(self.pos)) if rows is None else rows
+        result = self.data[rows, (self.pos[rows] - 1 - k) % self.data.shape[1]]
+        return np.where(self.count[rows] > k, result, np.nan)
+
+    def tail_sum(self, k, rows=None):
+        # sum of the newest k values, NaN until k values were pushed
+        rows = np.arange(len(self.pos)) if rows is None else rows
+        if k == 0:
+            return np.zeros(len(rows))
+        total = np.zeros(len(rows))
+        for i in range(k):
+            total += self.lag(i, rows)
+        return total
+
+    def grow(self, n):
+        extra = n - len(self.pos)
+        self.data = np.vstack([self.data, np.full((extra, self.data.shape[1]), np.nan)])
+        self.pos = np.concatenate([self.pos, np.zeros(extra, dtype=int)])
+        self.count = np.concatenate([self.count, np.zeros(extra, dtype=int)])
+
+    def get_state(self):
+        return {'data': self.data, 'pos': self.pos, 'count': self.count}
+
+    def set_state(self, state):
+        self.data = np.array(state['data'], dtype=float)
+        self.pos = np.array(state['pos'], dtype=int)
+        self.count = np.array(state['count'], dtype=int)
+
+
+class IndicatorEngine(object):
+    STATE_ARRAYS = ('ema_short', 'ema_long', 'dea', 'prev_close', 'count')
+
+    def __init__(self, codes, macd=(12, 26, 9), atr_period=14, ma_windows=(5, 20), keep=3):
+        # keep: committed MACD histogram values kept for pattern checks
+        self.codes = []
+        self.index = {}
+        self.short, self.long, self.signal = macd
+        self.atr_period = atr_period
+        self.ma_windows = tuple(ma_windows)
+        self.keep = keep
+        self.date = None
+        self._undo = None
+        self.ema_short = np.empty(0)
+        self.ema_long = np.empty(0)
+        self.dea = np.empty(0)
+        self.prev_close = np.empty(0)
+        self.count = np.empty(0, dtype=int)
+        self.closes = CodeRing(0, max(self.ma_windows + (1,)))
+        self.tr = CodeRing(0, atr_period)
+        self.hist = CodeRing(0, keep)
+        self.add_codes(codes)
+
+    def add_codes(self, codes):
+        new = [c for c in codes if c not in self.index]
+        if not new:
+            return
+        for c in new:
+            self.index[c] = len(self.codes)
+            self.codes.append(c)
+        n = len(self.codes)
+        extra = np.full(len(new), np.nan)
+        self.ema_short = np.concatenate([self.ema_short, extra])
+        self.ema_long = np.concatenate([self.ema_long, extra])
+        self.dea = np.concatenate([self.dea, extra])
+        self.prev_close = np.concatenate([self.prev_close, extra])
+        self.count = np.concatenate([self.count, np.zeros(len(new), dtype=int)])
+        for ring in self._rings().values():
+            ring.grow(n)
+
+    def rows(self, codes=None):
+        if codes is None:
+            return np.arange(len(self.codes))
+        return np.array([self.index[c] for c in codes], dtype=int)
+
+    def _rings(self):
+        return {'closes': self.closes, 'tr': self.tr, 'hist': self.hist}
+
+    def _live_state(self):
+        state = {k: getattr(self, k) for k in self.STATE_ARRAYS}
+        state['codes'] = np.array(self.codes)
+        state['date'] = np.array(self.date or '')
+        for name, ring in self._rings().items():
+            for k, v in ring.get_state().items():
+                state[name + '.' + k] = v
+        return state
+
+    def _set_live_state(self, state):
+        self.codes = [str(c) for c in state['codes']]
+        self.index = {c: i for i, c in enumerate(self.codes)}
+        self.date = str(state['date']) or None
+        for k in self.STATE_ARRAYS:
+            setattr(self, k, np.array(state[k], dtype=int if k == 'count' else float))
+        for name, ring in self._rings().items():
+            prefix = name + '.'
+            ring.set_state({k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)})
+
+    def get_state(self):
+        # the snapshot taken before the last commit is kept too, so a restored engine can still replace that bar
+        state = self._live_state()
+        if self._undo is not None:
+            for k, v in self._undo[1].items():
+                state['undo.' + k] = v
+        return state
+
+    def set_state(self, state):
+        self._set_live_state(state)
+        undo = {k[len('undo.'):]: v for k, v in state.items() if k.startswith('undo.')}
+        self._undo = (str(undo['date']) or None, undo) if undo else None
+
+    def rollback(self):
+        if self._undo is not None:
+            codes = self.codes
+            self.date, state = self._undo
+            self._set_live_state(state)
+            self._undo = None
+            # codes added after the snapshot come back empty, at the same rows
+            self.add_codes(codes)
+
+    def commit(self, date, close, high=None, low=None):
+        # one finished bar for every code, NaN where a code has no bar; the same date again replaces it
+        date = str(date)
+        if self.date is not None:
+            if date < self.date:
+                return
+            if date == self.date:
+                self.rollback()
+        self._undo = (self.date, {k: np.array(v) for k, v in self._live_state().items()})
+        close = np.asarray(close, dtype=float).reshape(-1)
+        mask = np.isfinite(close)
+        self.ema_short = np.where(mask, ema_step(self.ema_short, close, ema_alpha(self.short)), self.ema_short)
+        self.ema_long = np.where(mask, ema_step(self.ema_long, close, ema_alpha(self.long)), self.ema_long)
+        dif = self.ema_short - self.ema_long
+        self.dea = np.where(mask, ema_step(self.dea, dif, ema_alpha(self.signal)), self.dea)
+        self.hist.push(2 * (dif - self.dea), mask)
+        self.closes.push(close, mask)
+        if high is not None and low is not None:
+            tr = self.true_range(np.asarray(high, dtype=float), np.asarray(low, dtype=float), self.prev_close)
+            self.tr.push(tr, np.isfinite(tr))
+        self.prev_close = np.where(mask, close, self.prev_close)
+        self.count = self.count + mask
+        self.date = date
+
+    def sync(self, dates, close, high=None, low=None):
+        # commit the columns of (codes x dates) arrays that are newer than the committed state
+        for i, date in enumerate(dates):
+            if self.date is None or str(date) >= self.date:
+                self.commit(date, close[:, i], None if high is None else high[:, i], None if low is None else low[:, i])
+
+    @staticmethod
+    def true_range(high, low, prev_close):
+        with np.errstate(invalid='ignore'):
+            return np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+
+    def _atr(self, rows, tr=None):
+        if tr is None:
+            atr = self.tr.tail_sum(self.atr_period, rows) / self.atr_period
+        else:
+            atr = (self.tr.tail_sum(self.atr_period - 1, rows) + tr) / self.atr_period
+        return atr
+
+    def values(self, codes=None):
+        # committed indicators as of the last finished bar
+        rows = self.rows(codes)
+        ready = self.count[rows] >= self.long
+        dif = self.ema_short[rows] - self.ema_long[rows]
+        result = {
+            'close': self.prev_close[rows],
+            'dif': np.where(ready, dif, np.nan),
+            'dea': np.where(ready, self.dea[rows], np.nan),
+            'hist': np.where(ready, self.hist.lag(0, rows), np.nan),
+            'atr': self._atr(rows),
+            'count': self.count[rows],
+        }
+        for w in self.ma_windows:
+            result['ma%d' % w] = self.closes.tail_sum(w, rows) / w
+        return result
+
+    def what_if(self, price, codes=None, high=None, low=None):
+        # indicators if the current bar closed at `price`; *_prev and hist_prev2 are the committed values
+        rows = self.rows(codes)
+        price = np.asarray(price, dtype=float).reshape(-1)
+        ema_short = ema_step(self.ema_short[rows], price, ema_alpha(self.short))
+        ema_long = ema_step(self.ema_long[rows], price, ema_alpha(self.long))
+        dif = ema_short - ema_long
+        dea = ema_step(self.dea[rows], dif, ema_alpha(self.signal))
+        count = self.count[rows] + np.isfinite(price)
+        ready = count >= self.long
+        prev_ready = self.count[rows] >= self.long
+        result = {
+            'price': price,
+            'dif': np.where(ready, dif, np.nan),
+            'dea': np.where(ready, dea, np.nan),
+            'hist': np.where(ready, 2 * (dif - dea), np.nan),
+            'dif_prev': np.where(prev_ready, self.ema_short[rows] - self.ema_long[rows], np.nan),
+            'dea_prev': np.where(prev_ready, self.dea[rows], np.nan),
+            'hist_prev': np.where(prev_ready, self.hist.lag(0, rows), np.nan),
+            'hist_prev2': np.where(prev_ready, self.hist.lag(1, rows), np.nan),
+            'count': count,
+        }
+        for w in self.ma_windows:
+            result['ma%d' % w] = (self.closes.tail_sum(w - 1, rows) + price) / w
+        if high is not None and low is not None:
+            tr = self.true_range(np.asarray(high, dtype=float), np.asarray(low, dtype=float), self.prev_close[rows])
+            result['atr'] = self._atr(rows, tr)
+        else:
+            result['atr'] = self._atr(rows)
+        return result
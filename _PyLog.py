@@ -0,0 +1,98 @@
+#coding:utf-8
+
+# Buffered strategy log written from a background thread.
+# handlebar only enqueues lines; the writer thread appends them in batches to
+# <root>/<mode>/<name>/<YYYY-mm-dd>.txt, switching files when the date changes.
+
+import os
+import time
+import atexit
+import datetime
+import threading
+import queue
+
+_STOP = object()
+
+
+class AsyncLogger(object):
+    def __init__(self, root, name, mode='prod', encoding='gb2312', batch_size=512, flush_interval=0.5):
+        self.directory = os.path.join(root, mode, name)
+        self.encoding = encoding
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.file = None
+        self.file_date = None
+        self.dropped = 0
+        self.thread = threading.Thread(target=self._run, name='strategy-log-' + name)
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, message):
+        # never blocks; the file date is taken when the line is logged, not when it is written
+        if self.thread is None:
+            self.dropped += 1
+            return
+        self.queue.put((datetime.date.today(), str(message)))
+
+    def _open(self, date):
+        if self.file is not None:
+            self.file.close()
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, date.strftime('%Y-%m-%d') + '.txt')
+        self.file = open(path, 'a', encoding=self.encoding, errors='replace')
+        self.file_date = date
+
+    def _write(self, batch):
+        for date, line in batch:
+            if date != self.file_date:
+                if self.file is not None:
+                    self.file.flush()
+                self._open(date)
+            self.file.write(line + '\n')
+        self.file.flush()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                items = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [item for item in items if item is not _STOP]
+            stop = len(batch) < len(items)
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                print('strategy log write failed: %s' % e)
+            for _ in items:
+                self.queue.task_done()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def flush(self, timeout=None):
+        # wait until everything logged so far is on disk
+        if timeout is None:
+            self.queue.join()
+            return True
+        deadline = time.time() + timeout
+        while self.queue.unfinished_tasks and time.time() < deadline:
+            time.sleep(0.01)
+        return not self.queue.unfinished_tasks
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.thread = None
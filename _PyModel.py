@@ -0,0 +1,460 @@
+#coding:utf-8
+
+# Model fitting off the handlebar thread.
+# Fits run in a thread pool (a process pool only when asked for, since spawning workers inside the terminal can
+# re-launch the host executable) and are warm started from the previous parameters; handlebar only reads the newest
+# finished result.
+
+import os
+import time
+import pickle
+import hashlib
+import numpy as np
+from concurrent import futures
+from concurrent.futures.process import BrokenProcessPool
+
+
+def make_executor(backend='thread', max_workers=None, initializer=None, initargs=()):
+    kwargs = {'max_workers': max_workers}
+    if initializer is not None:
+        kwargs['initializer'] = initializer
+        kwargs['initargs'] = initargs
+    if backend == 'process':
+        return futures.ProcessPoolExecutor(**kwargs)
+    if backend == 'thread':
+        return futures.ThreadPoolExecutor(**kwargs)
+    raise ValueError('unknown backend: ' + str(backend))
+
+
+def fit_arma(series, order=(4, 3), steps=10, start_params=None, params=None):
+    # params given: keep them and only run the filter over the new data, otherwise estimate
+    series = np.asarray(series, dtype=float)
+    try:
+        from statsmodels.tsa.arima.model import ARIMA
+    except ImportError:
+        ARIMA = None
+    if ARIMA is not None:
+        model = ARIMA(series, order=(order[0], 0, order[1]))
+        if params is not None:
+            result = model.filter(params)
+        else:
+            result = model.fit(start_params=start_params)
+        forecast = result.forecast(steps)
+    else:
+        import statsmodels.api as sm
+        result = sm.tsa.ARMA(series, order).fit(start_params=params if params is not None else start_params, disp=0)
+        forecast = result.forecast(steps)[0]
+    return {
+        'params': np.asarray(result.params),
+        'forecast': np.asarray(forecast),
+        'resid_std': float(np.std(result.resid)),
+    }
+
+
+def _hash_update(h, obj):
+    if isinstance(obj, np.ndarray):
+        obj = np.ascontiguousarray(obj)
+        h.update(('ndarray', str(obj.dtype), obj.shape).__repr__().encode())
+        if obj.dtype == object:
+            for v in obj.reshape(-1):
+                _hash_update(h, v)
+        else:
+            h.update(obj.tobytes())
+    elif hasattr(obj, 'values') and hasattr(obj, 'index'):
+        # pandas Series / DataFrame
+        h.update(type(obj).__name__.encode())
+        _hash_update(h, np.asarray(obj.index.astype(str)))
+        if hasattr(obj, 'columns'):
+            _hash_update(h, np.asarray(obj.columns.astype(str)))
+        _hash_update(h, np.asarray(obj.values))
+    elif isinstance(obj, dict):
+        h.update(b'dict')
+        for k in sorted(obj, key=repr):
+            _hash_update(h, k)
+            _hash_update(h, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        h.update(('seq', len(obj)).__repr__().encode())
+        for v in obj:
+            _hash_update(h, v)
+    elif callable(obj) and hasattr(obj, '__qualname__'):
+        h.update((getattr(obj, '__module__', ''), obj.__qualname__).__repr__().encode())
+    else:
+        h.update(repr(obj).encode())
+
+
+def make_cache_key(data, params=None, version=''):
+    h = hashlib.sha256()
+    _hash_update(h, data)
+    _hash_update(h, params)
+    _hash_update(h, version)
+    return h.hexdigest()
+
+
+class ModelCache(object):
+    # fitted models pickled under a hash of training data, hyperparameters and code version
+    # the total size is kept as a running count; the directory is only walked when it crosses max_bytes (then trimmed
+    # to low_water * max_bytes) or, for max_age, at most once per age_check_interval seconds
+    def __init__(self, root, max_bytes=None, max_age=None, low_water=0.8, age_check_interval=3600):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.low_water = low_water
+        self.age_check_interval = age_check_interval
+        self.total_bytes = None
+        self.count = None
+        self.evicted_at = 0.0
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key + '.pkl')
+
+    def _size(self, path):
+        try:
+            return os.path.getsize(path)
+        except OSError:
+            return None
+
+    def _scan(self):
+        entries = self.entries()
+        self.total_bytes = sum(e[1] for e in entries)
+        self.count = len(entries)
+        return entries
+
+    def _remove(self, path):
+        size = self._size(path)
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        if self.total_bytes is not None and size is not None:
+            self.total_bytes -= size
+            self.count -= 1
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                model = pickle.load(f)
+        except (IOError, OSError):
+            return None
+        except Exception:
+            # truncated or unreadable entry: drop it and treat as a miss
+            self._remove(path)
+            return None
+        # touch so that size eviction drops the least recently used entries first
+        os.utime(path, None)
+        return model
+
+    def put(self, key, model):
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        if self.total_bytes is None and (self.max_bytes or self.max_age):
+            self._scan()
+        old = self._size(path)
+        tmp = path + '.%d.tmp' % os.getpid()
+        with open(tmp, 'wb') as f:
+            pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+        if self.total_bytes is not None:
+            self.total_bytes += size - (old or 0)
+            self.count += 0 if old is not None else 1
+        now = time.time()
+        if self.max_bytes and self.total_bytes > self.max_bytes:
+            self.evict(max_bytes=int(self.max_bytes * self.low_water))
+        elif self.max_age and now - self.evicted_at >= self.age_check_interval:
+            self.evict()
+
+    def get_or_fit(self, fit, data, params=None, version=''):
+        key = make_cache_key(data, params, version)
+        model = self.get(key)
+        if model is not None:
+            return model, True
+        model = fit()
+        self.put(key, model)
+        return model, False
+
+    def entries(self):
+        result = []
+        for folder, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith('.pkl'):
+                    path = os.path.join(folder, name)
+                    st = os.stat(path)
+                    result.append((st.st_mtime, st.st_size, path))
+        return result
+
+    def evict(self, max_bytes=None, max_age=None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        max_age = self.max_age if max_age is None else max_age
+        entries = sorted(self.entries())
+        now = time.time()
+        self.evicted_at = now
+        keep = []
+        for mtime, size, path in entries:
+            if max_age and now - mtime > max_age:
+                os.remove(path)
+            else:
+                keep.append((mtime, size, path))
+        total = sum(e[1] for e in keep)
+        count = len(keep)
+        if max_bytes:
+            for mtime, size, path in keep:
+                if total <= max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+                count -= 1
+        self.total_bytes = total
+        self.count = count
+
+    def clear(self):
+        self.evict(max_age=-1)
+
+
+class ModelFitService(object):
+    def __init__(self, fit_func=fit_arma, backend='thread', max_workers=None, refit_every=20
+            , drift_threshold=3.0, cache=None, version='', **fit_kwargs):
+        self.fit_func = fit_func
+        self.cache = cache
+        self.version = version
+        self.backend = backend
+        self.max_workers = max_workers
+        self.refit_every = refit_every
+        self.drift_threshold = drift_threshold
+        self.fit_kwargs = fit_kwargs
+        self.executor = make_executor(backend, max_workers)
+        self.models = {}
+
+    def _state(self, key):
+        state = self.models.get(key)
+        if state is None:
+            state = {
+                'params': None,
+                'fit_bar': None,
+                'resid_std': None,
+                'latest': None,
+                'results': {},
+                'pending': None,
+                'queued': None,
+            }
+            self.models[key] = state
+        return state
+
+    def _need_refit(self, state, bar, series):
+        if state['params'] is None:
+            return True
+        if self.refit_every and bar - state['fit_bar'] >= self.refit_every:
+            return True
+        latest = state['latest']
+        if self.drift_threshold and latest is not None and state['resid_std'] and latest['bar'] == bar - 1:
+            error = abs(series[-1] - latest['forecast'][0])
+            if error > self.drift_threshold * state['resid_std']:
+                return True
+        return False
+
+    def _launch(self, state, bar, series):
+        kwargs = dict(self.fit_kwargs)
+        refit = self._need_refit(state, bar, series)
+        if refit:
+            kwargs['start_params'] = state['params']
+        else:
+            kwargs['params'] = state['params']
+        if self.cache is not None:
+            key = make_cache_key((self.fit_func, series), kwargs, self.version)
+            result = self.cache.get(key)
+            if result is not None:
+                future = futures.Future()
+                future.set_result(dict(result))
+                state['pending'] = (future, bar, series, refit, None)
+                return
+        else:
+            key = None
+        try:
+            future = self.executor.submit(self.fit_func, series, **kwargs)
+        except BrokenProcessPool:
+            self._fallback()
+            future = self.executor.submit(self.fit_func, series, **kwargs)
+        state['pending'] = (future, bar, series, refit, key)
+
+    def _fallback(self):
+        # embedded interpreters may not be able to start worker processes
+        self.executor.shutdown(wait=False)
+        self.backend = 'thread'
+        self.executor = make_executor('thread', self.max_workers)
+
+    def _collect(self, state, wait=False, timeout=None):
+        while state['pending'] is not None:
+            future, bar, series, refit, key = state['pending']
+            if not wait and not future.done():
+                return
+            try:
+                result = future.result(timeout)
+            except futures.TimeoutError:
+                return
+            except BrokenProcessPool:
+                self._fallback()
+                state['pending'] = None
+                self._launch(state, bar, series)
+                continue
+            except Exception:
+                result = None
+            state['pending'] = None
+            if result is not None and key is not None:
+                self.cache.put(key, result)
+            if result is not None:
+                result = dict(result)
+                result['bar'] = bar
+                result['refit'] = refit
+                if refit or state['params'] is None:
+                    state['params'] = result['params']
+                    state['fit_bar'] = bar
+                    state['resid_std'] = result['resid_std']
+                state['latest'] = result
+                state['results'][bar] = result
+            elif refit:
+                # failed estimation, try again from scratch next time
+                state['params'] = None
+            if state['queued'] is not None:
+                bar, series = state['queued']
+                state['queued'] = None
+                self._launch(state, bar, series)
+
+    def submit(self, key, bar, series, wait=False, timeout=None):
+        state = self._state(key)
+        self._collect(state)
+        if bar not in state['results']:
+            series = np.asarray(series, dtype=float)
+            if state['pending'] is None:
+                self._launch(state, bar, series)
+            elif state['pending'][1] != bar:
+                state['queued'] = (bar, series)
+        if wait:
+            self._collect(state, True, timeout)
+        return self.forecast(key)
+
+    def forecast(self, key, bar=None):
+        state = self.models.get(key)
+        if state is None:
+            return None
+        self._collect(state)
+        if bar is None:
+            return state['latest']
+        return state['results'].get(bar)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+_worker_model = {}
+
+
+def _init_inference_worker(model, method):
+    # process workers receive the model once instead of with every batch
+    _worker_model['model'] = model
+    _worker_model['method'] = method
+
+
+def run_inference(features, model=None, method='predict'):
+    if model is None:
+        model = _worker_model['model']
+        method = _worker_model['method']
+    if isinstance(method, str):
+        return np.asarray(getattr(model, method)(features))
+    return np.asarray(method(model, features))
+
+
+class InferenceExecutor(object):
+    # requests queued during a bar are stacked into one predict call on the pool;
+    # results and callbacks are delivered on the strategy thread by poll()/result()
+    def __init__(self, model, method='predict', backend='thread', max_workers=1, batch_size=256
+            , latency_budget=0.0):
+        self.model = model
+        self.method = method
+        self.backend = backend
+        self.batch_size = batch_size
+        self.latency_budget = latency_budget
+        if backend == 'process':
+            self.executor = make_executor(backend, max_workers, _init_inference_worker, (model, method))
+        else:
+            self.executor = make_executor(backend, max_workers)
+        self.queue = []
+        self.batches = []
+        self.pending = {}
+        self.last = {}
+        self.latency = {}
+        self.request_id = 0
+
+    def submit(self, key, features, callback=None):
+        self.request_id += 1
+        self.queue.append((self.request_id, key, np.asarray(features, dtype=float).reshape(-1), callback))
+        self.pending[key] = self.request_id
+        if len(self.queue) >= self.batch_size:
+            self.flush()
+        return self.request_id
+
+    def flush(self):
+        if not self.queue:
+            return
+        batch, self.queue = self.queue, []
+        features = np.vstack([r[2] for r in batch])
+        if self.backend == 'process':
+            future = self.executor.submit(run_inference, features)
+        else:
+            future = self.executor.submit(run_inference, features, self.model, self.method)
+        self.batches.append((future, batch, time.time()))
+
+    def poll(self, timeout=0.0):
+        # deliver every finished batch, waiting at most `timeout` seconds for the rest
+        self.flush()
+        deadline = time.time() + timeout
+        remaining = []
+        for future, batch, submitted in self.batches:
+            if not future.done():
+                try:
+                    future.result(max(deadline - time.time(), 0.0))
+                except futures.TimeoutError:
+                    remaining.append((future, batch, submitted))
+                    continue
+                except Exception:
+                    pass
+            self._deliver(future, batch, submitted)
+        self.batches = remaining
+
+    def _deliver(self, future, batch, submitted):
+        try:
+            values = future.result()
+        except Exception:
+            values = None
+        elapsed = time.time() - submitted
+        for i, (request_id, key, _, callback) in enumerate(batch):
+            if self.pending.get(key) == request_id:
+                del self.pending[key]
+            if values is None:
+                continue
+            value = values[i]
+            self.last[key] = (request_id, value)
+            self.latency[key] = elapsed
+            if callback is not None:
+                callback(key, value)
+
+    def result(self, key, latency_budget=None):
+        # wait up to the budget for the newest request of `key`, else fall back to its last prediction
+        budget = self.latency_budget if latency_budget is None else latency_budget
+        self.poll()
+        if key in self.pending and budget:
+            deadline = time.time() + budget
+            while key in self.pending and time.time() < deadline:
+                self.poll(min(deadline - time.time(), 0.01))
+        last = self.last.get(key)
+        return None if last is None else last[1]
+
+    def is_fresh(self, key):
+        return key not in self.pending and key in self.last
+
+    def shutdown(self, wait=True):
+        self.flush()
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,492 @@
+#coding:utf-8
+
+# Option chain helpers.
+# OptionChain indexes the contracts of one underlying (strike, type, expiry, multiplier) as numpy columns, built from
+# instrument details once per trading day. bsm_price / implied_vol price and invert whole chains at once. IVSurface
+# keeps the implied vol of every contract, re-solves only the contracts whose quotes changed, and fits one smile per
+# expiry (a natural cubic spline in log-moneyness) that is interpolated in total variance across expiries.
+# PortfolioGreeks joins option positions with the chain index; strikes, expiries and vols of the held contracts are
+# kept as small arrays, so each underlying tick is one vectorized BSM pass over the book plus the hedge quantity.
+
+import time
+import datetime
+import numpy as np
+
+OPTION_CALL = 'CALL'
+OPTION_PUT = 'PUT'
+DAYS_PER_YEAR = 365.0
+
+# m_nDirection on option positions
+DIRECTION_LONG = 48
+DIRECTION_SHORT = 49
+
+
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+
+def norm_cdf(x):
+    # Abramowitz & Stegun 26.2.17, absolute error below 7.5e-8
+    x = np.asarray(x, dtype=float)
+    t = 1.0 / (1.0 + 0.2316419 * np.abs(x))
+    poly = t * (0.319381530 + t * (-0.356563782 + t * (1.781477937 + t * (-1.821255978 + t * 1.330274429))))
+    upper = norm_pdf(x) * poly
+    return np.where(x >= 0, 1.0 - upper, upper)
+
+
+def _d1_d2(spot, strike, t, rate, sigma, dividend):
+    vol_t = sigma * np.sqrt(t)
+    d1 = (np.log(spot / strike) + (rate - dividend + 0.5 * sigma * sigma) * t) / vol_t
+    return d1, d1 - vol_t
+
+
+def bsm_price(is_call, spot, strike, t, rate, sigma, dividend=0.0):
+    # European prices; every argument broadcasts, t in years
+    is_call = np.asarray(is_call, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, d2 = _d1_d2(spot, strike, t, rate, sigma, dividend)
+        fs = spot * np.exp(-dividend * t)
+        ks = strike * np.exp(-rate * t)
+        return np.where(is_call, fs * norm_cdf(d1) - ks * norm_cdf(d2), ks * norm_cdf(-d2) - fs * norm_cdf(-d1))
+
+
+def bsm_vega(spot, strike, t, rate, sigma, dividend=0.0):
+    # price change per 1.00 of volatility
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, _ = _d1_d2(spot, strike, t, rate, sigma, dividend)
+        return spot * np.exp(-dividend * t) * norm_pdf(d1) * np.sqrt(t)
+
+
+def bsm_greeks(is_call, spot, strike, t, rate, sigma, dividend=0.0):
+    # per unit of underlying: delta, gamma (per 1 spot), vega (per 1.00 vol), theta (per year)
+    is_call = np.asarray(is_call, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        d1, d2 = _d1_d2(spot, strike, t, rate, sigma, dividend)
+        sqrt_t = np.sqrt(t)
+        qf = np.exp(-dividend * t)
+        rf = np.exp(-rate * t)
+        pdf = norm_pdf(d1)
+        cdf1 = norm_cdf(d1)
+        cdf2 = norm_cdf(d2)
+        delta = np.where(is_call, qf * cdf1, qf * (cdf1 - 1))
+        gamma = qf * pdf / (spot * sigma * sqrt_t)
+        vega = spot * qf * pdf * sqrt_t
+        theta = (-spot * qf * pdf * sigma / (2 * sqrt_t)
+            + np.where(is_call, dividend * spot * qf * cdf1 - rate * strike * rf * cdf2
+                , rate * strike * rf * (1 - cdf2) - dividend * spot * qf * (1 - cdf1)))
+    return {'delta': delta, 'gamma': gamma, 'vega': vega, 'theta': theta}
+
+
+def implied_vol(prices, is_call, spot, strike, t, rate, dividend=0.0, low=1e-4, high=5.0, tol=1e-6, max_iter=50):
+    # safeguarded Newton: steps leaving the [low, high] bracket fall back to bisection
+    # NaN where the price is outside the no-arbitrage bounds
+    prices, is_call, spot, strike, t = np.broadcast_arrays(np.asarray(prices, dtype=float)
+        , np.asarray(is_call, dtype=bool), np.asarray(spot, dtype=float), np.asarray(strike, dtype=float)
+        , np.asarray(t, dtype=float))
+    fs = spot * np.exp(-dividend * t)
+    ks = strike * np.exp(-rate * t)
+    lower = np.where(is_call, np.maximum(fs - ks, 0), np.maximum(ks - fs, 0))
+    upper = np.where(is_call, fs, ks)
+    with np.errstate(invalid='ignore'):
+        ok = np.isfinite(prices) & (prices > lower) & (prices < upper) & (t > 0) & (strike > 0) & (spot > 0)
+    sigma = np.full(prices.shape, np.nan)
+    if not ok.any():
+        return sigma
+    p, c, s, k, tt = prices[ok], is_call[ok], spot[ok], strike[ok], t[ok]
+    lo = np.full(p.shape, float(low))
+    hi = np.full(p.shape, float(high))
+    x = np.full(p.shape, 0.3)
+    for _ in range(max_iter):
+        diff = bsm_price(c, s, k, tt, rate, x, dividend) - p
+        if (np.abs(diff) < tol).all():
+            break
+        hi = np.where(diff > 0, x, hi)
+        lo = np.where(diff < 0, x, lo)
+        vega = bsm_vega(s, k, tt, rate, x, dividend)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = x - diff / vega
+        x = np.where((vega > 1e-12) & (step > lo) & (step < hi), step, 0.5 * (lo + hi))
+    sigma[ok] = x
+    return sigma
+
+
+def option_price(tick):
+    # mid of the best quotes when both sides are present, otherwise the last price
+    bid, ask = tick.get('bidPrice') or [0], tick.get('askPrice') or [0]
+    if bid[0] > 0 and ask[0] > 0:
+        return 0.5 * (bid[0] + ask[0])
+    price = tick.get('lastPrice', 0)
+    return price if price and price > 0 else np.nan
+
+
+def year_fraction(today, expiries):
+    # calendar days from today to each YYYYMMDD expiry in years, at least one day
+    start = datetime.datetime.strptime(str(today), '%Y%m%d')
+    expiries = np.asarray(expiries, dtype=np.int64)
+    days = np.array([(datetime.datetime.strptime(str(e), '%Y%m%d') - start).days for e in expiries.ravel()], dtype=float)
+    return np.maximum(days.reshape(expiries.shape), 1.0) / DAYS_PER_YEAR
+
+
+class OptionChain(object):
+    def __init__(self, underlying, codes, strikes, is_call, expiries, multipliers, trading_day=None):
+        self.underlying = underlying
+        self.trading_day = trading_day
+        self.codes = list(codes)
+        self.index = {c: i for i, c in enumerate(self.codes)}
+        self.strikes = np.asarray(strikes, dtype=float)
+        self.is_call = np.asarray(is_call, dtype=bool)
+        self.expiries = np.asarray(expiries, dtype=np.int64)
+        self.multipliers = np.asarray(multipliers, dtype=float)
+
+    @classmethod
+    def from_details(cls, underlying, codes, detail, trading_day=None):
+        # detail(code) -> raw instrument detail with ExtendInfo (OptExercisePrice, optType); others are skipped
+        rows = []
+        for code in codes:
+            info = detail(code) or {}
+            ext = info.get('ExtendInfo') or {}
+            if 'OptExercisePrice' not in ext:
+                continue
+            rows.append((code, ext['OptExercisePrice'], ext.get('optType') == OPTION_CALL, int(info.get('ExpireDate') or 0)
+                , info.get('VolumeMultiple') or 1))
+        rows.sort(key=lambda r: (r[3], r[1], not r[2]))
+        columns = list(zip(*rows)) or [[]] * 5
+        return cls(underlying, *columns, trading_day=trading_day)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def rows(self, codes):
+        # -1 for codes outside the chain
+        return np.array([self.index.get(c, -1) for c in codes], dtype=np.int64)
+
+    def expiry_dates(self):
+        return np.unique(self.expiries)
+
+    def expiry_rows(self, expiry):
+        return np.flatnonzero(self.expiries == int(expiry))
+
+    def time_to_expiry(self, today):
+        return year_fraction(today, self.expiries)
+
+
+class Smile(object):
+    # natural cubic spline through (x, y) with flat extrapolation; fewer than three points interpolate linearly
+    def __init__(self, x, y):
+        order = np.argsort(x)
+        self.x = np.asarray(x, dtype=float)[order]
+        self.y = np.asarray(y, dtype=float)[order]
+        n = len(self.x)
+        self.m = np.zeros(n)
+        if n >= 3:
+            h = np.diff(self.x)
+            a = np.zeros((n - 2, n - 2))
+            idx = np.arange(n - 2)
+            a[idx, idx] = 2 * (h[:-1] + h[1:])
+            a[idx[1:], idx[:-1]] = h[1:-1]
+            a[idx[:-1], idx[1:]] = h[1:-1]
+            rhs = 6 * (np.diff(self.y[1:]) / h[1:] - np.diff(self.y[:-1]) / h[:-1])
+            self.m[1:-1] = np.linalg.solve(a, rhs)
+
+    def __call__(self, x):
+        x = np.clip(np.asarray(x, dtype=float), self.x[0], self.x[-1])
+        if len(self.x) < 3:
+            return np.interp(x, self.x, self.y)
+        i = np.clip(np.searchsorted(self.x, x) - 1, 0, len(self.x) - 2)
+        x0, x1 = self.x[i], self.x[i + 1]
+        h = x1 - x0
+        a, b = (x1 - x) / h, (x - x0) / h
+        return (a * self.y[i] + b * self.y[i + 1]
+            + ((a ** 3 - a) * self.m[i] + (b ** 3 - b) * self.m[i + 1]) * h * h / 6)
+
+
+class IVSurface(object):
+    def __init__(self, chain, rate=0.0, dividend=0.0, spot_tolerance=1e-4, otm_only=True):
+        # spot_tolerance: relative spot move that re-solves the whole chain; smaller moves re-solve changed quotes only
+        self.chain = chain
+        self.rate = rate
+        self.dividend = dividend
+        self.spot_tolerance = spot_tolerance
+        self.otm_only = otm_only
+        n = len(chain)
+        self.prices = np.full(n, np.nan)
+        self.iv = np.full(n, np.nan)
+        self.spot = np.nan
+        self.solved_spot = np.nan
+        self.today = None
+        self.t = np.empty(0)
+        self.smiles = {}
+        # bumped whenever iv changes, so readers can skip re-reading an unchanged surface
+        self.version = 0
+
+    def set_chain(self, chain):
+        # move to a rebuilt chain (new listings, expired contracts dropped); quotes carry over by code and the whole
+        # chain is re-solved on the next refresh
+        old = self.chain.rows(chain.codes)
+        found = old >= 0
+        prices = np.full(len(chain), np.nan)
+        prices[found] = self.prices[old[found]]
+        self.prices = prices
+        self.iv = np.full(len(chain), np.nan)
+        self.chain = chain
+        self.today = None
+        self.solved_spot = np.nan
+        self.smiles = {}
+        self.version += 1
+
+    def refresh(self, spot, prices=None, codes=None, today=None):
+        # prices aligned with codes (default: the whole chain); returns the number of contracts re-solved
+        today = str(today or time.strftime('%Y%m%d'))
+        if today != self.today:
+            self.today = today
+            self.t = self.chain.time_to_expiry(today)
+            self.solved_spot = np.nan
+        if spot == spot and spot > 0:
+            self.spot = float(spot)
+        if prices is not None:
+            rows = np.arange(len(self.chain)) if codes is None else self.chain.rows(codes)
+            prices = np.asarray(prices, dtype=float)
+            keep = rows >= 0
+            rows, prices = rows[keep], prices[keep]
+            changed = rows[~((prices == self.prices[rows]) | (np.isnan(prices) & np.isnan(self.prices[rows])))]
+            self.prices[rows] = prices
+        else:
+            changed = np.empty(0, dtype=np.int64)
+        if not self.spot == self.spot:
+            return 0
+        if not abs(self.spot / self.solved_spot - 1) <= self.spot_tolerance:
+            changed = np.arange(len(self.chain))
+            self.solved_spot = self.spot
+        if not len(changed):
+            return 0
+        c = self.chain
+        self.iv[changed] = implied_vol(self.prices[changed], c.is_call[changed], self.solved_spot, c.strikes[changed]
+            , self.t[changed], self.rate, self.dividend)
+        for expiry in np.unique(c.expiries[changed]):
+            self.fit(expiry)
+        self.version += 1
+        return len(changed)
+
+    def on_quote(self, datas):
+        # subscribe_whole_quote push or get_full_tick result carrying the underlying and/or chain contracts
+        tick = datas.get(self.chain.underlying)
+        spot = tick.get('lastPrice', np.nan) if tick else np.nan
+        codes = [code for code in datas if code in self.chain.index]
+        if codes or spot == spot:
+            self.refresh(spot, [option_price(datas[code]) for code in codes], codes)
+
+    def forward(self, t):
+        # from the spot the current IVs were solved against
+        return self.solved_spot * np.exp((self.rate - self.dividend) * np.asarray(t, dtype=float))
+
+    def fit(self, expiry):
+        c = self.chain
+        rows = c.expiry_rows(expiry)
+        t = self.t[rows[0]]
+        k = np.log(c.strikes[rows] / self.forward(t))
+        iv = self.iv[rows]
+        use = np.isfinite(iv)
+        if self.otm_only:
+            otm = use & np.where(c.is_call[rows], k >= 0, k < 0)
+            # wings quoted on one side only keep their in-the-money quotes
+            use = otm | (use & ~np.isin(c.strikes[rows], c.strikes[rows][otm]))
+        if not use.any():
+            self.smiles.pop(int(expiry), None)
+            return None
+        # one point per strike: the mean of the quotes kept at that strike
+        strikes, inverse = np.unique(c.strikes[rows][use], return_inverse=True)
+        vols = np.bincount(inverse, weights=iv[use]) / np.bincount(inverse)
+        smile = Smile(np.log(strikes / self.forward(t)), vols)
+        self.smiles[int(expiry)] = (t, smile)
+        return smile
+
+    def smile(self, expiry):
+        item = self.smiles.get(int(expiry))
+        return item[1] if item else None
+
+    def _total_variance(self, expiry, k):
+        t, smile = self.smiles[expiry]
+        vol = smile(k)
+        return vol * vol * t
+
+    def interpolate(self, strikes, expiries):
+        # model IV at arbitrary strikes and YYYYMMDD expiries; linear in total variance between fitted expiries,
+        # the nearest fitted expiry's vol outside them
+        strikes, expiries = np.broadcast_arrays(np.asarray(strikes, dtype=float), np.asarray(expiries, dtype=np.int64))
+        result = np.full(strikes.shape, np.nan)
+        fitted = sorted(self.smiles)
+        if not fitted or self.today is None:
+            return result
+        times = np.array([self.smiles[e][0] for e in fitted])
+        for expiry in np.unique(expiries):
+            mask = expiries == expiry
+            t = float(year_fraction(self.today, expiry))
+            k = strikes[mask]
+            j = np.searchsorted(times, t)
+            if j == 0 or j == len(times) or times[j] == t:
+                near = fitted[min(j, len(times) - 1)]
+                result[mask] = self.smiles[near][1](np.log(k / self.forward(t)))
+                continue
+            t0, t1 = times[j - 1], times[j]
+            x = np.log(k / self.forward(t))
+            w0 = self._total_variance(fitted[j - 1], x)
+            w1 = self._total_variance(fitted[j], x)
+            w = w0 + (w1 - w0) * (t - t0) / (t1 - t0)
+            result[mask] = np.sqrt(np.maximum(w, 0) / t)
+        return result
+
+    def market_iv(self, codes):
+        # solved IV per contract, NaN for unquoted or unknown codes
+        rows = self.chain.rows(codes)
+        values = np.full(len(rows), np.nan)
+        found = rows >= 0
+        values[found] = self.iv[rows[found]]
+        return values
+
+    def model_iv(self, codes):
+        # smile IV at each contract's own strike and expiry
+        rows = self.chain.rows(codes)
+        values = np.full(len(rows), np.nan)
+        found = rows >= 0
+        if found.any():
+            values[found] = self.interpolate(self.chain.strikes[rows[found]], self.chain.expiries[rows[found]])
+        return values
+
+
+class PortfolioGreeks(object):
+    def __init__(self, chain, rate=0.0, dividend=0.0, surface=None, default_vol=0.25, hedge_multiplier=1, hedge_lot=100
+            , band=0.0, account_id=''):
+        # account_id: position callbacks of other accounts are ignored ('' keeps every one)
+        # surface: IVSurface of the same chain supplying vols; default_vol where it has none
+        # hedge_multiplier / hedge_lot: underlying units per hedge contract and the order lot (ETF: 1 / 100;
+        # index options hedged with futures: the futures multiplier / 1)
+        # band: net delta (underlying units) tolerated before hedging
+        self.chain = chain
+        self.rate = rate
+        self.dividend = dividend
+        self.surface = surface
+        self.default_vol = default_vol
+        self.hedge_multiplier = hedge_multiplier
+        self.hedge_lot = hedge_lot
+        self.band = band
+        self.account_id = account_id
+        self.volumes = {}
+        self.underlying_volume = 0.0
+        self.today = None
+        self.spot = np.nan
+        self.totals = {'delta': 0.0, 'gamma': 0.0, 'vega': 0.0, 'theta': 0.0}
+        self._book = None
+
+    def set_position(self, code, volume, direction=DIRECTION_LONG):
+        # contracts held in one direction; the underlying itself counts as units of delta
+        if code == self.chain.underlying:
+            self.underlying_volume = float(volume)
+            return
+        if code not in self.chain.index:
+            return
+        self.volumes[(code, direction)] = volume
+        self._book = None
+
+    def load(self, positions):
+        # get_trade_detail_data(account, 'STOCK_OPTION', 'POSITION') result
+        self.volumes = {}
+        self._book = None
+        for position in positions:
+            self.on_position(position)
+
+    def on_position(self, position):
+        account_id = getattr(position, 'm_strAccountID', '')
+        if self.account_id and account_id and account_id != self.account_id:
+            return
+        code = position.m_strInstrumentID + '.' + position.m_strExchangeID
+        self.set_position(code, position.m_nVolume, getattr(position, 'm_nDirection', DIRECTION_LONG))
+
+    def set_chain(self, chain):
+        # move to a rebuilt chain; positions in contracts no longer listed are dropped
+        self.chain = chain
+        self.volumes = {k: v for k, v in self.volumes.items() if k[0] in chain.index}
+        self._book = None
+
+    def _build(self):
+        # held rows with signed units (contracts x multiplier), time to expiry and vols
+        if self._book is None:
+            signed = {}
+            for (code, direction), volume in self.volumes.items():
+                sign = -1 if direction == DIRECTION_SHORT else 1
+                signed[code] = signed.get(code, 0) + sign * volume
+            codes = [c for c, v in signed.items() if v]
+            rows = self.chain.rows(codes)
+            units = np.array([signed[c] for c in codes], dtype=float) * self.chain.multipliers[rows]
+            t = year_fraction(self.today, self.chain.expiries[rows]) if self.today else np.empty(0)
+            self._book = {'codes': codes, 'rows': rows, 'units': units, 't': t, 'vol': self._vols(rows)
+                , 'surface_version': self._surface_version()}
+        return self._book
+
+    def _surface_version(self):
+        return self.surface.version if self.surface is not None else None
+
+    def _vols(self, rows):
+        vol = np.full(len(rows), np.nan)
+        surface = self.surface
+        if surface is not None and len(rows):
+            vol = surface.iv[rows].copy()
+            missing = ~np.isfinite(vol)
+            if missing.any():
+                vol[missing] = surface.interpolate(self.chain.strikes[rows[missing]], self.chain.expiries[rows[missing]])
+        return np.where(np.isfinite(vol), vol, self.default_vol)
+
+    def refresh_vols(self):
+        # re-read vols from the surface when it changed since the last read; positions and expiries are kept
+        book = self._book
+        if book is not None and book['surface_version'] != self._surface_version():
+            book['vol'] = self._vols(book['rows'])
+            book['surface_version'] = self._surface_version()
+
+    def update(self, spot, today):
+        # -> totals {'delta', 'gamma', 'vega', 'theta'} in underlying units; delta includes the underlying position
+        # today: the bar's date (YYYYMMDD), which time to expiry is counted from
+        today = str(today)
+        if today != self.today:
+            self.today = today
+            self._book = None
+        book = self._build()
+        # vols follow the live surface, which re-solves on the same pushes before this book is re-priced
+        self.refresh_vols()
+        self.spot = float(spot)
+        rows = book['rows']
+        if len(rows):
+            c = self.chain
+            greeks = bsm_greeks(c.is_call[rows], self.spot, c.strikes[rows], book['t'], self.rate, book['vol']
+                , self.dividend)
+            for name, values in greeks.items():
+                self.totals[name] = float(np.dot(book['units'], values))
+        else:
+            self.totals = dict.fromkeys(self.totals, 0.0)
+        self.totals['delta'] += self.underlying_volume
+        return self.totals
+
+    def on_quote(self, datas):
+        tick = datas.get(self.chain.underlying)
+        price = tick.get('lastPrice', 0) if tick else 0
+        # live pushes are priced on the trading day the chain was built for
+        if price and price > 0 and self.chain.trading_day:
+            self.update(price, self.chain.trading_day)
+
+    def hedge_quantity(self):
+        # hedge contracts (positive: buy) bringing net delta back to zero, 0 while inside the band
+        delta = self.totals['delta']
+        if abs(delta) <= self.band:
+            return 0
+        lots = int(round(-delta / (self.hedge_multiplier * self.hedge_lot)))
+        return lots * self.hedge_lot
+
+    def exposure(self):
+        # per held contract {code: {'units', 'vol', 'delta'}} at the last update spot
+        book = self._build()
+        if not len(book['rows']) or self.spot != self.spot:
+            return {}
+        c, rows = self.chain, book['rows']
+        delta = bsm_greeks(c.is_call[rows], self.spot, c.strikes[rows], book['t'], self.rate, book['vol']
+            , self.dividend)['delta']
+        return {code: {'units': float(u), 'vol': float(v), 'delta': float(u * d)} for code, u, v, d
+            in zip(book['codes'], book['units'], book['vol'], delta)}
@@ -0,0 +1,151 @@
+#coding:utf-8
+
+# Post-close precompute of per-code daily indicators.
+# A job fetches daily bars for its pool once after the close, evaluates the registered indicators on
+# (codes x bars) matrices and stores one table per trading day, so the next morning only loads a file.
+
+import os
+import time
+import datetime
+import numpy as np
+
+
+def bar_day(index_value):
+    return str(index_value)[:8]
+
+
+def previous_trading_day(ContextInfo, trading_day, stock_code):
+    # the trading day before trading_day on stock_code's calendar, None when unknown
+    dates = ContextInfo.get_trading_dates(stock_code, '', trading_day, 2, '1d') or []
+    dates = [bar_day(d) for d in dates if bar_day(d) < trading_day]
+    return dates[-1] if dates else None
+
+
+class DailyTable(object):
+    def __init__(self, as_of, codes, values):
+        self.as_of = as_of
+        self.codes = list(codes)
+        self.values = values
+        self.index = {c: i for i, c in enumerate(self.codes)}
+
+    def column(self, name):
+        return self.values[name]
+
+    def row(self, code):
+        i = self.index.get(code)
+        if i is None:
+            return None
+        return {k: v[i].item() for k, v in self.values.items()}
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, as_of=np.array(self.as_of), codes=np.array(self.codes)
+                , **{'v.' + k: v for k, v in self.values.items()})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            values = {k[2:]: data[k] for k in data.files if k.startswith('v.')}
+            return cls(str(data['as_of']), [str(c) for c in data['codes']], values)
+
+
+class PrecomputeJob(object):
+    def __init__(self, name, codes, root, fields=('open', 'high', 'low', 'close', 'volume'), count=130
+            , period='1d', dividend_type='none'):
+        # tables are read on the next trading day, so bars are unadjusted: a front-adjusted table is rescaled on an
+        # ex-dividend day and no longer matches that day's prices
+        self.name = name
+        self.codes = list(codes)
+        self.directory = os.path.join(root, name)
+        self.fields = list(fields)
+        self.count = count
+        self.period = period
+        self.dividend_type = dividend_type
+        self.indicators = []
+
+    def register(self, name, func):
+        # func(bars) -> one value per code; func may also return a dict of named columns (name is then unused)
+        self.indicators.append((name, func))
+
+    def path(self, as_of):
+        return os.path.join(self.directory, as_of + '.npz')
+
+    def bars(self, data, before=None):
+        # get_market_data_ex result -> {field: (codes x count) matrix}, each code right-aligned on its own bars
+        # before: drop bars on or after this day (e.g. today's unfinished bar in the morning)
+        result = {f: np.full((len(self.codes), self.count), np.nan) for f in self.fields}
+        for i, code in enumerate(self.codes):
+            df = data.get(code)
+            if df is None or df.empty:
+                continue
+            if before is not None:
+                df = df[[bar_day(d) < before for d in df.index]]
+            df = df.iloc[-self.count:]
+            if df.empty:
+                continue
+            for f in self.fields:
+                if f in df:
+                    result[f][i, self.count - len(df):] = np.asarray(df[f].values, dtype=float)
+        return result
+
+    def compute(self, bars):
+        values = {}
+        for name, func in self.indicators:
+            result = func(bars)
+            if isinstance(result, dict):
+                values.update({k: np.asarray(v) for k, v in result.items()})
+            else:
+                values[name] = np.asarray(result)
+        return values
+
+    def run_with(self, fetch, trading_day=None):
+        # fetch(fields, codes, period, end_time, count, dividend_type) -> get_market_data_ex style dict
+        trading_day = trading_day or time.strftime('%Y%m%d')
+        data = fetch(self.fields, self.codes, self.period, trading_day, self.count, self.dividend_type)
+        days = [bar_day(df.index[-1]) for df in data.values() if df is not None and not df.empty]
+        if not days:
+            return None, data
+        as_of = max(days)
+        table = DailyTable(as_of, self.codes, self.compute(self.bars(data)))
+        table.save(self.path(as_of))
+        return table, data
+
+    def run(self, ContextInfo, trading_day=None):
+        # after the close: bars up to and including trading_day are final
+        def fetch(fields, codes, period, end_time, count, dividend_type):
+            return ContextInfo.get_market_data_ex(fields, codes, period=period, end_time=end_time, count=count
+                , dividend_type=dividend_type)
+        return self.run_with(fetch, trading_day)
+
+    def run_standalone(self, trading_day=None):
+        # outside the strategy process, through the xtquant data client
+        from xtquant import xtdata
+
+        def fetch(fields, codes, period, end_time, count, dividend_type):
+            return xtdata.get_market_data_ex(fields, codes, period=period, end_time=end_time, count=count
+                , dividend_type=dividend_type)
+        return self.run_with(fetch, trading_day)
+
+    def load(self, as_of):
+        path = self.path(as_of)
+        if not os.path.exists(path):
+            return None
+        return DailyTable.load(path)
+
+    def load_previous(self, ContextInfo, trading_day):
+        # the table computed after the close of the trading day before trading_day; None when that run is missing,
+        # so callers never trade on an older table
+        if not self.codes:
+            return None
+        as_of = previous_trading_day(ContextInfo, trading_day, self.codes[0])
+        return self.load(as_of) if as_of else None
+
+    def schedule(self, ContextInfo, func, time_str='153000', name=''):
+        # run func(ContextInfo) every day at time_str, starting today
+        time_point = datetime.datetime.strptime(time.strftime('%Y%m%d') + time_str, '%Y%m%d%H%M%S')
+        return ContextInfo.schedule_run(func, time_point, 0, datetime.timedelta(days=1), name or self.name)
@@ -0,0 +1,317 @@
+#coding:utf-8
+
+# Helpers fed by subscribe_whole_quote pushes.
+# TriggerEngine keeps per-code price conditions in flat arrays; each push updates the last prices of the pushed
+# codes and evaluates every condition in one vectorized pass, calling back only the triggers that fired.
+# TickSnapshot turns a get_full_tick result into aligned numpy columns, reusing its buffers between calls.
+# PriceCache keeps the latest pushed price and running day bar per code, so price lookups are memory reads.
+
+import time
+import itertools
+import traceback
+import numpy as np
+
+TRIGGER_BELOW = 1       # price <= level
+TRIGGER_ABOVE = 2       # price >= level
+TRIGGER_CROSS = 3       # previous and current price on different sides of level (either direction)
+
+
+def tick_price(tick):
+    price = tick.get('lastPrice', 0)
+    return price if price and price > 0 else np.nan
+
+
+class Trigger(object):
+    def __init__(self, trigger_id, code, kind, level, callback, tag=None, once=True):
+        self.trigger_id = trigger_id
+        self.code = code
+        self.kind = kind
+        self.level = level
+        self.callback = callback
+        self.tag = tag
+        self.once = once
+        self.active = True
+        self.fired_price = None
+        self.fired_count = 0
+
+
+class TriggerEngine(object):
+    def __init__(self):
+        self.codes = []
+        self.index = {}
+        self.price = np.empty(0)
+        self.prev_price = np.empty(0)
+        self.triggers = {}
+        self.ids = itertools.count(1)
+        self._arrays = None
+
+    def _row(self, code):
+        i = self.index.get(code)
+        if i is None:
+            i = len(self.codes)
+            self.codes.append(code)
+            self.index[code] = i
+            self.price = np.append(self.price, np.nan)
+            self.prev_price = np.append(self.prev_price, np.nan)
+        return i
+
+    def add(self, code, kind, level, callback, tag=None, once=True):
+        # callback(trigger, price); once triggers are removed before their callback runs
+        self._row(code)
+        trigger = Trigger(next(self.ids), code, kind, float(level), callback, tag, once)
+        self.triggers[trigger.trigger_id] = trigger
+        self._arrays = None
+        return trigger
+
+    def below(self, code, level, callback, **kwargs):
+        return self.add(code, TRIGGER_BELOW, level, callback, **kwargs)
+
+    def above(self, code, level, callback, **kwargs):
+        return self.add(code, TRIGGER_ABOVE, level, callback, **kwargs)
+
+    def cross(self, code, level, callback, **kwargs):
+        return self.add(code, TRIGGER_CROSS, level, callback, **kwargs)
+
+    def percent(self, code, base, pct, callback, **kwargs):
+        # fires once the price moved pct (e.g. -0.03) away from base; negative pct watches drops, positive rises
+        kind = TRIGGER_BELOW if pct < 0 else TRIGGER_ABOVE
+        return self.add(code, kind, base * (1 + pct), callback, **kwargs)
+
+    def add_many(self, codes, kind, levels, callback, tag=None, once=True):
+        # one trigger per code; NaN levels are skipped
+        levels = np.broadcast_to(np.asarray(levels, dtype=float), (len(codes),))
+        return [self.add(code, kind, level, callback, tag, once) for code, level in zip(codes, levels)
+            if np.isfinite(level)]
+
+    def percent_many(self, codes, bases, pcts, callback, tag=None, once=True):
+        bases = np.asarray(bases, dtype=float)
+        pcts = np.broadcast_to(np.asarray(pcts, dtype=float), bases.shape)
+        levels = bases * (1 + pcts)
+        result = []
+        for kind, mask in ((TRIGGER_BELOW, pcts < 0), (TRIGGER_ABOVE, pcts >= 0)):
+            if mask.any():
+                result += self.add_many([c for c, m in zip(codes, mask) if m], kind, levels[mask], callback, tag, once)
+        return result
+
+    def remove(self, trigger):
+        trigger.active = False
+        if self.triggers.pop(trigger.trigger_id, None) is not None:
+            self._arrays = None
+
+    def clear(self, code=None, tag=None):
+        for trigger in list(self.triggers.values()):
+            if (code is None or trigger.code == code) and (tag is None or trigger.tag == tag):
+                self.remove(trigger)
+
+    def find(self, code=None, tag=None):
+        return [t for t in self.triggers.values()
+            if (code is None or t.code == code) and (tag is None or t.tag == tag)]
+
+    def _build(self):
+        if self._arrays is None:
+            objs = list(self.triggers.values())
+            self._arrays = (
+                objs,
+                np.array([self.index[t.code] for t in objs], dtype=np.int64),
+                np.array([t.kind for t in objs], dtype=np.int8),
+                np.array([t.level for t in objs], dtype=float),
+            )
+        return self._arrays
+
+    def update(self, codes, prices):
+        # -> bool mask over self.codes of the rows that received a valid price
+        updated = np.zeros(len(self.codes), dtype=bool)
+        for code, price in zip(codes, prices):
+            i = self.index.get(code)
+            if i is not None and price == price:
+                self.prev_price[i] = self.price[i]
+                self.price[i] = price
+                updated[i] = True
+        return updated
+
+    def evaluate(self, updated=None):
+        objs, rows, kinds, levels = self._build()
+        if not objs:
+            return []
+        p = self.price[rows]
+        q = self.prev_price[rows]
+        with np.errstate(invalid='ignore'):
+            hit = (((kinds == TRIGGER_BELOW) & (p <= levels))
+                | ((kinds == TRIGGER_ABOVE) & (p >= levels))
+                | ((kinds == TRIGGER_CROSS) & (((q < levels) & (p >= levels)) | ((q > levels) & (p <= levels)))))
+        if updated is not None:
+            hit &= updated[rows]
+        fired = [objs[k] for k in np.flatnonzero(hit)]
+        for trigger in fired:
+            if trigger.once:
+                self.remove(trigger)
+        for trigger in fired:
+            price = self.price[self.index[trigger.code]]
+            trigger.fired_price = price
+            trigger.fired_count += 1
+            try:
+                trigger.callback(trigger, price)
+            except Exception:
+                traceback.print_exc()
+        return fired
+
+    def on_quote(self, datas):
+        # subscribe_whole_quote push: {code: tick dict}
+        codes = [code for code in datas if code in self.index]
+        if not codes:
+            return []
+        updated = self.update(codes, [tick_price(datas[code]) for code in codes])
+        return self.evaluate(updated)
+
+
+TICK_FIELDS = ('lastPrice', 'open', 'high', 'low', 'lastClose', 'volume', 'amount', 'pvolume', 'openInt')
+TICK_LEVEL_FIELDS = ('bidPrice', 'askPrice', 'bidVol', 'askVol')
+_NO_TICK = {}
+
+
+def _levels(values, n):
+    if values is not None and len(values) == n:
+        return values
+    values = list(values or ())
+    if len(values) < n:
+        values += [np.nan] * (n - len(values))
+    return values[:n]
+
+
+class TickSnapshot(object):
+    # columns are overwritten in place by the next refresh; copy them to keep a snapshot
+    def __init__(self, fields=TICK_FIELDS, level_fields=TICK_LEVEL_FIELDS, levels=5):
+        self.fields = list(fields)
+        self.level_fields = list(level_fields)
+        self.levels = levels
+        self.codes = []
+        self.code_array = np.empty(0, dtype=object)
+        self.index = {}
+        self.columns = {}
+        self.valid = np.empty(0, dtype=bool)
+        self.timetag = np.empty(0, dtype='U23')
+
+    def _resize(self, codes):
+        if codes == self.codes and self.columns:
+            return
+        n = len(codes)
+        self.codes = list(codes)
+        self.code_array = np.array(self.codes, dtype=object)
+        self.index = {c: i for i, c in enumerate(self.codes)}
+        self.valid = np.zeros(n, dtype=bool)
+        self.timetag = np.empty(n, dtype='U23')
+        self.columns = {f: np.empty(n) for f in self.fields}
+        self.columns.update({f: np.empty((n, self.levels)) for f in self.level_fields})
+
+    def fill(self, ticks, codes=None):
+        # ticks: get_full_tick result {code: tick dict}; codes fixes the row order (default: order of ticks)
+        codes = list(ticks) if codes is None else list(codes)
+        self._resize(codes)
+        rows = [ticks.get(c) or _NO_TICK for c in codes]
+        self.valid[...] = [tick is not _NO_TICK for tick in rows]
+        self.timetag[...] = [tick.get('timetag', '') for tick in rows]
+        for f in self.fields:
+            self.columns[f][...] = [tick.get(f, np.nan) for tick in rows]
+        n = self.levels
+        for f in self.level_fields:
+            if rows:
+                self.columns[f][...] = [_levels(tick.get(f), n) for tick in rows]
+        return self
+
+    def refresh(self, get_full_tick, codes=None):
+        # codes: instruments or market codes such as ['SH', 'SZ']; rows follow the codes returned
+        ticks = get_full_tick(list(codes or self.codes))
+        return self.fill(ticks)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def column(self, name):
+        return self.columns[name]
+
+    def rows(self, codes):
+        # row numbers of codes, -1 for codes not in the snapshot
+        return np.array([self.index.get(c, -1) for c in codes], dtype=np.int64)
+
+    def subset(self, codes, names=None):
+        # {name: column} for codes in the given order; missing codes read as NaN
+        rows = self.rows(codes)
+        found = rows >= 0
+        result = {}
+        for name in names or list(self.columns):
+            column = self.columns[name]
+            values = np.full((len(rows),) + column.shape[1:], np.nan)
+            values[found] = column[rows[found]]
+            result[name] = values
+        return result
+
+    def select(self, mask):
+        # codes of the rows where mask holds, e.g. snapshot.select(snapshot['lastPrice'] > snapshot['lastClose'])
+        return self.code_array[np.asarray(mask, dtype=bool) & self.valid].tolist()
+
+
+CACHE_FIELDS = ('lastPrice', 'open', 'high', 'low', 'volume', 'amount')
+
+
+class PriceCache(object):
+    def __init__(self, fields=CACHE_FIELDS, capacity=1024):
+        self.fields = list(fields)
+        self.codes = []
+        self.index = {}
+        self.columns = {f: np.full(capacity, np.nan) for f in self.fields}
+        self.updated_at = np.zeros(capacity)
+
+    def _row(self, code):
+        i = self.index.get(code)
+        if i is None:
+            i = len(self.codes)
+            if i == len(self.updated_at):
+                for f in self.fields:
+                    self.columns[f] = np.append(self.columns[f], np.full(i, np.nan))
+                self.updated_at = np.append(self.updated_at, np.zeros(i))
+            self.codes.append(code)
+            self.index[code] = i
+        return i
+
+    def on_quote(self, datas):
+        # subscribe_whole_quote push or get_full_tick result: {code: tick dict}
+        now = time.time()
+        for code, tick in datas.items():
+            # a code without a valid price still gets a row, so it is not seeded again
+            i = self._row(code)
+            price = tick_price(tick)
+            if price != price:
+                continue
+            for f in self.fields:
+                self.columns[f][i] = tick.get(f, np.nan)
+            self.columns['lastPrice'][i] = price
+            self.updated_at[i] = now
+
+    def rows(self, codes):
+        return np.array([self.index.get(c, -1) for c in codes], dtype=np.int64)
+
+    def missing(self, codes):
+        return [c for c in codes if c not in self.index]
+
+    def get(self, codes, field='lastPrice'):
+        # NaN for codes never pushed
+        rows = self.rows(codes)
+        values = np.full(len(rows), np.nan)
+        found = rows >= 0
+        values[found] = self.columns[field][rows[found]]
+        return values
+
+    def prices(self, codes):
+        return self.get(codes, 'lastPrice')
+
+    def bars(self, codes):
+        # running day bar {field: array} for codes
+        return {f: self.get(codes, f) for f in self.fields}
+
+    def age(self, codes):
+        # seconds since the last push per code, inf for codes never pushed
+        rows = self.rows(codes)
+        ages = np.full(len(rows), np.inf)
+        found = rows >= 0
+        ages[found] = time.time() - self.updated_at[rows[found]]
+        return ages
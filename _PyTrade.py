@@ -0,0 +1,607 @@
+#coding:utf-8
+
+# Trading state kept inside the strategy process.
+# Books are seeded from get_trade_detail_data once, then updated by the terminal's trade callbacks
+# (deal_callback / order_callback / position_callback / account_callback) and reconciled periodically.
+
+import time
+import threading
+import collections
+from concurrent import futures
+import numpy as np
+
+# m_nOffsetFlag on stock deals/orders: 48 buy(open), 49 sell(close)
+OFFSET_OPEN = 48
+OFFSET_CLOSE = 49
+
+# m_nDirection on deals/orders: 48 buy, 49 sell
+DIRECTION_BUY = 48
+DIRECTION_SELL = 49
+
+# passorder opTypes on the buy side; every other opType sells
+# stock 23 buy, 33 margin buy; futures 0 open long, 4/5 close short, 8/9 close short preferring today / yesterday,
+# 12/13/14 buy-side combined instructions
+BUY_OP_TYPES = frozenset((0, 4, 5, 8, 9, 12, 13, 14, 23, 33))
+
+# m_nOrderStatus
+ORDER_UNREPORTED = 48
+ORDER_WAIT_REPORTING = 49
+ORDER_REPORTED = 50
+ORDER_REPORTED_CANCEL = 51
+ORDER_PARTSUCC_CANCEL = 52
+ORDER_PART_CANCEL = 53
+ORDER_CANCELED = 54
+ORDER_PART_SUCC = 55
+ORDER_SUCCEEDED = 56
+ORDER_JUNK = 57
+ORDER_FINAL_STATUS = (ORDER_PART_CANCEL, ORDER_CANCELED, ORDER_SUCCEEDED, ORDER_JUNK)
+
+# account types PositionBook can follow: one long position per code, cash moves by the traded amount
+STOCK_ACCOUNT_TYPES = ('STOCK', 'CREDIT')
+
+POSITION_FIELDS = {
+    'volume': 'm_nVolume',
+    'can_use_volume': 'm_nCanUseVolume',
+    'open_price': 'm_dOpenPrice',
+    'last_price': 'm_dLastPrice',
+    'market_value': 'm_dMarketValue',
+}
+ACCOUNT_FIELDS = {
+    'balance': 'm_dBalance',
+    'available': 'm_dAvailable',
+    'market_value': 'm_dInstrumentValue',
+    'frozen_cash': 'm_dFrozenCash',
+}
+
+
+def instrument_code(obj):
+    return obj.m_strInstrumentID + '.' + obj.m_strExchangeID
+
+
+def is_buy(obj):
+    # side from m_nDirection; the offset flag is only a fallback for objects without a direction
+    direction = getattr(obj, 'm_nDirection', None)
+    if direction in (DIRECTION_BUY, DIRECTION_SELL):
+        return direction == DIRECTION_BUY
+    return getattr(obj, 'm_nOffsetFlag', OFFSET_OPEN) == OFFSET_OPEN
+
+
+def op_side(op_type):
+    return 'buy' if op_type in BUY_OP_TYPES else 'sell'
+
+
+def _read(obj, fields):
+    return {k: getattr(obj, attr, 0) for k, attr in fields.items()}
+
+
+class PositionBook(object):
+    def __init__(self, account_id, account_type, query, reconcile_interval=60, t0=False, bar_key=None):
+        # query is get_trade_detail_data; reconcile_interval 0 re-queries once per bar_key() (barpos in backtests),
+        # or on every read without a bar_key
+        # futures and options hold long and short legs per code and move margin rather than cash, which this book
+        # does not model
+        if account_type.upper() not in STOCK_ACCOUNT_TYPES:
+            raise ValueError('PositionBook only follows stock accounts, not %s' % account_type)
+        self.account_id = account_id
+        self.account_type = account_type
+        self.query = query
+        self.reconcile_interval = reconcile_interval
+        self.t0 = t0
+        self.bar_key = bar_key
+        self.positions = {}
+        self.account = {}
+        self.frozen = {}
+        self.reserved = {}
+        self.deal_ids = set()
+        self.reconciled_at = None
+        self.reconciled_bar = None
+        self.version = 0
+        self._views = {}
+
+    def _mine(self, obj):
+        account_id = getattr(obj, 'm_strAccountID', '')
+        return not account_id or account_id == self.account_id
+
+    def _changed(self):
+        self.version += 1
+        self._views = {}
+
+    def reconcile(self):
+        positions = {}
+        for obj in self.query(self.account_id, self.account_type, 'POSITION'):
+            positions[instrument_code(obj)] = _read(obj, POSITION_FIELDS)
+        accounts = self.query(self.account_id, self.account_type, 'ACCOUNT')
+        diff = set(k for k in set(positions) | set(self.positions)
+            if positions.get(k, {}).get('volume') != self.positions.get(k, {}).get('volume'))
+        self.positions = positions
+        if accounts:
+            self.account = _read(accounts[0], ACCOUNT_FIELDS)
+        # the snapshot already nets out volume frozen by open sell orders
+        for item in self.frozen.values():
+            item[2] = True
+        self.reconciled_at = time.time()
+        self.reconciled_bar = self.bar_key() if self.bar_key is not None else None
+        self._changed()
+        return diff
+
+    def maybe_reconcile(self):
+        if self.reconciled_at is None:
+            self.reconcile()
+        elif self.reconcile_interval == 0 and self.bar_key is not None:
+            if self.bar_key() != self.reconciled_bar:
+                self.reconcile()
+        elif time.time() - self.reconciled_at >= self.reconcile_interval:
+            self.reconcile()
+
+    def _position(self, code):
+        pos = self.positions.get(code)
+        if pos is None:
+            pos = {k: 0 for k in POSITION_FIELDS}
+            self.positions[code] = pos
+        return pos
+
+    def on_deal(self, deal):
+        if not self._mine(deal):
+            return
+        deal_id = getattr(deal, 'm_strTradeID', '')
+        if deal_id:
+            if deal_id in self.deal_ids:
+                return
+            self.deal_ids.add(deal_id)
+        code = instrument_code(deal)
+        volume = deal.m_nVolume
+        amount = getattr(deal, 'm_dTradeAmount', 0) or volume * getattr(deal, 'm_dPrice', 0)
+        pos = self._position(code)
+        if is_buy(deal):
+            pos['volume'] += volume
+            if self.t0:
+                pos['can_use_volume'] += volume
+            # cash reserved by the order callback pays first; only the excess (or an unseen order) reduces available
+            reserved = self.reserved.get(getattr(deal, 'm_strOrderSysID', ''))
+            spent = 0.0
+            if reserved is not None:
+                spent = min(amount, reserved[0])
+                reserved[0] -= spent
+            self.account['available'] = self.account.get('available', 0) - (amount - spent)
+        else:
+            pos['volume'] -= volume
+            frozen = self.frozen.get(getattr(deal, 'm_strOrderSysID', ''))
+            if frozen is not None:
+                frozen[1] -= volume
+            else:
+                pos['can_use_volume'] -= volume
+            self.account['available'] = self.account.get('available', 0) + amount
+            if pos['volume'] <= 0:
+                del self.positions[code]
+        self._changed()
+
+    def on_order(self, order):
+        if not self._mine(order):
+            return
+        order_id = getattr(order, 'm_strOrderSysID', '')
+        if not order_id:
+            return
+        if is_buy(order):
+            self._reserve(order, order_id)
+            return
+        status = order.m_nOrderStatus
+        frozen = self.frozen.get(order_id)
+        if frozen is None and status not in ORDER_FINAL_STATUS:
+            remaining = order.m_nVolumeTotalOriginal - order.m_nVolumeTraded
+            self.frozen[order_id] = [instrument_code(order), remaining, False]
+            self._position(instrument_code(order))['can_use_volume'] -= remaining
+            self._changed()
+        elif frozen is not None and status in ORDER_FINAL_STATUS:
+            code, remaining, reconciled = self.frozen.pop(order_id)
+            if remaining > 0 and not reconciled and code in self.positions:
+                self.positions[code]['can_use_volume'] += remaining
+            self._changed()
+
+    def _reserve(self, order, order_id):
+        # open buy orders hold cash at their limit price until filled or finished; the unused rest is released
+        status = order.m_nOrderStatus
+        reserved = self.reserved.get(order_id)
+        if reserved is None and status not in ORDER_FINAL_STATUS:
+            remaining = order.m_nVolumeTotalOriginal - order.m_nVolumeTraded
+            amount = remaining * getattr(order, 'm_dLimitPrice', 0)
+            self.reserved[order_id] = [amount]
+            self.account['available'] = self.account.get('available', 0) - amount
+            self._changed()
+        elif reserved is not None and status in ORDER_FINAL_STATUS:
+            self.account['available'] = self.account.get('available', 0) + self.reserved.pop(order_id)[0]
+            self._changed()
+
+    def on_position(self, position):
+        if not self._mine(position):
+            return
+        code = instrument_code(position)
+        record = _read(position, POSITION_FIELDS)
+        if record['volume'] > 0:
+            self.positions[code] = record
+        else:
+            self.positions.pop(code, None)
+        for item in self.frozen.values():
+            if item[0] == code:
+                item[2] = True
+        self._changed()
+
+    def on_account(self, account):
+        if not self._mine(account):
+            return
+        self.account = _read(account, ACCOUNT_FIELDS)
+        self._changed()
+
+    def volume(self, code, field='volume'):
+        self.maybe_reconcile()
+        pos = self.positions.get(code)
+        return 0 if pos is None else pos[field]
+
+    def holdings(self, field='volume'):
+        # code -> value for positions with a positive value, rebuilt only after a change
+        self.maybe_reconcile()
+        view = self._views.get(field)
+        if view is None:
+            view = {k: v[field] for k, v in self.positions.items() if v[field] > 0}
+            self._views[field] = view
+        return view
+
+    def arrays(self, codes, field='volume'):
+        self.maybe_reconcile()
+        return np.array([self.positions.get(c, {}).get(field, 0) for c in codes], dtype=float)
+
+    def asset(self, field='balance'):
+        self.maybe_reconcile()
+        return self.account.get(field, 0)
+
+
+class OrderIdGenerator(object):
+    # strictly increasing userOrderIds, unique within a process and across restarts
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self.base = int(time.time() * 1000) * 1000
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def next(self, prefix=None):
+        with self.lock:
+            self.seq += 1
+            return '%s%d' % (self.prefix if prefix is None else prefix, self.base + self.seq)
+
+
+# one sequence for every trader in the process, so traders created in the same millisecond never share an id
+ORDER_IDS = OrderIdGenerator()
+
+
+class OrderTicket(object):
+    def __init__(self, user_order_id, order):
+        self.user_order_id = user_order_id
+        self.order = order
+        self.future = futures.Future()
+        self.submitted_at = None
+        self.acked_at = None
+
+    @property
+    def latency(self):
+        # seconds from passorder to the first order callback
+        if self.submitted_at is None or self.acked_at is None:
+            return None
+        return self.acked_at - self.submitted_at
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+
+class BasketTrader(object):
+    def __init__(self, account_id, strategy_name, passorder, rate=20.0, burst=5, id_prefix='', manager=None
+            , confirm_on_send=False):
+        # rate: orders per second, burst: orders sent back to back before throttling
+        # confirm_on_send: resolve tickets as soon as passorder returns (backtests fire no order callbacks)
+        self.account_id = account_id
+        self.strategy_name = strategy_name
+        self.manager = manager
+        self.passorder = passorder
+        self.rate = rate
+        self.burst = burst
+        self.id_prefix = id_prefix
+        self.confirm_on_send = confirm_on_send
+        self.tokens = float(burst)
+        self.refilled_at = time.time()
+        self.queue = collections.deque()
+        self.tickets = {}
+        self.pending = {}
+
+    def _take(self, block):
+        if not self.rate:
+            return True
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+        self.refilled_at = now
+        if self.tokens < 1:
+            if not block:
+                return False
+            time.sleep((1 - self.tokens) / self.rate)
+            self.tokens = 1.0
+            self.refilled_at = time.time()
+        self.tokens -= 1
+        return True
+
+    def _send(self, ticket, ContextInfo):
+        order = ticket.order
+        ticket.submitted_at = time.time()
+        if self.manager is not None:
+            self.manager.on_submit(ticket.user_order_id, order, self.account_id)
+        try:
+            self.passorder(order.get('op_type', 23), order.get('order_type', 1101), self.account_id, order['code']
+                , order.get('pr_type', 14), order.get('price', -1), order['volume'], self.strategy_name
+                , order.get('quick_trade', 1), ticket.user_order_id, ContextInfo)
+        except Exception as e:
+            self.pending.pop(ticket.user_order_id, None)
+            ticket.future.set_exception(e)
+            if self.manager is not None:
+                self.manager.on_order_error(ticket, str(e))
+            return
+        if self.confirm_on_send:
+            self.pending.pop(ticket.user_order_id, None)
+            ticket.acked_at = time.time()
+            ticket.future.set_result(None)
+            if self.manager is not None:
+                self.manager.on_sent(ticket.user_order_id)
+
+    def submit(self, orders, ContextInfo, block=False):
+        # orders: dicts with code, volume and optional price, op_type(23 buy/24 sell), pr_type, order_type
+        # sends what the rate allows now and leaves the rest to pump() (a timer or the next bar);
+        # block=True sleeps until the whole basket is sent
+        tickets = []
+        for order in orders:
+            ticket = OrderTicket(ORDER_IDS.next(self.id_prefix), order)
+            self.tickets[ticket.user_order_id] = ticket
+            self.pending[ticket.user_order_id] = ticket
+            self.queue.append(ticket)
+            tickets.append(ticket)
+        self.pump(ContextInfo, block)
+        return tickets
+
+    def pump(self, ContextInfo, block=False):
+        while self.queue and self._take(block):
+            self._send(self.queue.popleft(), ContextInfo)
+        return len(self.queue)
+
+    def on_order(self, order):
+        ticket = self.pending.pop(getattr(order, 'm_strRemark', ''), None)
+        if ticket is not None:
+            ticket.acked_at = time.time()
+            ticket.future.set_result(order)
+
+    def on_order_error(self, args, message):
+        user_order_id = getattr(args, 'userOrderId', '') or getattr(args, 'remark', '')
+        ticket = self.pending.pop(user_order_id, None)
+        if ticket is not None:
+            ticket.acked_at = time.time()
+            ticket.future.set_exception(RuntimeError(message))
+
+    def latency(self):
+        values = [t.latency for t in self.tickets.values() if t.latency is not None]
+        if not values:
+            return {'count': 0, 'pending': len(self.pending)}
+        values = np.array(values)
+        return {'count': len(values), 'pending': len(self.pending), 'mean': values.mean()
+            , 'p95': np.percentile(values, 95), 'max': values.max()}
+
+
+ORDER_SUBMITTED = 'submitted'
+ORDER_PARTIALLY_FILLED = 'partially_filled'
+ORDER_FILLED = 'filled'
+ORDER_CANCELLED = 'cancelled'
+ORDER_REJECTED = 'rejected'
+# handed to the backtest engine, which sends no order or deal callbacks
+ORDER_SENT = 'sent'
+ORDER_DONE_STATES = (ORDER_FILLED, ORDER_CANCELLED, ORDER_REJECTED, ORDER_SENT)
+
+
+def order_state(status, traded):
+    if status == ORDER_SUCCEEDED:
+        return ORDER_FILLED
+    if status in (ORDER_PART_CANCEL, ORDER_CANCELED):
+        return ORDER_CANCELLED
+    if status == ORDER_JUNK:
+        return ORDER_REJECTED
+    return ORDER_PARTIALLY_FILLED if traded > 0 else ORDER_SUBMITTED
+
+
+def price_level(price):
+    return round(float(price), 4)
+
+
+class ManagedOrder(object):
+    __slots__ = ('user_order_id', 'account_id', 'account_type', 'code', 'side', 'price', 'volume'
+        , 'traded', 'traded_amount', 'state', 'order_sys_id', 'message', 'submitted_at', 'updated_at')
+
+    def __init__(self, user_order_id, account_id, account_type, code, side, price, volume):
+        self.user_order_id = user_order_id
+        self.account_id = account_id
+        self.account_type = account_type
+        self.code = code
+        self.side = side
+        self.price = price
+        self.volume = volume
+        self.traded = 0
+        self.traded_amount = 0.0
+        self.state = ORDER_SUBMITTED
+        self.order_sys_id = ''
+        self.message = ''
+        self.submitted_at = self.updated_at = time.time()
+
+    @property
+    def remaining(self):
+        return 0 if self.state in ORDER_DONE_STATES else max(self.volume - self.traded, 0)
+
+    @property
+    def average_price(self):
+        return self.traded_amount / self.traded if self.traded else 0.0
+
+    @property
+    def key(self):
+        return (self.code, self.side, price_level(self.price))
+
+
+class OrderManager(object):
+    # every order sent through the context, keyed by userOrderId and indexed by open (code, side, price level)
+    def __init__(self, cancel=None, track_external=False):
+        self.cancel_func = cancel
+        self.track_external = track_external
+        self.orders = {}
+        self.sys_ids = {}
+        self.open_by_level = collections.defaultdict(set)
+        self.open_by_code = collections.defaultdict(set)
+        self.deal_ids = set()
+        self.fills = collections.deque()
+        self.fill_listeners = []
+
+    def _index(self, order):
+        self.open_by_level[order.key].add(order.user_order_id)
+        self.open_by_code[order.code].add(order.user_order_id)
+
+    def _unindex(self, order):
+        for index, key in ((self.open_by_level, order.key), (self.open_by_code, order.code)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(order.user_order_id)
+                if not ids:
+                    del index[key]
+
+    def _set_state(self, order, state):
+        if order.state in ORDER_DONE_STATES:
+            return
+        order.state = state
+        order.updated_at = time.time()
+        if state in ORDER_DONE_STATES:
+            self._unindex(order)
+
+    def on_submit(self, user_order_id, order, account_id, account_type='STOCK'):
+        side = op_side(order.get('op_type', 23))
+        managed = ManagedOrder(user_order_id, account_id, order.get('account_type', account_type), order['code']
+            , side, order.get('price', -1), order['volume'])
+        self.orders[user_order_id] = managed
+        self._index(managed)
+        return managed
+
+    def _lookup(self, obj):
+        user_order_id = getattr(obj, 'm_strRemark', '')
+        if user_order_id in self.orders:
+            return self.orders[user_order_id]
+        user_order_id = self.sys_ids.get(getattr(obj, 'm_strOrderSysID', ''))
+        return self.orders.get(user_order_id)
+
+    def _external(self, obj):
+        user_order_id = getattr(obj, 'm_strRemark', '') or getattr(obj, 'm_strOrderSysID', '')
+        if not self.track_external or not user_order_id:
+            return None
+        managed = ManagedOrder(user_order_id, getattr(obj, 'm_strAccountID', ''), 'STOCK', instrument_code(obj)
+            , 'buy' if is_buy(obj) else 'sell', getattr(obj, 'm_dLimitPrice', 0)
+            , getattr(obj, 'm_nVolumeTotalOriginal', 0))
+        self.orders[user_order_id] = managed
+        self._index(managed)
+        return managed
+
+    def on_order(self, obj):
+        order = self._lookup(obj) or self._external(obj)
+        if order is None:
+            return
+        sys_id = getattr(obj, 'm_strOrderSysID', '')
+        if sys_id and not order.order_sys_id:
+            order.order_sys_id = sys_id
+            self.sys_ids[sys_id] = order.user_order_id
+        traded = getattr(obj, 'm_nVolumeTraded', 0)
+        order.message = getattr(obj, 'm_strCancelInfo', '') or order.message
+        was_open = order.state not in ORDER_DONE_STATES
+        self._set_state(order, order_state(obj.m_nOrderStatus, max(traded, order.traded)))
+        if was_open and order.state in ORDER_DONE_STATES and order.traded:
+            # cancelled after a partial fill: no deal follows, so listeners get the close as an empty fill
+            self._emit_fill(order, 0.0, 0)
+
+    def on_deal(self, obj):
+        deal_id = getattr(obj, 'm_strTradeID', '')
+        if deal_id:
+            if deal_id in self.deal_ids:
+                return
+            self.deal_ids.add(deal_id)
+        order = self._lookup(obj)
+        if order is None:
+            return
+        volume = obj.m_nVolume
+        price = getattr(obj, 'm_dPrice', 0)
+        order.traded += volume
+        order.traded_amount += volume * price
+        if order.state not in ORDER_DONE_STATES:
+            self._set_state(order, ORDER_FILLED if order.traded >= order.volume else ORDER_PARTIALLY_FILLED)
+        self._emit_fill(order, price, volume)
+
+    def _emit_fill(self, order, price, volume):
+        fill = {'user_order_id': order.user_order_id, 'code': order.code, 'side': order.side
+            , 'price': price, 'volume': volume, 'remaining': order.remaining, 'state': order.state, 'time': time.time()}
+        self.fills.append(fill)
+        for listener in self.fill_listeners:
+            listener(fill)
+
+    def on_order_error(self, args, message):
+        user_order_id = getattr(args, 'user_order_id', '') or getattr(args, 'userOrderId', '') or getattr(args, 'remark', '')
+        order = self.orders.get(user_order_id)
+        if order is not None:
+            order.message = message
+            self._set_state(order, ORDER_REJECTED)
+
+    def on_sent(self, user_order_id):
+        # backtest orders are settled by the engine within the bar and never stay open
+        order = self.orders.get(user_order_id)
+        if order is not None:
+            self._set_state(order, ORDER_SENT)
+
+    def add_fill_listener(self, listener):
+        self.fill_listeners.append(listener)
+
+    def drain_fills(self):
+        # fills received since the last call, oldest first
+        fills = list(self.fills)
+        self.fills.clear()
+        return fills
+
+    def get(self, user_order_id):
+        return self.orders.get(user_order_id)
+
+    def open_orders(self, code=None, side=None, price=None):
+        if code is not None and side is not None and price is not None:
+            ids = self.open_by_level.get((code, side, price_level(price)), ())
+        elif code is not None:
+            ids = self.open_by_code.get(code, ())
+        else:
+            ids = [k for v in self.open_by_code.values() for k in v]
+        orders = [self.orders[k] for k in ids]
+        if side is not None and price is None:
+            orders = [o for o in orders if o.side == side]
+        return orders
+
+    def level_volume(self, code, side, price):
+        # unfilled volume resting at one price level
+        return sum(self.orders[k].remaining for k in self.open_by_level.get((code, side, price_level(price)), ()))
+
+    def levels(self, code, side, account_id=None):
+        result = {}
+        for k in self.open_by_code.get(code, ()):
+            order = self.orders[k]
+            if order.side == side and (account_id is None or order.account_id == account_id):
+                level = price_level(order.price)
+                result[level] = result.get(level, 0) + order.remaining
+        return result
+
+    def cancel(self, user_order_id, ContextInfo):
+        order = self.orders.get(user_order_id)
+        if order is None or order.state in ORDER_DONE_STATES or not order.order_sys_id:
+            return False
+        return self.cancel_func(order.order_sys_id, order.account_id, order.account_type, ContextInfo)
+
+    def cancel_level(self, code, side, price, ContextInfo, account_id=None):
+        return [k for k in list(self.open_by_level.get((code, side, price_level(price)), ()))
+            if (account_id is None or self.orders[k].account_id == account_id) and self.cancel(k, ContextInfo)]
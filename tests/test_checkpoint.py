@@ -0,0 +1,101 @@
+#coding:utf-8
+
+import os
+
+import numpy as np
+
+from _PyCheckpoint import Checkpoint, decode, encode
+from _PyIndicator import IndicatorEngine
+
+
+class Holder(object):
+    def __init__(self, value=None):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+VALUES = {
+    'array': np.arange(6.0).reshape(2, 3),
+    'scalar': '20240105',
+    'mapping': {'600000.SH': 1.5, '000001.SZ': 2.5},
+    'table': {'600000.SH': {'ma5': 10.0, 'atr': 0.2}, '000001.SZ': {'ma5': 8.0, 'atr': 0.1}},
+    'list': ['a', 'b'],
+    'pickle': {'600000.SH': [1, 'x']},
+}
+
+
+def test_encode_picks_columnar_kinds():
+    for kind, value in VALUES.items():
+        encoded_kind, arrays = encode(value)
+        assert encoded_kind == kind
+        decoded = decode(encoded_kind, arrays)
+        if kind == 'array':
+            np.testing.assert_array_equal(decoded, value)
+        else:
+            assert decoded == value
+
+
+def test_save_and_restore_by_trading_day(tmp_path):
+    path = str(tmp_path / 'state.npz')
+    holders = {}
+    checkpoint = Checkpoint(path)
+    for kind, value in VALUES.items():
+        holders[kind] = Holder(value)
+        checkpoint.register(kind, holders[kind].get, holders[kind].set, daily=kind == 'table')
+    assert checkpoint.save('20240105')
+    restored = {kind: Holder() for kind in VALUES}
+    fresh = Checkpoint(path)
+    for kind in VALUES:
+        fresh.register(kind, restored[kind].get, restored[kind].set, daily=kind == 'table')
+    assert sorted(fresh.restore('20240105')) == sorted(VALUES)
+    assert restored['table'].value == VALUES['table']
+    restored['table'].value = None
+    # the daily table belongs to another day now
+    assert 'table' not in fresh.restore('20240108')
+    assert restored['table'].value is None
+    assert Checkpoint(str(tmp_path / 'missing.npz')).restore('20240105') == []
+
+
+def test_maybe_save_writes_only_changes(tmp_path):
+    path = str(tmp_path / 'state.npz')
+    holder = Holder({'a': 1})
+    checkpoint = Checkpoint(path, interval=0)
+    checkpoint.register('h', holder.get, holder.set)
+    assert checkpoint.maybe_save('20240105')
+    assert not checkpoint.maybe_save('20240105')
+    holder.value = {'a': 2}
+    assert checkpoint.maybe_save('20240105')
+    slow = Checkpoint(path, interval=3600)
+    slow.register('h', holder.get, holder.set)
+    slow.checked_at = float('inf')
+    assert not slow.maybe_save('20240105')
+    slow.mark_dirty()
+    assert slow.maybe_save('20240105')
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_indicator_engine_round_trip(tmp_path):
+    rng = np.random.RandomState(4)
+    close = 10 + np.cumsum(rng.normal(0, 0.1, (2, 40)), axis=1)
+    dates = ['2024%04d' % (101 + i) for i in range(40)]
+    engine = IndicatorEngine(['a', 'b'])
+    engine.sync(dates[:30], close[:, :30])
+    checkpoint = Checkpoint(str(tmp_path / 'state.npz'))
+    checkpoint.register_object('engine', engine)
+    checkpoint.save('20240131')
+    restored = IndicatorEngine([])
+    fresh = Checkpoint(str(tmp_path / 'state.npz'))
+    fresh.register_object('engine', restored)
+    assert fresh.restore('20240201') == ['engine']
+    assert restored.codes == ['a', 'b'] and restored.date == dates[29]
+    # the live strategy re-syncs from the last committed date, which replaces that bar
+    restored.sync(dates[29:], close[:, 29:])
+    engine.sync(dates[29:], close[:, 29:])
+    assert restored.values()['count'].tolist() == [40, 40]
+    for name, v in engine.values().items():
+        np.testing.assert_allclose(restored.values()[name], v, equal_nan=True, err_msg=name)
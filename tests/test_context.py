@@ -0,0 +1,349 @@
+#coding:utf-8
+
+import copy
+import os
+
+import numpy as np
+
+import _PyContextInfo
+
+PyContext = getattr(_PyContextInfo, '__PyContext')
+
+
+class FakeContextInfo(object):
+    def __init__(self, barpos=0, do_back_test=True):
+        self.barpos = barpos
+        self.do_back_test = do_back_test
+        self.calls = []
+        self.subscriptions = {}
+        self.next_sub_id = 0
+        self.ticks = {}
+        self.bars = {}
+
+    def subscribe_whole_quote(self, code_list, callback):
+        self.next_sub_id += 1
+        self.subscriptions[self.next_sub_id] = (list(code_list), callback)
+        return self.next_sub_id
+
+    def unsubscribe_quote(self, sub_id):
+        self.subscriptions.pop(sub_id)
+
+    def get_full_tick(self, stock_code):
+        self.calls.append(('tick', list(stock_code)))
+        return {c: self.ticks[c] for c in stock_code if c in self.ticks}
+
+    def get_bar_timetag(self, index):
+        return 1704177000000 + index * 60000
+
+    def get_market_data2(self, fields, stock_code, period, start_time, end_time, count, dividend_type, fill_data
+            , subscribe):
+        self.calls.append(('bars', period, end_time, count, dividend_type))
+        return {c: [[end_time, self.bars[c]]] for c in stock_code if c in self.bars}
+
+    def get_risk_free_rate(self, index):
+        self.calls.append(index)
+        return 2.0 + index * 0.01
+
+
+def make_context(**kwargs):
+    return PyContext(FakeContextInfo(**kwargs))
+
+
+def test_risk_free_rate_series_fetches_each_bar_once():
+    ctx = make_context(barpos=10)
+    rates = ctx.get_risk_free_rate_series(3, 6)
+    np.testing.assert_allclose(rates, [2.03, 2.04, 2.05, 2.06])
+    assert ctx.context.calls == [3, 4, 5, 6]
+    # overlapping and later windows only query the bars not seen yet
+    rates = ctx.get_risk_free_rate_series(5, 12)
+    np.testing.assert_allclose(rates, 2.0 + np.arange(5, 13) * 0.01)
+    assert ctx.context.calls == [3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+
+
+def test_risk_free_rate_series_before_first_bar():
+    ctx = make_context(barpos=2)
+    rates = ctx.get_risk_free_rate_series(-2, 1)
+    assert np.isnan(rates[:2]).all()
+    np.testing.assert_allclose(rates[2:], [2.0, 2.01])
+    assert len(ctx.get_risk_free_rate_series(4, 3)) == 0
+
+
+def test_shared_cache_survives_bar_copies():
+    ctx = make_context(barpos=5)
+    ctx.get_risk_free_rate_series(0, 5)
+    copied = copy.deepcopy(ctx)
+    assert copied.z8sglma_shared is ctx.z8sglma_shared
+    copied.get_risk_free_rate_series(0, 5)
+    assert ctx.context.calls == [0, 1, 2, 3, 4, 5]
+
+
+def test_inference_executor_is_kept_per_name():
+    ctx = make_context()
+    assert ctx.get_inference_executor('m') is None
+    executor = ctx.get_inference_executor('m', object(), batch_size=8)
+    assert copy.deepcopy(ctx).get_inference_executor('m') is executor
+    assert executor.batch_size == 8
+    executor.shutdown()
+
+
+def test_live_inference_requests_are_flushed_by_one_timer():
+    import time
+    from _PyModel import InferenceExecutor
+    timers = []
+    for back_test in (True, False):
+        ctx = make_context(do_back_test=back_test)
+        ctx.schedule_run = lambda func, *args: timers.append((func, args[-1])) or len(timers)
+        executor = ctx.get_inference_executor('m', type('Model', (object,), {'predict': lambda self, x: x.sum(axis=1)})())
+        ctx.get_inference_executor('n', object())
+    assert [name for _, name in timers] == ['inference_pump']
+    delivered = []
+    executor.submit('a', [1.0, 2.0], lambda key, value: delivered.append((key, value)))
+    pump = timers[0][0]
+    deadline = time.time() + 5
+    while pump(ctx) and time.time() < deadline:
+        time.sleep(0.01)
+    assert delivered == [('a', 3.0)] and not executor.queue
+    executor.shutdown()
+
+
+def test_trade_callbacks_reach_every_listener():
+    ctx = make_context()
+    received = []
+
+    class Listener(object):
+        def on_deal(self, deal):
+            received.append(('deal', deal))
+
+        def on_order_error(self, args, message):
+            received.append(('order_error', args, message))
+
+    ctx.z8sglma_shared['trade_listeners'] = [Listener(), object()]
+    ctx.dispatch_trade_callback('deal', 'd1')
+    ctx.dispatch_trade_callback('order_error', 'args', 'message')
+    ctx.dispatch_trade_callback('position', 'p1')
+    assert received == [('deal', 'd1'), ('order_error', 'args', 'message')]
+
+
+def test_indicator_engine_is_kept_per_period():
+    ctx = make_context()
+    engine = ctx.get_indicator_engine('1d', ['a'])
+    assert ctx.get_indicator_engine('1d', ['b', 'a']) is engine
+    assert engine.codes == ['a', 'b']
+    assert ctx.get_indicator_engine('1m') is not engine
+
+
+def test_loggers_are_kept_per_name_and_mode(tmp_path):
+    ctx = make_context(do_back_test=True)
+    logger = ctx.get_logger('s', root=str(tmp_path))
+    assert ctx.get_logger('s') is logger
+    assert logger.directory == os.path.join(str(tmp_path), 'backtest', 's')
+    prod = ctx.get_logger('s', root=str(tmp_path), mode='prod')
+    assert prod is not logger
+    ctx.close_loggers()
+    assert logger.thread is None and prod.thread is None
+    assert ctx.z8sglma_shared.get('logger') is None
+
+
+def test_checkpoint_is_kept_per_name(tmp_path):
+    ctx = make_context()
+    checkpoint = ctx.get_checkpoint('s', path=str(tmp_path / 's.npz'), interval=5)
+    assert ctx.get_checkpoint('s') is checkpoint and checkpoint.interval == 5
+
+
+def test_precompute_job_is_kept_per_name(tmp_path):
+    ctx = make_context()
+    job = ctx.get_precompute_job('s', ['a'], root=str(tmp_path), count=30)
+    assert ctx.get_precompute_job('s') is job
+    assert job.count == 30 and job.directory == os.path.join(str(tmp_path), 's')
+
+
+def test_whole_quote_subscription_is_renewed_only_for_new_codes():
+    ctx = make_context()
+    engine = ctx.get_trigger_engine()
+    fired = []
+    engine.below('a.SH', 9.5, lambda trigger, price: fired.append((trigger.code, price)))
+    first = ctx.watch_quotes(['a.SH', 'b.SH'])
+    assert ctx.watch_quotes(['b.SH']) == first
+    second = ctx.watch_quotes(['c.SH'])
+    assert list(ctx.context.subscriptions) == [second]
+    codes, callback = ctx.context.subscriptions[second]
+    assert codes == ['a.SH', 'b.SH', 'c.SH']
+    callback({'a.SH': {'lastPrice': 9.4}, 'b.SH': {'lastPrice': 1.0}})
+    assert fired == [('a.SH', 9.4)]
+
+
+def test_last_prices_are_seeded_once_then_pushed():
+    ctx = make_context(do_back_test=False)
+    ctx.context.ticks = {'a.SH': {'lastPrice': 10.0}, 'b.SH': {'lastPrice': 0}}
+    assert ctx.get_last_prices(['a.SH', 'b.SH']).tolist()[0] == 10.0
+    assert ctx.context.calls == [('tick', ['a.SH', 'b.SH'])]
+    # later pushes update the cache without another full tick request
+    ctx.dispatch_quote({'b.SH': {'lastPrice': 5.0}})
+    assert ctx.get_last_prices(['b.SH', 'a.SH'], as_dict=True) == {'b.SH': 5.0, 'a.SH': 10.0}
+    assert len(ctx.context.calls) == 1
+    codes, _ = list(ctx.context.subscriptions.values())[0]
+    assert codes == ['a.SH', 'b.SH']
+
+
+def test_last_prices_in_backtest_read_the_current_minute_bar():
+    ctx = make_context(barpos=3)
+    ctx.context.bars = {'a.SH': 10.5}
+    prices = ctx.get_last_prices(['a.SH', 'b.SH'])
+    assert prices[0] == 10.5 and np.isnan(prices[1])
+    end_time = _PyContextInfo.timetag_to_datetime(ctx.get_bar_timetag(3), '%Y%m%d%H%M%S')
+    assert ctx.context.calls == [('bars', '1m', end_time, 1, 'none')]
+
+
+def test_backtest_position_book_reconciles_once_per_bar(monkeypatch):
+    ctx = make_context(barpos=5)
+    kinds = []
+    monkeypatch.setattr(_PyContextInfo, 'get_trade_detail_data', lambda acc, typ, kind: kinds.append(kind) or []
+        , raising=False)
+    book = ctx.get_position_book('acc', 'STOCK', reconcile_interval=0)
+    book.holdings()
+    book.asset()
+    assert kinds == ['POSITION', 'ACCOUNT']
+    ctx.context.barpos = 6
+    book.holdings()
+    book.asset()
+    assert kinds == ['POSITION', 'ACCOUNT'] * 2
+
+
+def test_grid_book_is_kept_per_account():
+    ctx = make_context()
+    # the framework's cancel() only exists inside the client, so the order manager is set up by hand
+    from _PyTrade import OrderManager
+    ctx.z8sglma_shared['order_manager'] = OrderManager()
+    book = ctx.get_grid_book('acc')
+    assert ctx.get_grid_book('acc') is book and ctx.get_grid_book('other') is not book
+    assert book.manager is ctx.get_order_manager()
+
+
+def test_roll_schedule_is_loaded_from_every_listed_contract():
+    ctx = make_context()
+    ctx.get_main_contract = lambda code: 'rb2405.SF'
+    ctx.get_stock_list_in_sector = lambda sector: ['rb2405.SF', 'i2405.DF'] if sector == u'上期所' else []
+    ctx.get_his_contract_list = lambda market: ['rb2401.SF']
+    ctx.context.bars = {'rb2401.SF': 100.0, 'rb2405.SF': 50.0}
+    schedule, data = ctx.load_roll_schedule('rb.SF', '20240101', '20240102', fields=('openInterest',))
+    assert schedule.contracts == ['rb2401.SF', 'rb2405.SF'] and schedule.main_on('20240102') == 'rb2401.SF'
+    assert ctx.get_roll_manager().schedule('rb.SF') is schedule
+
+
+def test_contract_specs_are_rebuilt_each_trading_day(monkeypatch):
+    ctx = make_context()
+    queried = []
+    ctx.get_instrumentdetail = lambda code: queried.append(code) or {'VolumeMultiple': 10}
+    ctx.get_contract_multiplier = lambda code: 1
+    specs = ctx.get_contract_specs(['rb2405.SF'])
+    assert ctx.get_contract_specs(['rb2405.SF']) is specs and queried == ['rb2405.SF']
+    monkeypatch.setattr(_PyContextInfo.time, 'strftime', lambda fmt: '29991231')
+    assert ctx.get_contract_specs(['rb2405.SF']) is not specs and queried == ['rb2405.SF'] * 2
+
+
+def test_option_chain_and_surface_are_shared(monkeypatch):
+    ctx = make_context(do_back_test=False)
+    info = {'10000001.SHO': {'ExpireDate': 20240131, 'ExtendInfo': {'OptExercisePrice': 2.8, 'optType': 'CALL'}}}
+    ctx.context.get_instrumentdetail = info.get
+    ctx.get_option_undl_data = lambda undl_code: list(info)
+    ctx.context.ticks = {'510050.SH': {'lastPrice': 2.8}, '10000001.SHO': {'lastPrice': 0.1}}
+    monkeypatch.setattr(_PyContextInfo.time, 'strftime', lambda fmt: '20240102')
+    chain = ctx.get_option_chain('510050.SH')
+    assert ctx.get_option_chain('510050.SH') is chain and chain.codes == ['10000001.SHO']
+    surface = ctx.get_iv_surface('510050.SH')
+    assert ctx.get_iv_surface('510050.SH') is surface and surface.chain is chain
+    # live surfaces are seeded from one full tick request and then follow pushes
+    assert ctx.context.calls == [('tick', ['510050.SH', '10000001.SHO'])]
+    assert surface.spot == 2.8 and surface.prices.tolist() == [0.1]
+    # an explicit contract list rebuilds the chain when it differs
+    assert ctx.get_option_chain('510050.SH', []) is not chain
+
+
+def test_portfolio_greeks_are_seeded_and_follow_callbacks(monkeypatch):
+    ctx = make_context()
+    info = {'10000001.SHO': {'ExpireDate': 20240131, 'VolumeMultiple': 10000
+        , 'ExtendInfo': {'OptExercisePrice': 2.8, 'optType': 'CALL'}}}
+    ctx.context.get_instrumentdetail = info.get
+    ctx.get_option_undl_data = lambda undl_code: list(info)
+    held = type('Position', (object,), {'m_strInstrumentID': '10000001', 'm_strExchangeID': 'SHO', 'm_nVolume': 2})
+    queried = []
+    monkeypatch.setattr(_PyContextInfo, 'get_trade_detail_data'
+        , lambda *args: queried.append(args) or [held()], raising=False)
+    greeks = ctx.get_portfolio_greeks('acc', '510050.SH')
+    assert ctx.get_portfolio_greeks('acc', '510050.SH') is greeks
+    assert queried == [('acc', 'STOCK_OPTION', 'POSITION')]
+    assert greeks.volumes == {('10000001.SHO', 48): 2}
+    held.m_nVolume = 0
+    ctx.dispatch_trade_callback('position', held())
+    assert greeks.volumes == {('10000001.SHO', 48): 0}
+
+
+def test_backtest_portfolio_greeks_reload_positions_each_bar(monkeypatch):
+    ctx = make_context(barpos=3)
+    info = {'10000001.SHO': {'ExpireDate': 20240131, 'VolumeMultiple': 10000
+        , 'ExtendInfo': {'OptExercisePrice': 2.8, 'optType': 'CALL'}}}
+    ctx.context.get_instrumentdetail = info.get
+    ctx.get_option_undl_data = lambda undl_code: list(info)
+    held = type('Position', (object,), {'m_strInstrumentID': '10000001', 'm_strExchangeID': 'SHO', 'm_nVolume': 2})
+    queried = []
+    monkeypatch.setattr(_PyContextInfo, 'get_trade_detail_data'
+        , lambda *args: queried.append(args) or [held()], raising=False)
+    greeks = ctx.get_portfolio_greeks('acc', '510050.SH')
+    assert greeks.account_id == 'acc'
+    held.m_nVolume = 5
+    assert ctx.get_portfolio_greeks('acc', '510050.SH') is greeks and len(queried) == 1
+    ctx.context.barpos = 4
+    ctx.get_portfolio_greeks('acc', '510050.SH')
+    ctx.get_portfolio_greeks('acc', '510050.SH')
+    assert len(queried) == 2 and greeks.volumes == {('10000001.SHO', 48): 5}
+
+
+def test_live_basket_traders_are_pumped_by_one_timer(monkeypatch):
+    from _PyTrade import OrderManager
+    monkeypatch.setattr(_PyContextInfo, 'passorder', lambda *args: None, raising=False)
+    timers = []
+    for back_test in (True, False):
+        ctx = make_context(do_back_test=back_test)
+        ctx.z8sglma_shared['order_manager'] = OrderManager()
+        ctx.schedule_run = lambda func, *args: timers.append((func, args[-1])) or len(timers)
+        first = ctx.get_basket_trader('acc', 's', rate=5)
+        ctx.get_basket_trader('acc', 't', rate=5)
+        assert ctx.get_basket_trader('acc', 's') is first
+        # backtests send the whole bar at once, live runs drain the queue from a one-second timer
+        assert first.rate == (0 if back_test else 5)
+    assert [name for _, name in timers] == ['basket_pump']
+    assert ctx.pump_basket_traders() == 0
+
+
+def test_surface_and_greeks_follow_the_next_days_chain(monkeypatch):
+    ctx = make_context(do_back_test=False)
+    info = {'10000001.SHO': {'ExpireDate': 20240131, 'ExtendInfo': {'OptExercisePrice': 2.8, 'optType': 'CALL'}}}
+    ctx.context.get_instrumentdetail = info.get
+    ctx.get_option_undl_data = lambda undl_code: list(info)
+    monkeypatch.setattr(_PyContextInfo, 'get_trade_detail_data', lambda *args: [], raising=False)
+    day = ['20240102']
+    monkeypatch.setattr(_PyContextInfo.time, 'strftime', lambda fmt: day[0])
+    greeks = ctx.get_portfolio_greeks('acc', '510050.SH')
+    surface = ctx.get_iv_surface('510050.SH')
+    info['10000002.SHO'] = {'ExpireDate': 20240228, 'ExtendInfo': {'OptExercisePrice': 2.9, 'optType': 'CALL'}}
+    day[0] = '20240103'
+    del ctx.context.calls[:]
+    assert ctx.get_portfolio_greeks('acc', '510050.SH') is greeks
+    assert greeks.chain is surface.chain and surface.chain.codes == ['10000001.SHO', '10000002.SHO']
+    # only the newly listed contract is seeded
+    assert ctx.context.calls == [('tick', ['510050.SH', '10000002.SHO'])]
+
+
+def test_backtest_sells_of_the_same_code_are_not_blocked(monkeypatch):
+    # the trend strategy skips a sell while an earlier one is open; backtests send no callbacks to close it
+    from _PyTrade import OrderManager
+    sent = []
+    monkeypatch.setattr(_PyContextInfo, 'passorder', lambda *args: sent.append(args[3]), raising=False)
+    ctx = make_context(do_back_test=True)
+    ctx.z8sglma_shared['order_manager'] = OrderManager()
+    trader = ctx.get_basket_trader('acc', 's')
+    for bar in range(3):
+        if ctx.get_order_manager().open_orders('a.SH', 'sell'):
+            continue
+        trader.submit([{'code': 'a.SH', 'volume': 100, 'op_type': 24}], ctx)
+    assert sent == ['a.SH'] * 3
@@ -0,0 +1,275 @@
+#coding:utf-8
+
+import numpy as np
+import pandas as pd
+
+from _PyFactor import (FACTOR_NAMES, FactorInputs, FactorPanel, OnlineFactors, RollingWLS, compute_risk_factors
+    , decay_weights, half_life_decay, market_data_to_array, window_decay_sum, wls_regress)
+
+WINDOW, HALF_LIFE, MONTH_DAYS = 12, 6, 3
+DATES = ['2024%04d' % (101 + i) for i in range(40)]
+
+
+def make_inputs(days=40, n=3, seed=3):
+    rng = np.random.RandomState(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, (n, days)), axis=1))
+    close[1, 20] = np.nan
+    volume = rng.uniform(1e5, 1e6, (n, days))
+    index_close = 3000 * np.exp(np.cumsum(rng.normal(0, 0.01, days)))
+    risk_free = rng.uniform(1.5, 3.0, days)
+    return FactorInputs(close, volume, np.full(n, 1e7), index_close, risk_free)
+
+
+def weights(t):
+    decay = half_life_decay(HALF_LIFE)
+    return decay ** np.arange(WINDOW)[::-1], np.arange(t - WINDOW + 1, t + 1)
+
+
+def test_window_decay_sum_matches_direct_sum():
+    values = np.random.RandomState(0).normal(size=(2, 20))
+    decay = half_life_decay(HALF_LIFE)
+    result = window_decay_sum(values, WINDOW, decay)
+    assert np.isnan(result[:, :WINDOW - 1]).all()
+    for t in range(WINDOW - 1, 20):
+        w, cols = weights(t)
+        np.testing.assert_allclose(result[:, t], (values[:, cols] * w).sum(axis=1))
+
+
+def test_factors_match_direct_formulas():
+    inputs = make_inputs()
+    result = compute_risk_factors(inputs, window=WINDOW, half_life=HALF_LIFE, month_days=MONTH_DAYS)
+    t = inputs.close.shape[1] - 1
+    w, cols = weights(t)
+    rf = inputs.annual_rf[cols] / 365
+    x = inputs.index_close[cols] / inputs.index_close[cols - 1] - 1 - rf
+    for i in range(inputs.close.shape[0]):
+        y = inputs.close[i, cols] / inputs.close[i, cols - 1] - 1 - rf
+        mean = (w * y).sum() / w.sum()
+        np.testing.assert_allclose(result['DASTD'][i, t], np.sqrt((w * (y - mean) ** 2).sum() / w.sum()))
+        design = np.column_stack([np.ones(WINDOW), x]) * np.sqrt(w)[:, None]
+        coef = np.linalg.lstsq(design, y * np.sqrt(w), rcond=None)[0]
+        resid = y - coef[0] - coef[1] * x
+        np.testing.assert_allclose(result['HSIGMA'][i, t], np.sqrt((w * resid ** 2).sum() / w.sum()))
+        turnover = inputs.volume[i] / 1e7
+        np.testing.assert_allclose(result['STOM'][i, t], np.log(turnover[t - MONTH_DAYS + 1:].sum()))
+        np.testing.assert_allclose(result['STOQ'][i, t], np.log(turnover[t - 3 * MONTH_DAYS + 1:].sum() / 3))
+        log_rf = np.log(1 + inputs.annual_rf / 12)
+        z = [np.log(inputs.close[i, t] / inputs.close[i, t - m * MONTH_DAYS])
+            - sum(log_rf[t - k * MONTH_DAYS] for k in range(m)) for m in range(1, WINDOW // MONTH_DAYS + 1)]
+        np.testing.assert_allclose(result['CMRA'][i, t], np.log((1 + max(z)) / (1 + min(z))))
+
+
+def test_suspended_day_gets_zero_weight():
+    inputs = make_inputs()
+    result = compute_risk_factors(inputs, ['DASTD'], window=WINDOW, half_life=HALF_LIFE)
+    # the return into and out of the missing close drop out instead of turning the window into NaN
+    assert np.isfinite(result['DASTD'][1, 22:30]).all()
+
+
+def test_missing_inputs_raise():
+    inputs = FactorInputs(np.ones((2, 30)))
+    for name in ('HSIGMA', 'STOM', 'XYZ'):
+        try:
+            compute_risk_factors(inputs, [name])
+        except ValueError:
+            continue
+        raise AssertionError(name)
+
+
+def test_panel_round_trip(tmp_path):
+    inputs = make_inputs()
+    panel = FactorPanel(['a', 'b', 'c'], DATES, compute_risk_factors(inputs, window=WINDOW, half_life=HALF_LIFE
+        , month_days=MONTH_DAYS))
+    panel.save(str(tmp_path / 'panel.npz'))
+    loaded = FactorPanel.load(str(tmp_path / 'panel.npz'))
+    assert loaded.codes == panel.codes and loaded.dates == panel.dates
+    for name in panel.factors:
+        np.testing.assert_array_equal(loaded.values[name], panel.values[name])
+    frame = loaded.cross_section(DATES[-2])
+    assert list(frame.index) == ['a', 'b', 'c']
+    np.testing.assert_array_equal(frame['DASTD'].values, panel.values['DASTD'][:, -2])
+
+
+def test_market_data_to_array_aligns_dates():
+    data = {
+        'a': pd.DataFrame({'close': [1.0, 2.0, 3.0]}, index=['20240102', '20240103', '20240104']),
+        'b': pd.DataFrame({'close': [5.0]}, index=['20240103']),
+        'c': pd.DataFrame(),
+    }
+    result = market_data_to_array(data, ['a', 'b', 'c'], ['20240103', '20240104'], 'close')
+    np.testing.assert_array_equal(result, [[2.0, 3.0], [5.0, np.nan], [np.nan, np.nan]])
+
+
+class SigmaContext(object):
+    def __init__(self, data):
+        self.stock, self.index_code, self.barpos = 'a', 'idx', 300
+        self.data = data
+        self.pushed = []
+        self.regression = self
+
+    def update(self, x, y):
+        self.pushed.append((x, y[0]))
+        return 0.0, [1.0], [0.5]
+
+    def get_market_data_ex(self, fields, stock_code, period, end_time, count, dividend_type):
+        return self.data
+
+    def get_risk_free_rate_series(self, start, end):
+        return np.array([2.0])
+
+
+def test_hsigma_skips_bars_where_the_stock_was_suspended():
+    import HSIGMA
+    index = pd.DataFrame({'close': [100.0, 101.0]}, index=['20240103', '20240104'])
+    # the stock did not trade on 20240103: its two closes span three index days
+    suspended = SigmaContext({'a': pd.DataFrame({'close': [10.0, 10.5]}, index=['20240102', '20240104'])
+        , 'idx': index})
+    assert np.isnan(HSIGMA.getSigma(suspended, '20240104'))
+    assert suspended.pushed == []
+    traded = SigmaContext({'a': pd.DataFrame({'close': [10.0, 10.5]}, index=['20240103', '20240104']), 'idx': index})
+    assert HSIGMA.getSigma(traded, '20240104') == 0.5
+    rf = 0.02 / 365
+    np.testing.assert_allclose(traded.pushed, [(0.01 - rf, 0.05 - rf)])
+
+
+def online_factors(inputs, days=None):
+    online = OnlineFactors(['a', 'b', 'c'], WINDOW, HALF_LIFE, MONTH_DAYS)
+    days = inputs.close.shape[1] if days is None else days
+    online.warm_up(DATES[:days], FactorInputs(inputs.close[:, :days], inputs.volume[:, :days]
+        , inputs.float_shares[:, :days], inputs.index_close[:days], inputs.annual_rf[:days] * 100))
+    return online
+
+
+def test_online_replay_matches_batch():
+    inputs = make_inputs()
+    batch = compute_risk_factors(inputs, window=WINDOW, half_life=HALF_LIFE, month_days=MONTH_DAYS)
+    values = online_factors(inputs).values()
+    for name in FACTOR_NAMES:
+        np.testing.assert_allclose(values[name], batch[name][:, -1], rtol=1e-9, equal_nan=True, err_msg=name)
+
+
+def test_online_same_date_replaces_bar():
+    inputs = make_inputs()
+    online = online_factors(inputs, 39)
+    t = 39
+    args = (inputs.volume[:, t], inputs.float_shares[:, t], inputs.index_close[t], inputs.annual_rf[t] * 100)
+    online.update(DATES[t], inputs.close[:, t] * 1.1, *args)
+    values = online.update(DATES[t], inputs.close[:, t], *args)
+    expected = online_factors(inputs).values()
+    for name in FACTOR_NAMES:
+        np.testing.assert_allclose(values[name], expected[name], rtol=1e-9, equal_nan=True, err_msg=name)
+    # bars older than the last applied date are ignored
+    online.update(DATES[t - 1], inputs.close[:, t] * 2, *args)
+    assert online.date == DATES[t]
+    np.testing.assert_allclose(online.values()['DASTD'], expected['DASTD'], rtol=1e-9)
+
+
+def test_online_save_load_resumes(tmp_path):
+    inputs = make_inputs()
+    online = online_factors(inputs, 30)
+    online.save(str(tmp_path / 'online.npz'))
+    loaded = OnlineFactors.load(str(tmp_path / 'online.npz'))
+    assert loaded.date == DATES[29]
+    for t in range(30, 40):
+        loaded.update(DATES[t], inputs.close[:, t], inputs.volume[:, t], inputs.float_shares[:, t]
+            , inputs.index_close[t], inputs.annual_rf[t] * 100)
+    expected = online_factors(inputs).values()
+    for name in FACTOR_NAMES:
+        np.testing.assert_allclose(loaded.values()[name], expected[name], rtol=1e-9, equal_nan=True, err_msg=name)
+
+
+def direct_wls(y, x, w):
+    design = np.column_stack([np.ones(len(x)), x]) * np.sqrt(w)[:, None]
+    alpha, beta = np.linalg.lstsq(design, y * np.sqrt(w), rcond=None)[0]
+    resid = y - alpha - beta * x
+    return alpha, beta, np.sqrt((w * resid ** 2).sum() / w.sum())
+
+
+def test_wls_regress_matches_lstsq():
+    rng = np.random.RandomState(5)
+    x = rng.normal(0, 0.01, 50)
+    y = 0.001 + np.outer([0.5, 1.0, 1.5], x) + rng.normal(0, 0.005, (3, 50))
+    y[2, 7] = np.nan
+    w = decay_weights(50, 20)
+    alpha, beta, sigma = wls_regress(y, x, w)
+    for i in range(3):
+        keep = np.isfinite(y[i])
+        np.testing.assert_allclose([alpha[i], beta[i], sigma[i]], direct_wls(y[i, keep], x[keep], w[keep]))
+
+
+def test_rolling_wls_tracks_last_window():
+    rng = np.random.RandomState(6)
+    x = rng.normal(0, 0.01, 40)
+    y = 0.8 * x + rng.normal(0, 0.004, (2, 40))
+    regression = RollingWLS(2, WINDOW, HALF_LIFE)
+    for t in range(40):
+        alpha, beta, sigma = regression.update(x[t], y[:, t])
+        if t < WINDOW - 1:
+            assert np.isnan(beta).all()
+    expected = wls_regress(y[:, -WINDOW:], x[-WINDOW:], decay_weights(WINDOW, HALF_LIFE))
+    np.testing.assert_allclose(np.array([alpha, beta, sigma]), np.array(expected), rtol=1e-8)
+
+
+def test_beta_matches_direct_regression():
+    inputs = make_inputs()
+    result = compute_risk_factors(inputs, ['BETA'], window=WINDOW, half_life=HALF_LIFE)
+    w, cols = weights(inputs.close.shape[1] - 1)
+    rf = inputs.annual_rf[cols] / 365
+    x = inputs.index_close[cols] / inputs.index_close[cols - 1] - 1 - rf
+    y = inputs.close[0, cols] / inputs.close[0, cols - 1] - 1 - rf
+    np.testing.assert_allclose(result['BETA'][0, -1], direct_wls(y, x, w)[1])
+
+
+def bars(days, n=3, seed=7):
+    rng = np.random.RandomState(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, (days, n)), axis=0))
+    volume = rng.uniform(1e5, 1e6, (days, n))
+    index = 3000 * np.exp(np.cumsum(rng.normal(0, 0.01, days)))
+    dates = ['2024%04d' % (101 + i) for i in range(days)]
+    return dates, close, volume, index
+
+
+def feed(factors, dates, close, volume, index, shares):
+    for i, date in enumerate(dates):
+        factors.update(date, close[i], volume[i], shares, index[i], 2.0)
+
+
+def assert_same(a, b):
+    for name in b:
+        np.testing.assert_allclose(a[name], b[name], rtol=1e-9, equal_nan=True, err_msg=name)
+
+
+def test_recommit_matches_fresh_recompute():
+    dates, close, volume, index = bars(30)
+    shares = np.full(3, 1e7)
+    args = dict(window=12, half_life=6, month_days=3)
+    online = OnlineFactors(['a', 'b', 'c'], **args)
+    feed(online, dates[:-1], close[:-1], volume[:-1], index[:-1], shares)
+    # the last bar first arrives without an index close, then is recommitted twice with the final values
+    online.update(dates[-1], close[-1] * 1.01, volume[-1], shares, None, 2.0)
+    online.update(dates[-1], close[-1] * 0.99, volume[-1], shares, index[-1] * 1.02, 2.0)
+    online.update(dates[-1], close[-1], volume[-1], shares, index[-1], 2.0)
+    fresh = OnlineFactors(['a', 'b', 'c'], **args)
+    feed(fresh, dates, close, volume, index, shares)
+    assert np.isfinite(fresh.values()['BETA']).all()
+    assert_same(online.values(), fresh.values())
+    # recommitting the following bar still sees the corrected index close
+    more_dates, more_close, more_volume, more_index = bars(32)
+    online.update('20240131', more_close[-1], more_volume[-1], shares, more_index[-1], 2.0)
+    online.update('20240131', more_close[-2], more_volume[-2], shares, more_index[-2], 2.0)
+    fresh.update('20240131', more_close[-2], more_volume[-2], shares, more_index[-2], 2.0)
+    assert_same(online.values(), fresh.values())
+
+
+def test_recommit_after_load(tmp_path):
+    dates, close, volume, index = bars(20)
+    shares = np.full(3, 1e7)
+    online = OnlineFactors(['a', 'b', 'c'], window=12, half_life=6, month_days=3)
+    feed(online, dates[:-1], close[:-1], volume[:-1], index[:-1], shares)
+    online.update(dates[-1], close[-1] * 1.05, volume[-1], shares, None, 2.0)
+    online.save(str(tmp_path / 'factors.npz'))
+    loaded = OnlineFactors.load(str(tmp_path / 'factors.npz'))
+    loaded.update(dates[-1], close[-1], volume[-1], shares, index[-1], 2.0)
+    fresh = OnlineFactors(['a', 'b', 'c'], window=12, half_life=6, month_days=3)
+    feed(fresh, dates, close, volume, index, shares)
+    assert_same(loaded.values(), fresh.values())
@@ -0,0 +1,70 @@
+#coding:utf-8
+
+import numpy as np
+import pandas as pd
+
+from _PyFeature import FEATURE_NAMES, build_xy, load_training_set, rolling_window, window_features
+
+
+def bars(days=40, seed=1):
+    rng = np.random.RandomState(seed)
+    close = 10 + np.cumsum(rng.normal(0, 0.2, days))
+    return pd.DataFrame({
+        'high': close + 0.1,
+        'low': close - 0.1,
+        'close': close,
+        'volume': rng.uniform(1e5, 2e5, days),
+    }, index=['2024%04d' % (101 + i) for i in range(days)])
+
+
+def test_rolling_window_is_a_read_only_view():
+    values = np.arange(6.0)
+    windows = rolling_window(values, 3)
+    np.testing.assert_array_equal(windows, [[0, 1, 2], [1, 2, 3], [2, 3, 4], [3, 4, 5]])
+    assert not windows.flags.writeable
+    assert rolling_window(values, 7).shape == (0, 7)
+
+
+def test_window_features_match_single_window():
+    df = bars()
+    x = window_features(df['high'].values, df['low'].values, df['close'].values, df['volume'].values, 15)
+    assert x.shape == (26, len(FEATURE_NAMES))
+    w = df.iloc[10:25]
+    expected = [
+        w['close'].iloc[-1] / w['close'].mean(),
+        w['volume'].iloc[-1] / w['volume'].mean(),
+        w['high'].iloc[-1] / w['high'].mean(),
+        w['low'].iloc[-1] / w['low'].mean(),
+        w['volume'].iloc[-1],
+        w['close'].iloc[-1] / w['close'].iloc[0],
+        np.std(w['close'].values),
+    ]
+    np.testing.assert_allclose(x[10], expected)
+
+
+def test_build_xy_labels_compare_with_horizon():
+    df = bars()
+    x, y, index = build_xy(df.iloc[::-1], 15, 5)
+    # rows end at bars 14 .. 34, the last 5 bars have no known label yet
+    assert len(x) == len(y) == len(index) == 21
+    assert index[0] == df.index[14] and index[-1] == df.index[34]
+    close = df['close'].values
+    np.testing.assert_array_equal(y, (close[19:40] > close[14:35]).astype(int))
+
+
+class FakeContextInfo(object):
+    def __init__(self, data):
+        self.data = data
+        self.calls = 0
+
+    def get_market_data_ex(self, fields, stock_list, **kwargs):
+        self.calls += 1
+        return {code: self.data[code] for code in stock_list if code in self.data}
+
+
+def test_load_training_set_uses_one_fetch():
+    ctx = FakeContextInfo({'a': bars(40, 1), 'b': bars(40, 2), 'c': bars(10, 3)})
+    x, y, keys = load_training_set(ctx, ['a', 'b', 'c', 'd'], '20240101', '20240301')
+    assert ctx.calls == 1
+    assert x.shape == (42, len(FEATURE_NAMES)) and len(y) == 42
+    assert keys[0] == ('a', '20240115') and keys[21] == ('b', '20240115')
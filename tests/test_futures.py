@@ -0,0 +1,102 @@
+#coding:utf-8
+
+import numpy as np
+import pandas as pd
+
+from _PyFutures import ContractSpecs, RollManager, continuous, continuous_code, product_of, roll_schedule, split_code
+
+DATES = ['20240102', '20240103', '20240104', '20240105', '20240108', '20240109']
+CONTRACTS = ['rb2405.SF', 'rb2401.SF']
+
+
+def bars():
+    return {
+        'rb2401.SF': pd.DataFrame({'close': [10.0, 11, 12, 13, 14], 'openInterest': [100.0, 100, 80, 50, 30]}
+            , index=DATES[:5]),
+        'rb2405.SF': pd.DataFrame({'close': [20.0, 22, 24, 26, 28, 30], 'openInterest': [50.0, 60, 90, 120, 150, 160]}
+            , index=DATES),
+    }
+
+
+def test_codes():
+    assert split_code('rb2405.SF') == ('rb', '2405', 'SF') and split_code('600000') is None
+    assert product_of('IF2403.IF') == 'IF.IF' and continuous_code('rb.SF') == 'rb00.SF'
+
+
+def test_main_follows_previous_day_open_interest():
+    schedule = roll_schedule('rb.SF', bars(), CONTRACTS, DATES)
+    # contracts are put in expiry order whatever order they came in
+    assert schedule.contracts == ['rb2401.SF', 'rb2405.SF']
+    assert schedule.contract_per_date() == ['rb2401.SF'] * 3 + ['rb2405.SF'] * 3
+    assert schedule.roll_dates() == [('20240105', 'rb2401.SF', 'rb2405.SF')]
+    assert schedule.sub_main_on('20240103') == 'rb2405.SF' and schedule.sub_main_on('20240108') is None
+    assert schedule.main_on('20240106') == 'rb2405.SF' and schedule.main_on('20231229') is None
+    later = roll_schedule('rb.SF', bars(), CONTRACTS, DATES, confirm_days=2)
+    assert later.roll_dates() == [('20240108', 'rb2401.SF', 'rb2405.SF')]
+
+
+def test_continuous_series_is_back_adjusted():
+    data = bars()
+    schedule = roll_schedule('rb.SF', data, CONTRACTS, DATES)
+    # the roll gap is measured on the day before the roll: 24 / 12
+    ratio = continuous(data, schedule, fields=('close',))
+    np.testing.assert_allclose(ratio['factor'], [2, 2, 2, 1, 1, 1])
+    np.testing.assert_allclose(ratio['close'], [20, 22, 24, 26, 28, 30])
+    diff = continuous(data, schedule, fields=('close',), method='diff')
+    np.testing.assert_allclose(diff['close'], [22, 23, 24, 26, 28, 30])
+    assert ratio['contract'][2] == 'rb2401.SF'
+
+
+def test_roll_manager_resolves_the_main_once_a_day():
+    calls = []
+    manager = RollManager(lambda code: calls.append(code) or 'rb2405', lambda market: CONTRACTS + ['i2405.DF'])
+    assert manager.main('rb.SF', '20240102') == 'rb2405.SF'
+    assert manager.main('rb.SF', '20240102') == 'rb2405.SF'
+    assert calls == ['rb00.SF']
+    assert manager.contracts('rb.SF') == ['rb2401.SF', 'rb2405.SF']
+    # a schedule takes over for the dates it covers
+    manager.set_schedule(roll_schedule('rb.SF', bars(), CONTRACTS, DATES))
+    assert manager.should_roll('rb2401.SF', '20240104') is None
+    assert manager.should_roll('rb2401.SF', '20240105') == 'rb2405.SF'
+    assert manager.roll_dates('rb.SF')[0][0] == '20240105'
+    manager.main_on('rb.SF', '20240201')
+    assert calls == ['rb00.SF', 'rb00.SF']
+
+
+DETAILS = {
+    'rb2405.SF': {'VolumeMultiple': 10, 'LongMarginRatio': 0.1, 'ShortMarginRatio': 0.12, 'PriceTick': 1.0
+        , 'UpStopPrice': 3800.0, 'DownStopPrice': 3400.0},
+    'IF2403.IF': {'VolumeMultiple': 0, 'LongMarginRatio': 0.12, 'ShortMarginRatio': 0.12, 'PriceTick': 0.2
+        , 'UpStopPrice': 'x'},
+}
+
+
+def make_specs():
+    queried = []
+    detail = lambda code: queried.append(code) or DETAILS.get(code)
+    return ContractSpecs('20240102', detail, lambda code: 300), queried
+
+
+def test_contract_specs_load_each_code_once():
+    specs, queried = make_specs()
+    specs.ensure(['rb2405.SF', 'IF2403.IF', 'rb2405.SF'])
+    specs.get(['IF2403.IF', 'rb2405.SF'], 'price_tick')
+    assert queried == ['rb2405.SF', 'IF2403.IF']
+    # a missing VolumeMultiple falls back to get_contract_multiplier, bad numbers become NaN
+    np.testing.assert_array_equal(specs.get(['IF2403.IF', 'rb2405.SF'], 'multiplier'), [300, 10])
+    assert np.isnan(specs.get(['IF2403.IF'], 'up_stop')[0])
+
+
+def test_contract_specs_basket_math():
+    specs, _ = make_specs()
+    codes = ['rb2405.SF', 'IF2403.IF']
+    np.testing.assert_allclose(specs.notional(codes, [3600, 3500], [2, 1]), [72000, 1050000])
+    np.testing.assert_allclose(specs.margin(codes, [3600, 3500], [2, 1], long=[True, False]), [7200, 126000])
+    np.testing.assert_allclose(specs.margin(codes[:1], [3600], [1], long=False), [4320])
+    np.testing.assert_allclose(specs.round_price(codes, [3600.4, 3500.13]), [3600, 3500.2])
+    np.testing.assert_allclose(specs.round_price(codes, [3600.4, 3500.13], 'down'), [3600, 3500.0])
+    np.testing.assert_allclose(specs.round_price(codes, [3600.4, 3500.13], 'up'), [3601, 3500.2])
+    np.testing.assert_allclose(specs.clip_price(codes, [3900, 3000]), [3800, 3000])
+    np.testing.assert_array_equal(specs.max_volume(codes, [3600, 3500], [10000, 100000]), [2, 0])
+    codes, prices, volumes = specs.basket([{'code': 'rb2405.SF', 'price': 3600, 'volume': 2, 'op_type': 0}])
+    assert codes == ['rb2405.SF'] and prices.tolist() == [3600] and volumes.tolist() == [2]
@@ -0,0 +1,181 @@
+#coding:utf-8
+
+import numpy as np
+
+from _PyGrid import Grid, GridBook, TickSeries, ladder, param_grid, simulate, sweep
+from _PyTrade import OrderManager
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def make_grid(**kwargs):
+    return Grid('a', 10.0, 10.1, 9.5, 10.5, 0.1, buy_count=2, sell_count=2, max_warp=2, **kwargs)
+
+
+def test_ladder_is_anchored_on_the_base_price():
+    np.testing.assert_allclose(ladder(10.0, 0.3, 9.0, 11.0), [9.1, 9.4, 9.7, 10.0, 10.3, 10.6, 10.9])
+    assert len(make_grid().levels) == 11
+
+
+def test_ticks_fill_crossed_levels_and_move_the_anchors():
+    grid = make_grid()
+    assert grid.targets() == [('buy', 9.9, 100), ('buy', 10.0, 100), ('sell', 10.1, 100), ('sell', 10.2, 100)]
+    assert grid.on_tick(9.85) == [('buy', 10.0, 100), ('buy', 9.9, 100)]
+    # two buys ahead of sells reach max_warp: only sells rest, one level above each fill
+    assert grid.targets() == [('sell', 10.0, 100), ('sell', 10.1, 100)]
+    assert grid.position == 200 and grid.warp == 2
+    assert grid.on_tick(10.05) == [('sell', 10.0, 100)]
+    assert grid.position == 100
+    assert grid.targets() == [('buy', 9.8, 100), ('buy', 9.9, 100), ('sell', 10.1, 100), ('sell', 10.2, 100)]
+
+
+def test_layout_params_and_reference_distance():
+    params = {'base_buy_price': '10', 'base_sell_price': '10.1', 'min_buy_price': '9.5', 'max_sell_price': '10.5'
+        , 'grid_interval': '0.1', 'reference_price': '0.2', 'min_buy_singlevolume': '1'
+        , 'max_sell_singlevolume': '1', 'unknown': 'x'}
+    grid = Grid.from_layout('a', params)
+    assert grid.ref_steps == 2
+    grid.on_fill('buy', 10.0)
+    assert grid.targets() == [('buy', 9.9, 100), ('sell', 10.2, 100)]
+    # resting orders are topped up, those off the ladder are cancelled
+    assert grid.diff({9.9: 100, 9.5: 100}, {10.2: 50}) == ([('sell', 10.2, 50)], [('buy', 9.5)])
+
+
+def test_state_round_trip():
+    grid = make_grid()
+    grid.on_tick(9.85)
+    restored = make_grid()
+    restored.set_state(grid.get_state())
+    assert restored.targets() == grid.targets() and restored.position == 200
+
+
+def test_book_follows_complete_fills_and_reconciles():
+    cancelled = []
+    manager = OrderManager(lambda sys_id, account_id, account_type, ContextInfo: cancelled.append(sys_id) or True)
+    book = GridBook(manager)
+    grid = book.add(make_grid())
+    manager.on_submit('u1', {'code': 'a', 'op_type': 23, 'price': 10.0, 'volume': 100}, 'acc')
+    manager.on_submit('u2', {'code': 'a', 'op_type': 23, 'price': 9.5, 'volume': 100}, 'acc')
+    manager.on_order(Obj(m_strRemark='u1', m_strOrderSysID='s1', m_nOrderStatus=50, m_nVolumeTraded=0))
+    manager.on_order(Obj(m_strRemark='u2', m_strOrderSysID='s2', m_nOrderStatus=50, m_nVolumeTraded=0))
+    manager.on_deal(Obj(m_strTradeID='t1', m_strOrderSysID='s1', m_nVolume=40, m_dPrice=10.0))
+    assert grid.buy_fills == 0
+    manager.on_deal(Obj(m_strTradeID='t2', m_strOrderSysID='s1', m_nVolume=60, m_dPrice=10.0))
+    assert grid.buy_fills == 1 and grid.position == 100
+    place = book.reconcile(None)
+    assert cancelled == ['s2']
+    assert place == {'a': [('buy', 9.8, 100), ('buy', 9.9, 100), ('sell', 10.1, 100), ('sell', 10.2, 100)]}
+
+
+def test_book_settles_partial_fills_on_cancel():
+    manager = OrderManager(lambda *args: True)
+    book = GridBook(manager, account_id='acc')
+    grid = book.add(make_grid())
+    manager.on_submit('u1', {'code': 'a', 'op_type': 23, 'price': 10.0, 'volume': 100}, 'acc')
+    manager.on_order(Obj(m_strRemark='u1', m_strOrderSysID='s1', m_nOrderStatus=50, m_nVolumeTraded=0))
+    manager.on_deal(Obj(m_strTradeID='t1', m_strOrderSysID='s1', m_nVolume=40, m_dPrice=10.0))
+    assert grid.buy_fills == 0
+    # the rest is cancelled: the level counts as filled with the 40 traded
+    manager.on_order(Obj(m_strRemark='u1', m_strOrderSysID='s1', m_nOrderStatus=53, m_nVolumeTraded=40))
+    assert grid.buy_fills == 1 and grid.position == 40 and grid.buy_anchor == grid.index(10.0) - 1
+    # a deal reported after the cancel only adds to the position
+    manager.on_deal(Obj(m_strTradeID='t2', m_strOrderSysID='s1', m_nVolume=10, m_dPrice=10.0))
+    assert grid.buy_fills == 1 and grid.position == 50
+    # cancelled before the partial deal arrived
+    manager.on_submit('u2', {'code': 'a', 'op_type': 24, 'price': 10.1, 'volume': 100}, 'acc')
+    manager.on_order(Obj(m_strRemark='u2', m_strOrderSysID='s2', m_nOrderStatus=53, m_nVolumeTraded=30))
+    assert grid.sell_fills == 0
+    manager.on_deal(Obj(m_strTradeID='t3', m_strOrderSysID='s2', m_nVolume=30, m_dPrice=10.1))
+    assert grid.sell_fills == 1 and grid.position == 20
+
+
+def test_book_ignores_orders_of_other_accounts():
+    cancelled = []
+    manager = OrderManager(lambda sys_id, account_id, account_type, ContextInfo: cancelled.append(sys_id) or True)
+    book = GridBook(manager, account_id='acc')
+    grid = book.add(make_grid())
+    manager.on_submit('u1', {'code': 'a', 'op_type': 23, 'price': 10.0, 'volume': 100}, 'other')
+    manager.on_submit('u2', {'code': 'a', 'op_type': 23, 'price': 9.5, 'volume': 100}, 'other')
+    manager.on_order(Obj(m_strRemark='u1', m_strOrderSysID='s1', m_nOrderStatus=50, m_nVolumeTraded=0))
+    manager.on_order(Obj(m_strRemark='u2', m_strOrderSysID='s2', m_nOrderStatus=50, m_nVolumeTraded=0))
+    manager.on_deal(Obj(m_strTradeID='t1', m_strOrderSysID='s1', m_nVolume=100, m_dPrice=10.0))
+    assert grid.buy_fills == 0 and grid.position == 0
+    # the other account's resting order neither covers a level nor gets cancelled
+    assert book.reconcile(None) == {'a': grid.targets()}
+    assert cancelled == []
+
+
+def test_touch_mode_reports_crossings():
+    crossed = []
+    book = GridBook(on_cross=lambda code, fills: crossed.append((code, fills)))
+    book.add(make_grid())
+    assert book.on_quote({'a': {'lastPrice': 10.0}, 'b': {'lastPrice': 1.0}}) == {'a': [('buy', 10.0, 100)]}
+    assert book.on_quote({'a': {'lastPrice': 0}}) == {}
+    assert crossed == [('a', [('buy', 10.0, 100)])]
+
+
+def day_ticks(day, prices, start='093000', step=60):
+    # timetags in ms for ticks from start (Beijing time) every step seconds
+    base = (np.datetime64('2024-01-%02d' % day) - np.datetime64('1970-01-01')).astype('timedelta64[s]').astype(int)
+    base += int(start[:2]) * 3600 + int(start[2:4]) * 60 - 8 * 3600
+    return (base + np.arange(len(prices)) * step) * 1000
+
+
+def test_tick_series_marks_days_and_restore_ticks():
+    tags = np.r_[day_ticks(2, [1] * 3, '144900'), day_ticks(3, [1] * 2, '145000')]
+    series = TickSeries([10.0, 0, 10.1, 10.2, 10.3, 10.4][:5], tags, volumes=[1, 1, 1, 1, 1])
+    assert len(series) == 4
+    assert series.new_day.tolist() == [True, False, True, False]
+    assert series.restore.tolist() == [False, True, True, False]
+
+
+def test_simulation_matches_the_live_ladder():
+    # one level per tick, so every fill happens at its level price
+    prices = np.array([10.0, 9.9, 9.8, 9.9, 10.0, 10.1, 10.2, 10.3, 10.2, 10.1, 10.0, 9.9, 9.9, 10.0])
+    series = TickSeries(prices, day_ticks(2, prices))
+    stats = simulate(series, 10.0, 10.1, 9.5, 10.5, 0.1, buy_count=2, sell_count=2, max_warp=2
+        , fee_rate=0.001, end_restore=False)
+    grid = make_grid()
+    fills = [f for p in prices for f in grid.on_tick(p)]
+    assert stats['buy_fills'] == sum(side == 'buy' for side, _, _ in fills)
+    assert stats['sell_fills'] == sum(side == 'sell' for side, _, _ in fills)
+    assert stats['position'] == grid.position
+    cash = sum((v if side == 'sell' else -v) * p for side, p, v in fills)
+    np.testing.assert_allclose(stats['cash'], cash)
+    np.testing.assert_allclose(stats['fees'], sum(p * v for _, p, v in fills) * 0.001)
+    np.testing.assert_allclose(stats['pnl'], cash - stats['fees'] + grid.position * prices[-1])
+
+
+def test_gaps_fill_at_the_better_tick_price():
+    prices = [10.05, 9.75]
+    stats = simulate(TickSeries(prices, day_ticks(2, prices)), 10.0, 10.1, 9.5, 10.5, 0.1, buy_count=2
+        , sell_count=2, max_warp=2, end_restore=False)
+    assert stats['buy_fills'] == 2
+    np.testing.assert_allclose(stats['cash'], -9.75 * 200)
+
+
+def test_end_restore_trades_back_to_the_day_start_position():
+    prices = [10.0, 9.9, 9.8]
+    tags = day_ticks(2, prices, '144800')
+    stats = simulate(TickSeries(prices, tags), 10.0, 10.1, 9.5, 10.5, 0.1, buy_count=2, sell_count=2)
+    # buys at 10.0 and 9.9, then the 14:50 tick sells both back at 9.8
+    assert stats['buy_fills'] == 2 and stats['position'] == 0 and stats['restore_volume'] == 200
+    np.testing.assert_allclose(stats['pnl'], -(10.0 + 9.9) * 100 + 9.8 * 200)
+
+
+def test_sweep_covers_every_parameter_set():
+    prices = np.array([10.0, 9.9, 9.8, 10.0, 10.1, 10.2, 10.3, 10.0, 9.7, 10.4])
+    series = TickSeries(prices, day_ticks(2, prices))
+    params = param_grid(grid_interval=[0.1, 0.2], buy_count=[1, 2])
+    assert params[1] == {'grid_interval': 0.1, 'buy_count': 2}
+    base = dict(base_buy_price=10.0, base_sell_price=10.1, min_buy_price=9.5, max_sell_price=10.5)
+    params = [dict(base, **p) for p in params]
+    serial = sweep(series, params, processes=1)
+    parallel = sweep(series, params, processes=2)
+    assert len(serial['pnl']) == 4
+    for k in serial:
+        np.testing.assert_allclose(parallel[k], serial[k])
+    assert serial['pnl'][0] == simulate(series, **params[0])['pnl']
@@ -0,0 +1,176 @@
+#coding:utf-8
+
+import numpy as np
+import pandas as pd
+
+import _PyIndicator
+from _PyIndicator import (IndicatorEngine, atr, ema, ma, macd, market_data_matrix, returns, rolling_max, rolling_min
+    , zscore)
+
+CODES = ['a', 'b', 'c']
+
+
+def daily(days=60, n=3, seed=2):
+    rng = np.random.RandomState(seed)
+    close = 10 * np.exp(np.cumsum(rng.normal(0, 0.02, (n, days)), axis=1))
+    high = close * (1 + rng.uniform(0, 0.02, (n, days)))
+    low = close * (1 - rng.uniform(0, 0.02, (n, days)))
+    dates = ['2024%04d' % (101 + i) for i in range(days)]
+    return dates, close, high, low
+
+
+def expected(close, high, low):
+    s = pd.Series(close)
+    dif = s.ewm(span=12, adjust=False).mean() - s.ewm(span=26, adjust=False).mean()
+    dea = dif.ewm(span=9, adjust=False).mean()
+    prev = s.shift(1)
+    tr = pd.concat([pd.Series(high - low), (pd.Series(high) - prev).abs(), (pd.Series(low) - prev).abs()], axis=1)
+    return {
+        'dif': dif.values, 'dea': dea.values, 'hist': 2 * (dif - dea).values,
+        'atr': tr.max(axis=1).rolling(14).mean().values,
+        'ma5': s.rolling(5).mean().values, 'ma20': s.rolling(20).mean().values,
+    }
+
+
+def test_committed_values_match_pandas():
+    dates, close, high, low = daily()
+    engine = IndicatorEngine(CODES)
+    engine.sync(dates, close, high, low)
+    values = engine.values()
+    for i in range(len(CODES)):
+        exp = expected(close[i], high[i], low[i])
+        for name in exp:
+            np.testing.assert_allclose(values[name][i], exp[name][-1], rtol=1e-10, err_msg=name)
+    assert engine.date == dates[-1] and (values['count'] == 60).all()
+
+
+def test_what_if_leaves_state_untouched():
+    dates, close, high, low = daily()
+    engine = IndicatorEngine(CODES)
+    engine.sync(dates[:-1], close[:, :-1], high[:, :-1], low[:, :-1])
+    before = {k: np.array(v) for k, v in engine.get_state().items()}
+    guess = engine.what_if(close[:, -1], high=high[:, -1], low=low[:, -1])
+    # a subset of codes is evaluated on its own rows
+    subset = engine.what_if(close[[2, 0], -1], ['c', 'a'])
+    np.testing.assert_allclose(subset['dif'], guess['dif'][[2, 0]], rtol=1e-12)
+    for k, v in engine.get_state().items():
+        np.testing.assert_array_equal(v, before[k])
+    engine.commit(dates[-1], close[:, -1], high[:, -1], low[:, -1])
+    values = engine.values()
+    for name in ('dif', 'dea', 'hist', 'atr', 'ma5', 'ma20'):
+        np.testing.assert_allclose(guess[name], values[name], rtol=1e-10, err_msg=name)
+    np.testing.assert_allclose(guess['hist_prev'], engine.hist.lag(1), rtol=1e-10)
+
+
+def test_recommitting_a_date_replaces_the_bar():
+    dates, close, high, low = daily()
+    engine = IndicatorEngine(CODES)
+    engine.sync(dates[:-1], close[:, :-1], high[:, :-1], low[:, :-1])
+    engine.commit(dates[-1], close[:, -1] * 1.05, high[:, -1] * 1.05, low[:, -1])
+    engine.sync(dates[-1:], close[:, -1:], high[:, -1:], low[:, -1:])
+    fresh = IndicatorEngine(CODES)
+    fresh.sync(dates, close, high, low)
+    for name, v in fresh.values().items():
+        np.testing.assert_allclose(engine.values()[name], v, rtol=1e-12, err_msg=name)
+    # older dates are ignored
+    engine.commit(dates[0], close[:, 0])
+    assert engine.date == dates[-1]
+
+
+def test_recommit_after_restore():
+    dates, close, high, low = daily()
+    engine = IndicatorEngine(CODES)
+    engine.sync(dates[:-1], close[:, :-1], high[:, :-1], low[:, :-1])
+    engine.commit(dates[-1], close[:, -1] * 1.05, high[:, -1] * 1.05, low[:, -1])
+    restored = IndicatorEngine([])
+    restored.set_state({k: np.array(v) for k, v in engine.get_state().items()})
+    restored.commit(dates[-1], close[:, -1], high[:, -1], low[:, -1])
+    fresh = IndicatorEngine(CODES)
+    fresh.sync(dates, close, high, low)
+    assert (restored.values()['count'] == 60).all()
+    for name, v in fresh.values().items():
+        np.testing.assert_allclose(restored.values()[name], v, rtol=1e-12, err_msg=name)
+
+
+def test_missing_bars_keep_each_code_state():
+    dates, close, high, low = daily()
+    gapped = close.copy()
+    gapped[1, 30:35] = np.nan
+    engine = IndicatorEngine(CODES)
+    engine.sync(dates, gapped, high, low)
+    values = engine.values()
+    # a suspended code sees only its own bars, the others are unaffected
+    kept = np.r_[0:30, 35:60]
+    exp = expected(close[1, kept], high[1, kept], low[1, kept])
+    np.testing.assert_allclose(values['dif'][1], exp['dif'][-1], rtol=1e-10)
+    np.testing.assert_allclose(values['ma20'][1], exp['ma20'][-1], rtol=1e-10)
+    assert values['count'][1] == 55
+    np.testing.assert_allclose(values['dif'][0], expected(close[0], high[0], low[0])['dif'][-1], rtol=1e-10)
+
+
+def test_added_codes_start_empty():
+    dates, close, high, low = daily()
+    engine = IndicatorEngine(CODES[:2])
+    engine.sync(dates[:30], close[:2, :30], high[:2, :30], low[:2, :30])
+    engine.add_codes(['c', 'a'])
+    assert engine.codes == CODES
+    engine.sync(dates[30:], close[:, 30:], high[:, 30:], low[:, 30:])
+    values = engine.values()
+    assert values['count'].tolist() == [60, 60, 30]
+    np.testing.assert_allclose(values['ma20'][2], close[2, -20:].mean(), rtol=1e-10)
+
+
+def test_kernels_match_pandas_per_row():
+    dates, close, high, low = daily()
+    before = close.copy()
+    dif, dea, hist = macd(close)
+    kernel_atr = atr(high, low, close)
+    np.testing.assert_array_equal(close, before)
+    for i in range(len(CODES)):
+        exp = expected(close[i], high[i], low[i])
+        np.testing.assert_allclose(dif[i], exp['dif'], rtol=1e-10)
+        np.testing.assert_allclose(hist[i], exp['hist'], rtol=1e-10)
+        np.testing.assert_allclose(kernel_atr[i], exp['atr'], rtol=1e-10, equal_nan=True)
+        s = pd.Series(close[i])
+        np.testing.assert_allclose(ma(close, 5)[i], exp['ma5'], rtol=1e-10, equal_nan=True)
+        np.testing.assert_allclose(rolling_max(close, 10)[i], s.rolling(10).max().values, equal_nan=True)
+        np.testing.assert_allclose(rolling_min(close, 10)[i], s.rolling(10).min().values, equal_nan=True)
+        np.testing.assert_allclose(returns(close, 10)[i], s.pct_change(10).values, rtol=1e-10, equal_nan=True)
+        expected_z = ((s - s.rolling(20).mean()) / s.rolling(20).std()).values
+        np.testing.assert_allclose(zscore(close, 20)[i], expected_z, rtol=1e-6, equal_nan=True)
+
+
+def test_ema_fallback_matches_loop_and_skips_gaps():
+    values = np.array([[np.nan, 1.0, 2.0, np.nan, 4.0], [3.0, 3.0, np.nan, np.nan, 1.0]])
+    alpha = 2.0 / 4
+    expected_rows = _PyIndicator._ema_loop(values, alpha)
+    np.testing.assert_allclose(_PyIndicator._ema_numpy(values, alpha), expected_rows, equal_nan=True)
+    np.testing.assert_allclose(ema(values, 3), expected_rows, equal_nan=True)
+    np.testing.assert_allclose(ema(values[0], 3)[0], [np.nan, 1.0, 1.5, 1.5, 2.75], equal_nan=True)
+
+
+def test_market_data_matrix_right_aligns_each_code():
+    data = {
+        'a': pd.DataFrame({'close': [1.0, 2.0, 3.0]}),
+        'b': pd.DataFrame({'close': [5.0, 6.0]}),
+        'c': pd.DataFrame(),
+    }
+    result = market_data_matrix(data, ['a', 'b', 'c', 'd'], 'close')
+    np.testing.assert_array_equal(result, [[1, 2, 3], [np.nan, 5, 6], [np.nan] * 3, [np.nan] * 3])
+    np.testing.assert_array_equal(market_data_matrix(data, ['a'], 'close', 2), [[2, 3]])
+
+
+def test_recommit_after_codes_are_added_mid_day():
+    dates, close, high, low = daily()
+    engine = IndicatorEngine(CODES[:2])
+    engine.sync(dates[:-1], close[:2, :-1], high[:2, :-1], low[:2, :-1])
+    engine.commit(dates[-1], close[:2, -1] * 1.05, high[:2, -1], low[:2, -1])
+    engine.add_codes(['c'])
+    engine.commit(dates[-1], close[:, -1], high[:, -1], low[:, -1])
+    fresh = IndicatorEngine(CODES[:2])
+    fresh.sync(dates, close[:2], high[:2], low[:2])
+    values = engine.values()
+    assert values['count'].tolist() == [60, 60, 1]
+    for name, v in fresh.values().items():
+        np.testing.assert_allclose(values[name][:2], v, rtol=1e-12, err_msg=name)
+    assert values['close'][2] == close[2, -1]
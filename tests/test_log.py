@@ -0,0 +1,42 @@
+#coding:utf-8
+
+import datetime
+import os
+import threading
+
+from _PyLog import AsyncLogger
+
+
+def read_log(root, mode='prod', name='s'):
+    path = os.path.join(str(root), mode, name, datetime.date.today().strftime('%Y-%m-%d') + '.txt')
+    with open(path, encoding='gb2312') as f:
+        return f.read().splitlines()
+
+
+def test_lines_are_written_in_order_by_the_writer_thread(tmp_path):
+    logger = AsyncLogger(str(tmp_path), 's', batch_size=7)
+    for i in range(100):
+        logger.log('line %d' % i)
+    assert logger.flush(5)
+    assert read_log(tmp_path) == ['line %d' % i for i in range(100)]
+    assert logger.thread is not threading.current_thread()
+    logger.close()
+
+
+def test_close_writes_everything_and_drops_later_lines(tmp_path):
+    logger = AsyncLogger(str(tmp_path), 's', mode='backtest')
+    logger.log(u'买入 600000.SH')
+    logger.close()
+    assert logger.file is None
+    logger.log('after close')
+    assert logger.dropped == 1
+    assert read_log(tmp_path, 'backtest') == [u'买入 600000.SH']
+    logger.close()
+
+
+def test_loggers_append_to_the_same_day_file(tmp_path):
+    for text in ('first', 'second'):
+        logger = AsyncLogger(str(tmp_path), 's')
+        logger.log(text)
+        logger.close()
+    assert read_log(tmp_path) == ['first', 'second']
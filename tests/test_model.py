@@ -0,0 +1,222 @@
+#coding:utf-8
+
+import os
+import time
+import threading
+
+from concurrent import futures
+
+import numpy as np
+import pandas as pd
+
+from _PyModel import InferenceExecutor, ModelCache, ModelFitService, make_cache_key
+
+FIT_CALLS = []
+
+
+def fake_fit(series, steps=3, start_params=None, params=None):
+    # estimation returns the series mean as its only parameter, the filter keeps the given one
+    FIT_CALLS.append(len(series))
+    if params is None:
+        params = np.array([np.mean(series)])
+    if not np.isfinite(series).all():
+        raise ValueError('bad series')
+    return {
+        'params': params,
+        'forecast': np.full(steps, params[0]),
+        'resid_std': 1.0,
+        'start_params': start_params,
+    }
+
+
+def make_service(**kwargs):
+    kwargs.setdefault('backend', 'thread')
+    kwargs.setdefault('max_workers', 1)
+    return ModelFitService(fake_fit, **kwargs)
+
+
+def test_refit_schedule_and_warm_start():
+    service = make_service(refit_every=3, drift_threshold=0)
+    results = [service.submit('a', bar, np.arange(bar + 5.0), wait=True) for bar in range(7)]
+    assert [r['bar'] for r in results] == list(range(7))
+    assert [r['refit'] for r in results] == [True, False, False, True, False, False, True]
+    # between refits the parameters of the last estimation are reused, refits start from them
+    assert results[2]['params'][0] == results[0]['params'][0]
+    assert results[3]['start_params'][0] == results[0]['params'][0]
+    assert results[3]['params'][0] == np.mean(np.arange(8.0))
+    service.shutdown()
+
+
+def test_drift_forces_refit():
+    service = make_service(refit_every=0, drift_threshold=3.0)
+    series = np.ones(10)
+    service.submit('a', 0, series, wait=True)
+    assert not service.submit('a', 1, np.append(series, 1.5), wait=True)['refit']
+    # the new point misses the last one-step forecast by more than 3 residual stds
+    assert service.submit('a', 2, np.append(series, 10.0), wait=True)['refit']
+    service.shutdown()
+
+
+def test_results_are_cached_per_bar():
+    service = make_service()
+    first = service.submit('a', 0, np.ones(5), wait=True)
+    assert service.submit('a', 0, np.zeros(5), wait=True) is first
+    assert service.forecast('a', 0) is first
+    assert service.forecast('a', 1) is None
+    assert service.forecast('b') is None
+    service.shutdown()
+
+
+def test_failed_estimation_retries_from_scratch():
+    service = make_service()
+    assert service.submit('a', 0, np.array([1.0, np.nan]), wait=True) is None
+    result = service.submit('a', 1, np.array([1.0, 3.0]), wait=True)
+    assert result['refit'] and result['params'][0] == 2.0
+    service.shutdown()
+
+
+def test_fits_default_to_a_thread_pool():
+    service = ModelFitService(fake_fit, max_workers=1)
+    assert isinstance(service.executor, futures.ThreadPoolExecutor)
+    service.shutdown()
+
+
+def test_process_pool_runs_module_level_fits():
+    service = ModelFitService(fake_fit, backend='process', max_workers=1)
+    result = service.submit('a', 0, np.arange(4.0), wait=True, timeout=60)
+    assert result['forecast'][0] == 1.5
+    service.shutdown()
+
+
+def test_cache_key_covers_data_params_and_version():
+    df = pd.DataFrame({'close': [1.0, 2.0]}, index=['20240102', '20240103'])
+    key = make_cache_key(df, {'a': 1, 'b': 2}, 'v1')
+    assert key == make_cache_key(df.copy(), {'b': 2, 'a': 1}, 'v1')
+    assert key != make_cache_key(df * 2, {'a': 1, 'b': 2}, 'v1')
+    assert key != make_cache_key(df, {'a': 1, 'b': 3}, 'v1')
+    assert key != make_cache_key(df, {'a': 1, 'b': 2}, 'v2')
+    assert make_cache_key(np.arange(3)) != make_cache_key(np.arange(3.0))
+
+
+def test_get_or_fit_reuses_stored_model(tmp_path):
+    cache = ModelCache(str(tmp_path))
+    calls = []
+    fit = lambda: calls.append(1) or {'coef': np.arange(3)}
+    model, hit = cache.get_or_fit(fit, np.ones(4), {'alpha': 1})
+    assert not hit
+    model, hit = ModelCache(str(tmp_path)).get_or_fit(fit, np.ones(4), {'alpha': 1})
+    assert hit and calls == [1]
+    np.testing.assert_array_equal(model['coef'], np.arange(3))
+
+
+def test_evict_by_age_then_least_recently_used(tmp_path):
+    cache = ModelCache(str(tmp_path))
+    for i, key in enumerate(('aa1', 'bb2', 'cc3')):
+        cache.put(key, np.zeros(1000))
+        os.utime(cache.path(key), (time.time() - 100 + i, time.time() - 100 + i))
+    os.utime(cache.path('aa1'), (time.time() - 5000, time.time() - 5000))
+    cache.get('bb2')
+    size = os.path.getsize(cache.path('bb2'))
+    cache.evict(max_bytes=size, max_age=1000)
+    assert cache.get('aa1') is None and cache.get('cc3') is None
+    assert cache.get('bb2') is not None
+    cache.clear()
+    assert cache.entries() == []
+
+
+def test_put_keeps_a_running_size_and_trims_to_low_water(tmp_path):
+    cache = ModelCache(str(tmp_path))
+    cache.put('aa1', np.zeros(100))
+    size = os.path.getsize(cache.path('aa1'))
+    cache = ModelCache(str(tmp_path), max_bytes=3 * size, low_water=0.6)
+    for i, key in enumerate(('bb2', 'cc3')):
+        cache.put(key, np.zeros(100))
+        os.utime(cache.path(key), (time.time() - 20 + 10 * i, time.time() - 20 + 10 * i))
+    os.utime(cache.path('aa1'), (time.time() - 30, time.time() - 30))
+    assert cache.total_bytes == 3 * size and cache.count == 3
+    # a fourth entry crosses max_bytes: the oldest entries go until 0.6 * max_bytes fits
+    cache.put('dd4', np.zeros(100))
+    assert cache.count == 1 and cache.total_bytes == size
+    assert cache.get('dd4') is not None and cache.get('aa1') is None
+
+
+def test_corrupt_entries_are_dropped(tmp_path):
+    cache = ModelCache(str(tmp_path))
+    cache.put('aa1', np.zeros(10))
+    with open(cache.path('aa1'), 'wb') as f:
+        f.write(b'\x80\x04')
+    assert cache.get('aa1') is None
+    assert not os.path.exists(cache.path('aa1'))
+
+
+def test_service_serves_cached_fits(tmp_path):
+    cache = ModelCache(str(tmp_path))
+    series = np.arange(6.0)
+    first = make_service(cache=cache, version='v1').submit('a', 0, series, wait=True)
+    del FIT_CALLS[:]
+    second = make_service(cache=cache, version='v1').submit('a', 0, series, wait=True)
+    assert FIT_CALLS == []
+    np.testing.assert_array_equal(second['forecast'], first['forecast'])
+    make_service(cache=cache, version='v2').submit('a', 0, series, wait=True)
+    assert FIT_CALLS == [6]
+
+
+class SumModel(object):
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = []
+
+    def predict(self, features):
+        self.batches.append(len(features))
+        time.sleep(self.delay)
+        return features.sum(axis=1)
+
+
+def test_requests_of_a_bar_run_as_one_batch():
+    model = SumModel()
+    executor = InferenceExecutor(model)
+    delivered = []
+    callback = lambda key, value: delivered.append((key, value, threading.current_thread().name))
+    for i, key in enumerate(('a', 'b', 'c')):
+        executor.submit(key, [i, 1.0], callback)
+    executor.poll(1.0)
+    assert model.batches == [3]
+    main = threading.current_thread().name
+    assert delivered == [('a', 1.0, main), ('b', 2.0, main), ('c', 3.0, main)]
+    assert executor.result('b') == 2.0 and executor.is_fresh('b')
+    executor.shutdown()
+
+
+def test_batch_size_sends_full_batches():
+    model = SumModel()
+    executor = InferenceExecutor(model, batch_size=2)
+    for i in range(5):
+        executor.submit(i, [i])
+    executor.poll(1.0)
+    assert model.batches == [2, 2, 1]
+    assert [executor.result(i) for i in range(5)] == [0, 1, 2, 3, 4]
+    executor.shutdown()
+
+
+def test_result_falls_back_to_last_prediction():
+    model = SumModel()
+    executor = InferenceExecutor(model, latency_budget=1.0)
+    executor.submit('a', [1.0])
+    assert executor.result('a') == 1.0
+    model.delay = 0.3
+    executor.submit('a', [5.0])
+    # no budget: the previous prediction comes back and is flagged stale
+    assert executor.result('a', latency_budget=0) == 1.0
+    assert not executor.is_fresh('a')
+    assert executor.result('a') == 5.0 and executor.is_fresh('a')
+    assert executor.latency['a'] >= 0.3
+    executor.shutdown()
+
+
+def test_process_backend_ships_the_model_once():
+    executor = InferenceExecutor(SumModel(), backend='process')
+    executor.submit('a', [1.0, 2.0])
+    executor.submit('b', [3.0, 4.0])
+    assert executor.result('b', latency_budget=60) == 7.0
+    assert executor.result('a') == 3.0
+    executor.shutdown()
@@ -0,0 +1,206 @@
+#coding:utf-8
+
+import math
+
+import numpy as np
+
+import _PyOption
+from _PyOption import (DIRECTION_SHORT, IVSurface, OptionChain, PortfolioGreeks, Smile, bsm_greeks, bsm_price
+    , implied_vol, norm_cdf, option_price, year_fraction)
+
+TODAY = '20240102'
+EXPIRIES = (20240131, 20240327)
+STRIKES = (2.6, 2.7, 2.8, 2.9, 3.0)
+
+
+def details():
+    # two expiries x five strikes x call/put, plus a code without option fields
+    result = {'510050.SH': {'ExpireDate': 0}}
+    for e in EXPIRIES:
+        for k in STRIKES:
+            for kind in ('CALL', 'PUT'):
+                code = '%s%d%s.SHO' % (kind[0], e, int(k * 1000))
+                result[code] = {'ExpireDate': e, 'VolumeMultiple': 10000
+                    , 'ExtendInfo': {'OptExercisePrice': k, 'optType': kind}}
+    return result
+
+
+def make_chain():
+    info = details()
+    return OptionChain.from_details('510050.SH', sorted(info, reverse=True), info.get, TODAY)
+
+
+def flat_prices(chain, spot, vol, rate=0.02):
+    return bsm_price(chain.is_call, spot, chain.strikes, chain.time_to_expiry(TODAY), rate, vol)
+
+
+def test_norm_cdf_and_put_call_parity():
+    x = np.linspace(-4, 4, 17)
+    expected = [0.5 * (1 + math.erf(v / math.sqrt(2))) for v in x]
+    np.testing.assert_allclose(norm_cdf(x), expected, atol=1e-7)
+    call = bsm_price(True, 3.0, 2.8, 0.25, 0.02, 0.2, 0.01)
+    put = bsm_price(False, 3.0, 2.8, 0.25, 0.02, 0.2, 0.01)
+    np.testing.assert_allclose(call - put, 3.0 * math.exp(-0.01 * 0.25) - 2.8 * math.exp(-0.02 * 0.25), atol=1e-7)
+
+
+def test_implied_vol_inverts_prices():
+    vols = np.array([0.05, 0.2, 0.6, 1.5])
+    is_call = np.array([True, False, True, False])
+    strikes = np.array([3.0, 2.9, 3.1, 3.6])
+    prices = bsm_price(is_call, 3.0, strikes, 0.3, 0.02, vols)
+    np.testing.assert_allclose(implied_vol(prices, is_call, 3.0, strikes, 0.3, 0.02), vols, atol=1e-5)
+    # below intrinsic, above the spot or expired: no vol
+    bad = implied_vol([0.4, 3.5, 0.1], [True, True, True], 3.0, [2.5, 2.5, 2.5], [0.3, 0.3, 0.0], 0.0)
+    assert np.isnan(bad).all()
+
+
+def test_quotes_and_year_fraction():
+    assert option_price({'bidPrice': [0.1, 0], 'askPrice': [0.12], 'lastPrice': 0.2}) == 0.11
+    assert option_price({'bidPrice': [0], 'askPrice': [0.12], 'lastPrice': 0.2}) == 0.2
+    assert np.isnan(option_price({'lastPrice': 0}))
+    np.testing.assert_allclose(year_fraction(TODAY, [20240112, 20240102]), [10 / 365.0, 1 / 365.0])
+
+
+def test_chain_is_sorted_by_expiry_strike_and_type():
+    chain = make_chain()
+    assert len(chain) == 20 and '510050.SH' not in chain.index
+    assert chain.codes[:2] == ['C202401312600.SHO', 'P202401312600.SHO']
+    assert chain.expiry_dates().tolist() == list(EXPIRIES)
+    assert chain.expiry_rows(20240327).tolist() == list(range(10, 20))
+    assert chain.rows(['P202401312600.SHO', 'x']).tolist() == [1, -1]
+    assert chain.multipliers[0] == 10000
+
+
+def test_smile_interpolates_through_its_points():
+    x, y = [-0.2, -0.1, 0.0, 0.1, 0.2], [0.3, 0.25, 0.22, 0.23, 0.26]
+    smile = Smile(x[::-1], y[::-1])
+    np.testing.assert_allclose(smile(x), y)
+    # flat outside the quoted range
+    assert smile(-1.0) == 0.3 and smile(1.0) == 0.26
+    np.testing.assert_allclose(Smile([0.0, 0.2], [0.2, 0.3])(0.1), 0.25)
+
+
+def test_surface_resolves_only_changed_quotes():
+    chain = make_chain()
+    surface = IVSurface(chain, rate=0.02)
+    prices = flat_prices(chain, 2.8, 0.25)
+    assert surface.refresh(2.8, prices, today=TODAY) == 20
+    np.testing.assert_allclose(surface.iv, 0.25, atol=1e-5)
+    assert sorted(surface.smiles) == list(EXPIRIES)
+    # one quote moves: only its row is solved again
+    code = chain.codes[3]
+    assert surface.refresh(2.8, [prices[3] * 1.1, 1.0], [code, 'x'], today=TODAY) == 1
+    assert surface.market_iv([code])[0] > 0.25
+    assert surface.refresh(2.8, [prices[3] * 1.1], [code], today=TODAY) == 0
+    # a spot move past the tolerance solves the whole chain
+    assert surface.refresh(2.9, today=TODAY) == 20
+
+
+def test_flat_surface_interpolates_flat():
+    chain = make_chain()
+    surface = IVSurface(chain, rate=0.02)
+    surface.refresh(2.8, flat_prices(chain, 2.8, 0.25), today=TODAY)
+    # between, before and after the fitted expiries and away from the quoted strikes
+    model = surface.interpolate([2.75, 2.75, 2.75, 3.5], [20240228, 20240110, 20240628, 20240228])
+    np.testing.assert_allclose(model, 0.25, atol=1e-4)
+    np.testing.assert_allclose(surface.model_iv(chain.codes[:4]), 0.25, atol=1e-4)
+    assert np.isnan(surface.model_iv(['x'])[0])
+
+
+def test_surface_follows_quote_pushes(monkeypatch):
+    monkeypatch.setattr(_PyOption.time, 'strftime', lambda fmt: TODAY)
+    chain = make_chain()
+    surface = IVSurface(chain, rate=0.02)
+    prices = flat_prices(chain, 2.8, 0.3)
+    ticks = {code: {'lastPrice': p} for code, p in zip(chain.codes, prices)}
+    ticks['510050.SH'] = {'lastPrice': 2.8}
+    surface.on_quote(ticks)
+    np.testing.assert_allclose(surface.iv, 0.3, atol=1e-5)
+
+
+def test_greeks_match_finite_differences():
+    is_call = np.array([True, False])
+    args = (np.array([2.8, 2.9]), 0.2, 0.02, 0.25, 0.01)
+    greeks = bsm_greeks(is_call, 3.0, *args)
+    h = 1e-4
+    price = lambda spot=3.0, t=0.2, vol=0.25: bsm_price(is_call, spot, args[0], t, 0.02, vol, 0.01)
+    np.testing.assert_allclose(greeks['delta'], (price(3.0 + h) - price(3.0 - h)) / (2 * h), rtol=1e-4)
+    np.testing.assert_allclose(greeks['gamma'], (price(3.0 + h) - 2 * price() + price(3.0 - h)) / (h * h), rtol=1e-3)
+    np.testing.assert_allclose(greeks['vega'], (price(vol=0.25 + h) - price(vol=0.25 - h)) / (2 * h), rtol=1e-4)
+    np.testing.assert_allclose(greeks['theta'], -(price(t=0.2 + h) - price(t=0.2 - h)) / (2 * h), rtol=1e-3)
+
+
+def position(code, volume, direction=48, account=''):
+    name, market = code.split('.')
+    return type('Position', (object,), {'m_strInstrumentID': name, 'm_strExchangeID': market, 'm_nVolume': volume
+        , 'm_nDirection': direction, 'm_strAccountID': account})()
+
+
+def test_portfolio_greeks_net_long_short_and_underlying():
+    chain = make_chain()
+    book = PortfolioGreeks(chain, rate=0.02, default_vol=0.3, band=500)
+    call, put = chain.codes[4], chain.codes[5]
+    book.load([position(call, 3), position(call, 1, DIRECTION_SHORT), position(put, 1), position('x.SHO', 9)])
+    book.on_position(position('510050.SH', 1000))
+    totals = book.update(2.8, TODAY)
+    t = year_fraction(TODAY, chain.expiries[[4, 5]])
+    greeks = bsm_greeks(chain.is_call[[4, 5]], 2.8, chain.strikes[[4, 5]], t, 0.02, 0.3)
+    for name in ('delta', 'gamma', 'vega', 'theta'):
+        expected = 20000 * greeks[name][0] + 10000 * greeks[name][1] + (1000 if name == 'delta' else 0)
+        np.testing.assert_allclose(totals[name], expected, err_msg=name)
+    exposure = book.exposure()
+    assert exposure[call]['units'] == 20000 and exposure[put]['vol'] == 0.3
+    # delta outside the band is hedged in whole lots of the underlying
+    assert book.hedge_quantity() == -int(round(totals['delta'] / 100)) * 100
+    book.band = abs(totals['delta'])
+    assert book.hedge_quantity() == 0
+
+
+def test_portfolio_greeks_ignore_other_accounts_and_price_on_the_chain_day():
+    chain = make_chain()
+    book = PortfolioGreeks(chain, default_vol=0.3, account_id='acc')
+    call = chain.codes[4]
+    book.on_position(position(call, 2, account='acc'))
+    book.on_position(position(chain.codes[5], 5, account='other'))
+    assert book.volumes == {(call, 48): 2}
+    book.on_quote({'510050.SH': {'lastPrice': 2.8}})
+    # time to expiry runs from the chain's trading day, not the wall clock
+    assert book.today == TODAY
+    np.testing.assert_allclose(book.totals['delta'], book.update(2.8, TODAY)['delta'])
+
+
+def test_portfolio_greeks_read_vols_from_the_surface():
+    chain = make_chain()
+    surface = IVSurface(chain, rate=0.02)
+    surface.refresh(2.8, flat_prices(chain, 2.8, 0.2), today=TODAY)
+    book = PortfolioGreeks(chain, rate=0.02, surface=surface)
+    book.set_position(chain.codes[0], 1)
+    book.update(2.8, TODAY)
+    np.testing.assert_allclose(book.exposure()[chain.codes[0]]['vol'], 0.2, atol=1e-5)
+    version = surface.version
+    surface.refresh(2.8, flat_prices(chain, 2.8, 0.4), today=TODAY)
+    assert surface.version == version + 1
+    # the next update re-reads the vols the surface just solved
+    book.update(2.8, TODAY)
+    np.testing.assert_allclose(book.exposure()[chain.codes[0]]['vol'], 0.4, atol=1e-5)
+
+
+def test_surface_and_greeks_move_to_a_rebuilt_chain():
+    chain = make_chain()
+    surface = IVSurface(chain, rate=0.02)
+    surface.refresh(2.8, flat_prices(chain, 2.8, 0.25), today=TODAY)
+    greeks = PortfolioGreeks(chain, surface=surface)
+    greeks.set_position(chain.codes[0], 1)
+    greeks.set_position(chain.codes[12], 2)
+    # the first expiry is gone, one new contract is listed
+    info = details()
+    info['C202406282800.SHO'] = {'ExpireDate': 20240628, 'VolumeMultiple': 10000
+        , 'ExtendInfo': {'OptExercisePrice': 2.8, 'optType': 'CALL'}}
+    codes = [c for c in info if '20240131' not in c]
+    rebuilt = OptionChain.from_details('510050.SH', codes, info.get, TODAY)
+    surface.set_chain(rebuilt)
+    assert len(surface.prices) == 11 and np.isnan(surface.prices[-1])
+    assert surface.prices[2] == flat_prices(chain, 2.8, 0.25)[12] and surface.smiles == {}
+    assert surface.refresh(2.8, today=TODAY) == 11
+    greeks.set_chain(rebuilt)
+    assert greeks.volumes == {(chain.codes[12], 48): 2}
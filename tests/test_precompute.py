@@ -0,0 +1,75 @@
+#coding:utf-8
+
+import numpy as np
+import pandas as pd
+
+from _PyIndicator import atr, ma
+from _PyPrecompute import DailyTable, PrecomputeJob
+
+
+def frame(days, start=10.0):
+    close = start + np.arange(len(days), dtype=float)
+    return pd.DataFrame({'open': close, 'high': close + 0.5, 'low': close - 0.5, 'close': close
+        , 'volume': np.full(len(days), 1e5)}, index=days)
+
+
+DAYS = ['202401%02d' % d for d in range(2, 12)]
+
+
+class FakeFetch(object):
+    def __init__(self, data):
+        self.data = data
+        self.calls = []
+
+    def __call__(self, fields, codes, period, end_time, count, dividend_type):
+        self.calls.append((end_time, count, dividend_type))
+        return {c: self.data[c][[d <= end_time for d in self.data[c].index]] for c in codes if c in self.data}
+
+
+def make_job(tmp_path, **kwargs):
+    job = PrecomputeJob('s', ['a', 'b', 'c'], str(tmp_path), count=5, **kwargs)
+    job.register('ma3', lambda bars: ma(bars['close'], 3)[:, -1])
+    job.register('', lambda bars: {'atr2': atr(bars['high'], bars['low'], bars['close'], 2)[:, -1]
+        , 'last_close': bars['close'][:, -1]})
+    return job
+
+
+def test_run_writes_one_table_per_day(tmp_path):
+    fetch = FakeFetch({'a': frame(DAYS), 'b': frame(DAYS[:7], 20.0)})
+    job = make_job(tmp_path)
+    table, _ = job.run_with(fetch, '20240111')
+    assert fetch.calls == [('20240111', 5, 'none')]
+    assert table.as_of == '20240111'
+    np.testing.assert_allclose(table.column('ma3'), [18.0, 25.0, np.nan])
+    assert table.row('b') == {'ma3': 25.0, 'atr2': 1.5, 'last_close': 26.0}
+    assert table.row('x') is None
+    loaded = job.load('20240111')
+    assert loaded.codes == ['a', 'b', 'c']
+    np.testing.assert_array_equal(loaded.column('atr2'), table.column('atr2'))
+
+
+def test_bars_right_align_and_drop_unfinished_days(tmp_path):
+    job = make_job(tmp_path)
+    bars = job.bars({'a': frame(DAYS), 'b': frame(DAYS[:2])}, before='20240111')
+    np.testing.assert_array_equal(bars['close'][0], [14, 15, 16, 17, 18])
+    np.testing.assert_array_equal(bars['close'][1], [np.nan, np.nan, np.nan, 10, 11])
+    assert np.isnan(bars['close'][2]).all()
+
+
+class Calendar(object):
+    def __init__(self, days):
+        self.days = days
+
+    def get_trading_dates(self, stock_code, start_date, end_date, count, period):
+        return [d for d in self.days if d <= end_date][-count:]
+
+
+def test_load_previous_only_accepts_the_previous_trading_day(tmp_path):
+    job = make_job(tmp_path)
+    calendar = Calendar(['20240105', '20240108', '20240109', '20240110'])
+    for day in ('20240105', '20240109'):
+        DailyTable(day, ['a'], {'x': np.array([1.0])}).save(job.path(day))
+    assert job.load_previous(calendar, '20240110').as_of == '20240109'
+    # the run after 20240108 is missing: the older table is not used
+    assert job.load_previous(calendar, '20240109') is None
+    assert job.load_previous(calendar, '20240105') is None
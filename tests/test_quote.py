@@ -0,0 +1,108 @@
+#coding:utf-8
+
+import numpy as np
+
+from _PyQuote import TRIGGER_BELOW, PriceCache, TickSnapshot, TriggerEngine
+
+
+def push(engine, prices):
+    return engine.on_quote({code: {'lastPrice': price} for code, price in prices.items()})
+
+
+def test_conditions_fire_once_on_pushed_codes():
+    engine = TriggerEngine()
+    fired = []
+    record = lambda trigger, price: fired.append((trigger.tag, price))
+    engine.below('a', 9.0, record, tag='stop')
+    engine.above('b', 11.0, record, tag='take')
+    engine.cross('c', 5.0, record, tag='cross', once=False)
+    engine.percent('d', 20.0, -0.05, record, tag='drop')
+    push(engine, {'a': 9.5, 'b': 10.0, 'c': 4.0, 'd': 19.5})
+    assert fired == []
+    push(engine, {'a': 9.0, 'c': 5.5, 'd': 18.9})
+    assert sorted(fired) == [('cross', 5.5), ('drop', 18.9), ('stop', 9.0)]
+    # once triggers are gone, the cross trigger fires again on the way back
+    del fired[:]
+    push(engine, {'a': 8.0, 'c': 4.5, 'd': 18.0, 'b': 12.0})
+    assert sorted(fired) == [('cross', 4.5), ('take', 12.0)]
+    assert [t.tag for t in engine.find()] == ['cross']
+
+
+def test_rows_without_a_push_are_not_evaluated():
+    engine = TriggerEngine()
+    fired = []
+    engine.below('a', 10.0, lambda trigger, price: fired.append(trigger.code), once=False)
+    push(engine, {'a': 9.0})
+    push(engine, {'b': 1.0, 'a': 0})
+    assert fired == ['a']
+    assert engine.price[engine.index['a']] == 9.0
+
+
+def test_batch_adds_and_clear_by_tag():
+    engine = TriggerEngine()
+    fired = []
+    engine.add_many(['a', 'b', 'c'], TRIGGER_BELOW, [9.0, np.nan, 7.0], lambda t, p: fired.append(t.code), tag='atr')
+    engine.percent_many(['a', 'b'], [10.0, 10.0], [0.1, -0.1], lambda t, p: fired.append(t.code + '%'), tag='pct')
+    assert len(engine.find(tag='atr')) == 2 and len(engine.find(tag='pct')) == 2
+    engine.clear(tag='pct')
+    push(engine, {'a': 12.0, 'b': 8.0, 'c': 6.0})
+    assert fired == ['c']
+
+
+def test_a_failing_callback_does_not_stop_the_others(capsys):
+    engine = TriggerEngine()
+    fired = []
+    engine.below('a', 10.0, lambda t, p: 1 / 0)
+    engine.below('a', 10.0, lambda t, p: fired.append(p))
+    push(engine, {'a': 9.0})
+    assert fired == [9.0]
+    assert 'ZeroDivisionError' in capsys.readouterr().err
+
+
+def tick(last, pre_close, bids=(), volume=100):
+    return {'lastPrice': last, 'lastClose': pre_close, 'open': pre_close, 'high': last, 'low': last, 'volume': volume
+        , 'amount': last * volume, 'timetag': '20240105 09:25:03', 'bidPrice': list(bids), 'askPrice': [last + 0.01] * 5
+        , 'bidVol': [1] * len(bids), 'askVol': [2] * 5}
+
+
+def test_snapshot_columns_and_selection():
+    ticks = {'a': tick(10.5, 10.0, bids=(10.49, 10.48)), 'b': tick(9.0, 10.0), 'c': tick(11.0, 10.0)}
+    snapshot = TickSnapshot().fill(ticks, ['a', 'b', 'c', 'd'])
+    np.testing.assert_array_equal(snapshot['lastPrice'][:3], [10.5, 9.0, 11.0])
+    assert snapshot.valid.tolist() == [True, True, True, False]
+    np.testing.assert_array_equal(snapshot['bidPrice'][0], [10.49, 10.48, np.nan, np.nan, np.nan])
+    assert snapshot.timetag[0] == '20240105 09:25:03'
+    assert snapshot.select(snapshot['lastPrice'] > snapshot['lastClose']) == ['a', 'c']
+    subset = snapshot.subset(['c', 'x', 'a'], ['lastPrice', 'askVol'])
+    np.testing.assert_array_equal(subset['lastPrice'], [11.0, np.nan, 10.5])
+    assert subset['askVol'].shape == (3, 5)
+
+
+def test_refresh_reuses_buffers_for_the_same_codes():
+    snapshot = TickSnapshot()
+    requested = []
+
+    def get_full_tick(codes):
+        requested.append(codes)
+        return {'a': tick(10.0, 9.0), 'b': tick(5.0, 5.0)}
+    snapshot.refresh(get_full_tick, ['SH'])
+    column = snapshot['lastPrice']
+    snapshot.refresh(get_full_tick)
+    assert requested == [['SH'], ['a', 'b']]
+    assert snapshot['lastPrice'] is column
+    snapshot.fill({'a': tick(1.0, 1.0)})
+    assert snapshot.codes == ['a'] and snapshot['lastPrice'] is not column
+
+
+def test_price_cache_keeps_the_last_push_per_code():
+    cache = PriceCache(capacity=2)
+    cache.on_quote({'a': {'lastPrice': 10.0, 'high': 10.5, 'volume': 100}, 'b': {'lastPrice': 0}})
+    cache.on_quote({'c': {'lastPrice': 3.0}, 'a': {'lastPrice': 10.2, 'high': 10.6, 'volume': 150}})
+    # rows grow past the initial capacity, a code without a price keeps its row
+    assert cache.codes == ['a', 'b', 'c'] and cache.missing(['a', 'b', 'd']) == ['d']
+    np.testing.assert_array_equal(cache.prices(['c', 'a', 'b', 'd']), [3.0, 10.2, np.nan, np.nan])
+    bars = cache.bars(['a'])
+    assert bars['high'][0] == 10.6 and bars['volume'][0] == 150 and np.isnan(bars['open'][0])
+    ages = cache.age(['a', 'b'])
+    assert 0 <= ages[0] < 60 and ages[1] > 1e6
+    assert np.isinf(cache.age(['d'])[0])
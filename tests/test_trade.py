@@ -0,0 +1,319 @@
+#coding:utf-8
+
+import time
+
+import pytest
+
+from _PyTrade import BUY_OP_TYPES, BasketTrader, OrderIdGenerator, OrderManager, PositionBook, is_buy, op_side
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def stock_position(code, volume, can_use=None, market='SH', account='acc'):
+    return Obj(m_strInstrumentID=code, m_strExchangeID=market, m_nVolume=volume
+        , m_nCanUseVolume=volume if can_use is None else can_use, m_dOpenPrice=10.0, m_dLastPrice=10.0
+        , m_dMarketValue=volume * 10.0, m_strAccountID=account)
+
+
+def stock_account(available, balance=100000.0, account='acc'):
+    return Obj(m_dBalance=balance, m_dAvailable=available, m_dInstrumentValue=0.0, m_dFrozenCash=0.0
+        , m_strAccountID=account)
+
+
+def stock_deal(offset, volume, trade_id, code='600000', price=10.0, order_id='', account='acc', market='SH'):
+    return Obj(m_strInstrumentID=code, m_strExchangeID=market, m_nOffsetFlag=offset, m_nVolume=volume
+        , m_dPrice=price, m_dTradeAmount=volume * price, m_strTradeID=trade_id, m_strOrderSysID=order_id
+        , m_strAccountID=account)
+
+
+def stock_order(offset, status, volume, traded, order_id, code='600000'):
+    return Obj(m_strInstrumentID=code, m_strExchangeID='SH', m_nOffsetFlag=offset, m_nOrderStatus=status
+        , m_nVolumeTotalOriginal=volume, m_nVolumeTraded=traded, m_dLimitPrice=10.0, m_strOrderSysID=order_id
+        , m_strAccountID='acc')
+
+
+class FakeQuery(object):
+    def __init__(self, positions=(), accounts=()):
+        self.data = {'POSITION': list(positions), 'ACCOUNT': list(accounts)}
+        self.calls = []
+
+    def __call__(self, account_id, account_type, kind):
+        self.calls.append(kind)
+        return self.data[kind]
+
+
+def make_book(reconcile_interval=60, **kwargs):
+    query = FakeQuery([stock_position('600000', 1000), stock_position('000001', 500, market='SZ')]
+        , [stock_account(50000.0)])
+    return PositionBook('acc', 'STOCK', query, reconcile_interval, **kwargs), query
+
+
+def test_book_is_seeded_once_and_views_are_cached():
+    book, query = make_book()
+    holdings = book.holdings()
+    assert holdings == {'600000.SH': 1000, '000001.SZ': 500}
+    assert book.asset('available') == 50000.0
+    assert book.holdings() is holdings
+    assert query.calls == ['POSITION', 'ACCOUNT']
+    book.on_deal(stock_deal(48, 100, 't1', code='600519'))
+    assert book.holdings() is not holdings
+    assert book.holdings()['600519.SH'] == 100
+
+
+def test_deals_update_positions_and_cash():
+    book, _ = make_book()
+    book.holdings()
+    book.on_deal(stock_deal(48, 200, 't1'))
+    book.on_deal(stock_deal(48, 200, 't1'))
+    book.on_deal(stock_deal(48, 200, 't2', account='other'))
+    assert book.volume('600000.SH') == 1200
+    # bought shares are not sellable today unless the book is T+0
+    assert book.volume('600000.SH', 'can_use_volume') == 1000
+    assert book.asset('available') == 48000.0
+    book.on_deal(stock_deal(49, 500, 't3', code='000001', market='SZ'))
+    assert book.volume('000001.SZ') == 0
+    assert '000001.SZ' not in book.holdings()
+    assert book.asset('available') == 53000.0
+
+
+def test_sell_orders_freeze_sellable_volume():
+    book, _ = make_book()
+    book.holdings()
+    book.on_order(stock_order(49, 50, 600, 0, 'o1'))
+    assert book.volume('600000.SH', 'can_use_volume') == 400
+    book.on_deal(stock_deal(49, 200, 't1', order_id='o1'))
+    assert book.volume('600000.SH') == 800
+    assert book.volume('600000.SH', 'can_use_volume') == 400
+    # cancelling the rest gives the unfilled 400 back
+    book.on_order(stock_order(49, 53, 600, 200, 'o1'))
+    assert book.volume('600000.SH', 'can_use_volume') == 800
+
+
+def test_position_and_account_pushes_replace_records():
+    book, _ = make_book()
+    book.holdings()
+    book.on_position(stock_position('600000', 300))
+    book.on_position(stock_position('000001', 0, market='SZ'))
+    book.on_position(stock_position('600519', 100, account='other'))
+    assert book.holdings() == {'600000.SH': 300}
+    book.on_account(stock_account(1234.0))
+    assert book.asset('available') == 1234.0
+
+
+def test_reconcile_interval():
+    book, query = make_book(reconcile_interval=0)
+    book.holdings()
+    book.asset()
+    assert query.calls == ['POSITION', 'ACCOUNT'] * 2
+    query.data['POSITION'] = [stock_position('600000', 700)]
+    assert book.reconcile() == {'600000.SH', '000001.SZ'}
+    assert book.holdings() == {'600000.SH': 700}
+
+
+def test_reconcile_once_per_bar():
+    bar = [10]
+    book, query = make_book(reconcile_interval=0, bar_key=lambda: bar[0])
+    book.holdings()
+    book.asset()
+    book.volume('600000.SH')
+    assert query.calls == ['POSITION', 'ACCOUNT']
+    query.data['POSITION'] = [stock_position('600000', 700)]
+    assert book.holdings()['600000.SH'] == 1000
+    bar[0] = 11
+    assert book.holdings() == {'600000.SH': 700}
+    book.asset()
+    assert query.calls == ['POSITION', 'ACCOUNT'] * 2
+
+
+class FakePassorder(object):
+    def __init__(self, fail_codes=()):
+        self.sent = []
+        self.fail_codes = fail_codes
+
+    def __call__(self, op_type, order_type, account_id, code, pr_type, price, volume, strategy_name, quick_trade
+            , user_order_id, ContextInfo):
+        if code in self.fail_codes:
+            raise RuntimeError('rejected')
+        self.sent.append((op_type, code, price, volume, user_order_id))
+
+
+def test_order_ids_strictly_increase():
+    ids = OrderIdGenerator('s')
+    values = [ids.next() for _ in range(5)]
+    assert all(v.startswith('s') for v in values)
+    numbers = [int(v[1:]) for v in values]
+    assert numbers == sorted(set(numbers))
+
+
+def test_traders_share_one_id_sequence():
+    first = BasketTrader('acc', 'a', FakePassorder(), rate=0, id_prefix='x')
+    second = BasketTrader('acc', 'b', FakePassorder(), rate=0, id_prefix='x')
+    ids = [t.user_order_id for trader in (first, second, first) for t in trader.submit([{'code': 'a', 'volume': 1}], None)]
+    assert len(set(ids)) == 3 and all(i.startswith('x') for i in ids)
+
+
+def test_basket_throttles_and_pumps_the_rest():
+    passorder = FakePassorder()
+    trader = BasketTrader('acc', 'strategy', passorder, rate=1000.0, burst=2)
+    orders = [{'code': c, 'volume': 100, 'price': 10.0} for c in ('a', 'b', 'c', 'd')]
+    tickets = trader.submit(orders, None)
+    assert [s[1] for s in passorder.sent] == ['a', 'b']
+    assert len(trader.queue) == 2
+    time.sleep(0.01)
+    assert trader.pump(None) == 0
+    assert [s[1] for s in passorder.sent] == ['a', 'b', 'c', 'd']
+    assert [s[4] for s in passorder.sent] == [t.user_order_id for t in tickets]
+    assert passorder.sent[0][0] == 23
+
+
+def test_tickets_resolve_on_order_and_error_callbacks():
+    trader = BasketTrader('acc', 'strategy', FakePassorder(fail_codes=('c',)), rate=0)
+    a, b, c = trader.submit([{'code': code, 'volume': 100} for code in 'abc'], None)
+    assert c.done() and isinstance(c.future.exception(), RuntimeError)
+    ack = Obj(m_strRemark=a.user_order_id, m_nOrderStatus=50)
+    trader.on_order(ack)
+    assert a.result(0) is ack and a.latency >= 0
+    trader.on_order_error(Obj(userOrderId=b.user_order_id), 'no money')
+    assert str(b.future.exception()) == 'no money'
+    summary = trader.latency()
+    assert summary['count'] == 2 and summary['pending'] == 0
+
+
+def test_backtest_tickets_resolve_on_send():
+    manager = OrderManager()
+    trader = BasketTrader('acc', 'strategy', FakePassorder(), rate=0, manager=manager, confirm_on_send=True)
+    first, = trader.submit([{'code': 'a', 'volume': 100, 'op_type': 24}], None)
+    assert first.done() and first.result(0) is None and trader.pending == {}
+    assert manager.get(first.user_order_id).state == 'sent' and manager.open_orders('a', 'sell') == []
+
+
+def managed_order(remark, status, volume, traded, sys_id='', code='600000'):
+    return Obj(m_strInstrumentID=code, m_strExchangeID='SH', m_strRemark=remark, m_strOrderSysID=sys_id
+        , m_nOrderStatus=status, m_nVolumeTotalOriginal=volume, m_nVolumeTraded=traded, m_dLimitPrice=10.0
+        , m_nOffsetFlag=48, m_strAccountID='acc')
+
+
+def test_order_manager_tracks_the_order_lifecycle():
+    manager = OrderManager()
+    fills = []
+    manager.add_fill_listener(fills.append)
+    manager.on_submit('u1', {'code': '600000.SH', 'op_type': 23, 'price': 10.0, 'volume': 300}, 'acc')
+    manager.on_submit('u2', {'code': '600000.SH', 'op_type': 24, 'price': 10.5, 'volume': 100}, 'acc')
+    assert manager.levels('600000.SH', 'buy') == {10.0: 300}
+    assert [o.user_order_id for o in manager.open_orders('600000.SH', 'sell')] == ['u2']
+    manager.on_order(managed_order('u1', 50, 300, 0, sys_id='s1'))
+    # deals only carry the exchange order id
+    manager.on_deal(Obj(m_strTradeID='t1', m_strOrderSysID='s1', m_nVolume=100, m_dPrice=10.0))
+    manager.on_deal(Obj(m_strTradeID='t1', m_strOrderSysID='s1', m_nVolume=100, m_dPrice=10.0))
+    order = manager.get('u1')
+    assert order.state == 'partially_filled' and order.remaining == 200
+    assert manager.level_volume('600000.SH', 'buy', 10.0) == 200
+    manager.on_deal(Obj(m_strTradeID='t2', m_strOrderSysID='s1', m_nVolume=200, m_dPrice=9.99))
+    assert order.state == 'filled' and order.remaining == 0
+    assert abs(order.average_price - (1000 + 1998) / 300.0) < 1e-9
+    assert manager.levels('600000.SH', 'buy') == {}
+    assert [f['volume'] for f in fills] == [100, 200] and fills[-1]['remaining'] == 0
+    assert len(manager.drain_fills()) == 2 and manager.drain_fills() == []
+    manager.on_order_error(Obj(userOrderId='u2'), 'limit')
+    assert manager.get('u2').state == 'rejected' and manager.open_orders() == []
+
+
+def test_order_manager_cancels_by_level():
+    cancelled = []
+    manager = OrderManager(lambda sys_id, account_id, account_type, ContextInfo: cancelled.append(sys_id) or True)
+    for i in range(3):
+        manager.on_submit('u%d' % i, {'code': 'a', 'op_type': 24, 'price': 11.0, 'volume': 100}, 'acc')
+    manager.on_order(managed_order('u0', 50, 100, 0, sys_id='s0', code='a'))
+    manager.on_order(managed_order('u1', 50, 100, 0, sys_id='s1', code='a'))
+    # u2 has no exchange id yet and cannot be cancelled
+    assert sorted(manager.cancel_level('a', 'sell', 11.0, None)) == ['u0', 'u1']
+    assert sorted(cancelled) == ['s0', 's1']
+    manager.on_order(managed_order('u0', 54, 100, 0, sys_id='s0', code='a'))
+    assert manager.get('u0').state == 'cancelled'
+    assert manager.level_volume('a', 'sell', 11.0) == 200
+
+
+def test_basket_trader_feeds_the_order_manager():
+    manager = OrderManager()
+    trader = BasketTrader('acc', 'strategy', FakePassorder(fail_codes=('b',)), rate=0, manager=manager)
+    a, b = trader.submit([{'code': 'a', 'volume': 100, 'price': 10.0}, {'code': 'b', 'volume': 100}], None)
+    assert manager.get(a.user_order_id).state == 'submitted'
+    assert manager.get(b.user_order_id).state == 'rejected'
+    untracked = OrderManager(track_external=True)
+    untracked.on_order(managed_order('manual', 50, 100, 0, sys_id='s9'))
+    assert untracked.get('manual').side == 'buy'
+
+
+def deal(direction, offset, volume=1, trade_id='1', remark='', code='rb2405', market='SF'):
+    return Obj(m_strInstrumentID=code, m_strExchangeID=market, m_nDirection=direction, m_nOffsetFlag=offset
+        , m_nVolume=volume, m_dPrice=3700.0, m_dTradeAmount=0, m_strTradeID=trade_id, m_strRemark=remark
+        , m_strOrderSysID='', m_strAccountID='acc')
+
+
+def test_futures_op_sides():
+    # 0 open long, 3 open short, 1/2 close long, 4/5 close short
+    assert op_side(0) == 'buy'
+    assert op_side(3) == 'sell'
+    for op_type in (1, 2, 6, 7, 10, 11, 24, 34):
+        assert op_side(op_type) == 'sell'
+    for op_type in (4, 5, 8, 9, 12, 13, 14, 23, 33):
+        assert op_side(op_type) == 'buy'
+    assert BUY_OP_TYPES == {0, 4, 5, 8, 9, 12, 13, 14, 23, 33}
+
+
+def test_is_buy_reads_direction():
+    # closing a short is a buy although its offset flag is close; opening a short is a sell
+    assert is_buy(deal(48, 49))
+    assert not is_buy(deal(49, 48))
+    # objects without a direction fall back to the offset flag
+    assert is_buy(Obj(m_nOffsetFlag=48))
+    assert not is_buy(Obj(m_nOffsetFlag=49))
+
+
+def test_order_manager_futures_levels_and_fills():
+    manager = OrderManager()
+    fills = []
+    manager.add_fill_listener(fills.append)
+    manager.on_submit('open_short', {'code': 'rb2405.SF', 'op_type': 3, 'price': 3710, 'volume': 2}, 'acc', 'FUTURE')
+    manager.on_submit('close_short', {'code': 'rb2405.SF', 'op_type': 5, 'price': 3690, 'volume': 1}, 'acc', 'FUTURE')
+    assert manager.levels('rb2405.SF', 'sell') == {3710.0: 2}
+    assert manager.levels('rb2405.SF', 'buy') == {3690.0: 1}
+    manager.on_deal(deal(48, 49, trade_id='t1', remark='close_short'))
+    assert fills[-1]['side'] == 'buy' and fills[-1]['remaining'] == 0
+    assert manager.levels('rb2405.SF', 'buy') == {}
+
+
+def test_position_book_only_follows_stock_accounts():
+    for account_type in ('FUTURE', 'STOCK_OPTION'):
+        with pytest.raises(ValueError):
+            PositionBook('acc', account_type, lambda *args: [])
+    book = PositionBook('acc', 'credit', lambda *args: [])
+    book.reconcile()
+    book.on_deal(deal(48, 48, volume=300, trade_id='t1', code='600000', market='SH'))
+    book.on_deal(deal(49, 49, volume=100, trade_id='t2', code='600000', market='SH'))
+    assert book.volume('600000.SH') == 200
+
+
+def order(direction, status, volume, traded, price, sys_id='o1', code='600000', market='SH'):
+    return Obj(m_strInstrumentID=code, m_strExchangeID=market, m_nDirection=direction, m_nOrderStatus=status
+        , m_nVolumeTotalOriginal=volume, m_nVolumeTraded=traded, m_dLimitPrice=price, m_strOrderSysID=sys_id
+        , m_strAccountID='acc')
+
+
+def test_position_book_buy_cash_reduced_once():
+    book = PositionBook('acc', 'STOCK', lambda *args: [])
+    book.reconcile()
+    book.account['available'] = 10000.0
+    book.on_order(order(48, 50, 100, 0, 10.0))
+    assert book.asset('available') == 9000.0
+    fill = deal(48, 48, volume=100, trade_id='t1', code='600000', market='SH')
+    fill.m_strOrderSysID = 'o1'
+    fill.m_dTradeAmount = 990.0
+    book.on_deal(fill)
+    assert book.asset('available') == 9000.0
+    # the unused part of the reservation is released when the order finishes
+    book.on_order(order(48, 56, 100, 100, 10.0))
+    assert book.asset('available') == 9010.0
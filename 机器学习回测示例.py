@@ -12,8 +12,10 @@ import pandas as pd
 import numpy as np
 import time
 from datetime import *
+import sklearn
 from sklearn import svm
 import traceback
+import _PyFeature
 def init(ContextInfo):
 	ContextInfo.stock = ContextInfo.stockcode + '.' + ContextInfo.market
 	ContextInfo.set_universe([ContextInfo.stock])
@@ -27,47 +29,23 @@ def handlebar(ContextInfo):
 	sell_condition = False
 	d = ContextInfo.barpos
 	if ContextInfo.days == 0:
-		#2016010120170101һѵ
-		df = ContextInfo.get_market_data(['open','high','low','close','volume'],stock_code=[ContextInfo.stock],start_time='20160101',end_time='20170101',dividend_type='front')
-		df = df.sort_index()
-		days = df.index.values
-		days_close = df['close'].values
+		#2016010120170101һѵֻȡһݣûͼ15
 		print('start training SVM')
-		x_all = []
-		y_all = []
-		for i in range(14, len(days) - 5):
-			start_day = days[i - 14]
-			end_day = days[i]
-			data = ContextInfo.get_market_data(['open','high','low','close','volume'],stock_code=[ContextInfo.stock],end_time=end_day,count=15,skip_paused=False,dividend_type='front')
-			data = data.sort_index()
-			open = data['open'].values
-			close = data['close'].values
-			max = data['high'].values
-			min = data['low'].values
-			volume = data['volume'].values
-			close_mean = close[-1] / np.mean(close)
-			volume_mean = volume[-1] / np.mean(volume)
-			max_mean = max[-1] / np.mean(max)
-			min_mean = min[-1] / np.mean(min)
-			vol = volume[-1]
-			return_now = close[-1] / close[0]
-			std = np.std(np.array(close), axis = 0)
-			#featuresڴ
-			features = [close_mean, volume_mean, max_mean, min_mean, vol, return_now, std]           #6Ϊ
-			x_all.append(features)
-
-		for i in range(len(days_close) - 19):
-			if days_close[i+19] > days_close[i+14]:
-				label = 1
-			else:
-				label = 0
-			y_all.append(label)
+		x_all, y_all, _ = _PyFeature.load_training_set(ContextInfo, [ContextInfo.stock], '20160101', '20170101', window=15, horizon=5)
 		x_train = x_all[:-1]
 		y_train = y_all[:-1]
 
-		ContextInfo.clf = svm.SVC(C=1.0, kernel='rbf', degree=3, gamma='auto', coef0=0.0, shrinking=True, probability=False,tol=0.001, cache_size=200, verbose=False, max_iter=-1, decision_function_shape='ovr', random_state=None)
+		svm_params = dict(C=1.0, kernel='rbf', degree=3, gamma='auto', coef0=0.0, shrinking=True, probability=False,tol=0.001, cache_size=200, verbose=False, max_iter=-1, decision_function_shape='ovr', random_state=None)
+		def fit_svm():
+			clf = svm.SVC(**svm_params)
+			clf.fit(x_train, y_train)
+			return clf
+		#ͬѵݡsklearn汾ģֱӴӴ̻ȡ
+		cache = ContextInfo.get_model_cache(max_bytes=200*1024*1024, max_age=30*86400)
 		try:
-			ContextInfo.clf.fit(x_train, y_train)
+			ContextInfo.clf, hit = cache.get_or_fit(fit_svm, (x_train, y_train), svm_params, sklearn.__version__)
+			if hit:
+				print('load SVM from cache')
 		except:
 			e = traceback.format_exc()
 			print(('value error, bar:', e))
@@ -88,22 +66,12 @@ def handlebar(ContextInfo):
 	if ContextInfo.holding == 0 and weekday == 1:            #ÿһжǷ񿪲
 		data = ContextInfo.get_market_data(['open','high','low','close','volume'],stock_code=[ContextInfo.stock],end_time=end_date,count=15,skip_paused=False, dividend_type='front')
 		data = data.sort_index()
-		close = data['close'].values
-		max = data['high'].values
-		min = data['low'].values
-		volume = data['volume'].values
-		close_mean = close[-1] / np.mean(close)
-		volume_mean = volume[-1] / np.mean(volume)
-		max_mean = max[-1] / np.mean(max)
-		min_mean = min[-1] / np.mean(min)
-		vol = volume[-1]
-		return_now = close[-1] / close[0]
-		std = np.std(np.array(close), axis = 0)
-
-		features = [close_mean, volume_mean, max_mean, min_mean, vol, return_now, std]
-		features = np.array(features).reshape(1, -1)
+		features = _PyFeature.window_features(data['high'].values, data['low'].values, data['close'].values, data['volume'].values, 15)
 		try:
-			prediction = ContextInfo.clf.predict(features)[0]
+			#Ԥŵִ̳߳Уʵɶʱͣزresult()ȴ5ȡؽ
+			executor = ContextInfo.get_inference_executor('svm', ContextInfo.clf)
+			executor.submit(ContextInfo.stock, features[0])
+			prediction = executor.result(ContextInfo.stock, latency_budget=5)
 			if prediction == 1:
 				ContextInfo.holding = int(ContextInfo.money*0.95/(open_today))/100
 				order_shares(ContextInfo.stock,ContextInfo.holding*100,'fix',open_today,ContextInfo,ContextInfo.accountid)
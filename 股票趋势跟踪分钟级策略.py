@@ -2,6 +2,8 @@
 import pandas as pd
 import numpy as np
 import time, os
+import _PyFactor
+import _PyIndicator
 from datetime import datetime 
 from pathlib import Path
 
@@ -15,129 +17,154 @@ BASE_DIR = Path('D:\
 # ָ㸨
 # --------------------------------------------------------
 def log(message):
+	# ͬһKֻʽһʱ䣻дļɺ̨߳ɣڷļز/ʵ̷Ŀ¼
 	global C
-	bar_timetag = C.get_bar_timetag(C.barpos)
-	current_time_log = timetag_to_datetime(bar_timetag, '%Y-%m-%d %H:%M')
-	# current_day = timetag_to_datetime(bar_timetag, '%Y%m%d')
-	# ȡǰʱ
-	now = datetime.now()
-
-	# תΪַ
-	date_str = now.strftime("%Y-%m-%d")
-	# BASE_DIR = Path(os.getcwd())
-	# print(f"Base Directory: {BASE_DIR}")
-	print(f"[{current_time_log}] {message}")
-	if C.do_back_test:
-		log_file = BASE_DIR / f"logs/backtest/{C.strategyName}/{date_str}.txt"
-	else:
-		log_file = BASE_DIR / f"logs/prod/{C.strategyName}/{date_str}.txt"
-
-	if not log_file.parent.exists():
-		log_file.parent.mkdir(parents=True)
-    
-	with open(log_file, 'a', encoding='gb2312') as f:
-		f.write(f"[{current_time_log}]{str(message)}" + '\n')
-
-#  ATR (Average True Range) - **V1.18.2 **
-def calculate_atr(df, period=14):
-	""" ָ (period)  ATR ָꡣҪ high, low, close С """
-	if df is None or len(df) < period:
-		return np.nan
-	
-	df['close'] = pd.to_numeric(df['close'], errors='coerce')
-	
-	# 1.  True Range (TR)
-	# TR = max[(H - L), abs(H - C_prev), abs(L - C_prev)]
-	df['prev_close'] = df['close'].shift(1)
-	df['high_minus_low'] = df['high'] - df['low']
-	df['high_minus_prev_close'] = abs(df['high'] - df['prev_close'])
-	df['low_minus_prev_close'] = abs(df['low'] - df['prev_close'])
-	# ʹ .max(axis=1) ҳÿһ (ÿһ) ֵ
-	tr = df[['high_minus_low', 'high_minus_prev_close', 'low_minus_prev_close']].max(axis=1)
-	
-	# 2.  ATR (Smoothed Moving Average of TR)
-	# ʹ SMA ʵ֣ȡµ period ƽֵ
-	atr = tr.iloc[-period:].mean()
-	
-	return atr # ATRľֵ (۸λ)
-
-# MACD ָ㺯 (ֲ)
-# **ע⣺˺һ close_series**
-def calculate_macd(close_series, short_period=12, long_period=26, signal_period=9):
-	"""  MACD ָ (DIF, DEA, MACD Hist) """
-	if close_series.empty or len(close_series) < long_period:
-		return np.nan, np.nan, np.nan
-	
-	ema_short = close_series.ewm(span=short_period, adjust=False).mean()
-	ema_long = close_series.ewm(span=long_period, adjust=False).mean()
-	
-	dif = ema_short - ema_long
-	dea = dif.ewm(span=signal_period, adjust=False).mean()
-	macd_hist = (dif - dea) * 2
-	
-	# 
-	return dif, dea, macd_hist
+	if getattr(g, 'LOG_BARPOS', None) != C.barpos:
+		g.LOG_BARPOS = C.barpos
+		g.LOG_TIME = timetag_to_datetime(C.get_bar_timetag(C.barpos), '%Y-%m-%d %H:%M')
+	print(f"[{g.LOG_TIME}] {message}")
+	C.get_logger(C.strategyName, str(BASE_DIR / 'logs')).log(f"[{g.LOG_TIME}]{str(message)}")
+
+def daily_indicators(bars, atr_period):
+	""" ̺Ԥ㣺bars Ϊֻߵ ( x ) 󣬷ش T-1 ָꡣ """
+	return {
+		'bars': np.isfinite(bars['close']).sum(axis=1),
+		'atr': _PyIndicator.atr(bars['high'], bars['low'], bars['close'], atr_period)[:, -1],
+		'prev_close': bars['close'][:, -1],
+	}
+
+def make_daily_info(t_day_open_price, prev_day_close, atr_abs, multiplier):
+	# **V1.18.2 ߼㶯ֹ̬/˰ٷֱֵ**
+	dynamic_drop_pct_open = np.nan
+	dynamic_drop_pct_prev_close = np.nan #  T-1 ̼۵İٷֱ
+	if not np.isnan(atr_abs) and atr_abs > 0:
+		# ľԼ۸ = ATR_ABS * MULTIPLIER
+		drop_abs = atr_abs * multiplier
+		
+		# 1. ̬ٷֱȣڵտ̼ (Buy Filter)
+		if t_day_open_price > 0:
+			dynamic_drop_pct_open = - (drop_abs / t_day_open_price)
+			
+		# 2. ̬ٷֱȣ T-1 ̼ (Sell Stop) ޸߼
+		if prev_day_close > 0:
+			dynamic_drop_pct_prev_close = - (drop_abs / prev_day_close)
+
+	return {
+		't_day_open_price': t_day_open_price,                      
+		'prev_day_close': prev_day_close, # **޸ 1 T-1 ̼**
+		'dynamic_drop_pct': dynamic_drop_pct_open, # ã (׼̼)
+		'dynamic_drop_pct_prev_close': dynamic_drop_pct_prev_close # ֹ (׼T-1 ̼)
+	}
+
+def precompute_after_close(ContextInfo):
+	# ̺󣺼㲢̴ָ꣬ͬʱѵύָ
+	job = ContextInfo.get_precompute_job(ContextInfo.strategyName)
+	table, daily_data = job.run(ContextInfo)
+	if table is None:
+		log("̺Ԥ㣺δȡݡ")
+		return
+	engine = ContextInfo.get_indicator_engine('1d')
+	closed_dates = sorted(set(str(d) for df in daily_data.values() for d in df.index if str(d)[:8] <= table.as_of))
+	engine.sync(
+		closed_dates,
+		_PyFactor.market_data_to_array(daily_data, engine.codes, closed_dates, 'close'),
+		_PyFactor.market_data_to_array(daily_data, engine.codes, closed_dates, 'high'),
+		_PyFactor.market_data_to_array(daily_data, engine.codes, closed_dates, 'low')
+	)
+	ContextInfo.get_checkpoint(ContextInfo.strategyName).mark_dirty()
+	log(f"̺Ԥɣ{table.as_of} {len(table.codes)} ֻƱ")
+
+def on_stop_trigger(trigger, price):
+	# 鴥 T-1 ̼۵ֹ𣻲ڽʱʱ֮ٴμ
+	now = time.strftime('%H:%M')
+	if now < '09:32' or now > '14:59':
+		return
+	engine = C.get_trigger_engine()
+	volume = get_current_positions(C.account_id, C).get(trigger.code, 0)
+	if volume <= 0:
+		engine.remove(trigger)
+		return
+	if C.get_order_manager().open_orders(trigger.code, 'sell'):
+		return
+	engine.remove(trigger)
+	log(f"ֹ {trigger.code}ʼ۸ {price:.2f} ƶ̬ATRֹλ {trigger.level:.2f}")
+	execute_trade(False, trigger.code, volume, price, C, C.account_id)
+
+def arm_stop_triggers(ContextInfo, current_day):
+	# ʵָ̣ΪֲֵǼֹ𴥷ʱ飬صȵһK
+	g.TRIGGER_DATE = current_day
+	engine = ContextInfo.get_trigger_engine()
+	engine.clear(tag='stop')
+	holding_stocks = [stock for stock in get_current_positions(ContextInfo.account_id, ContextInfo) if stock in g.DAILY_DATA]
+	if not holding_stocks:
+		return
+	triggers = engine.percent_many(
+		holding_stocks,
+		[g.DAILY_DATA[stock]['prev_day_close'] for stock in holding_stocks],
+		[g.DAILY_DATA[stock]['dynamic_drop_pct_prev_close'] for stock in holding_stocks],
+		on_stop_trigger, tag='stop', once=False
+	)
+	ContextInfo.watch_quotes(holding_stocks)
+	log(f"ѵǼ {len(triggers)} ֲֹ𴥷")
 
 # --------------------------------------------------------
 # ֲֺͽס
 # --------------------------------------------------------
 
 def get_current_positions(accountid, ContextInfo):
-	# ... (ֲֻȡֲ)
-	holdinglist = {}
-
-	resultlist = get_trade_detail_data(accountid, 'STOCK', "POSITION")
-	for obj in resultlist:
-		if hasattr(obj, 'm_nCanUseVolume') and obj.m_nCanUseVolume > 0:
-			holdinglist[obj.m_strInstrumentID + "." + obj.m_strExchangeID] = obj.m_nCanUseVolume
-	return holdinglist
-
-def get_account_asset(account_id):
-	account = get_trade_detail_data(account_id, 'STOCK', 'ACCOUNT')
-	# log(account)
-	return account[0].m_dBalance
-
-
-def get_account_asset(account_id):
-	account = get_trade_detail_data(account_id, 'STOCK', 'ACCOUNT')
-	# log(account)
-	return account[0].m_dBalance
-
-def execute_trade(is_buy, stock_code, volume_abs, price, ContextInfo, account_id):
+	# óֲ {: }ɳֲֲάÿK߲ѯȫֲ
+	return ContextInfo.get_position_book(accountid, 'STOCK').holdings('can_use_volume')
+
+def get_account_asset(account_id, ContextInfo, field='balance'):
+	return ContextInfo.get_position_book(account_id, 'STOCK').asset(field)
+
+def make_order(is_buy, stock_code, volume_abs, price):
+	return {
+		'code': stock_code,
+		'volume': int(volume_abs),
+		'price': price,
+		'op_type': 23 if is_buy else 24,
+		'order_type': 1101,
+		'pr_type': 14,
+		'quick_trade': 1,
+	}
+
+def execute_basket(orders, ContextInfo, account_id):
 	"""
-	µӦ׳쳣
+	µuserOrderId Ψһҵ趨ύίлرӦ ticket ɡ
 	"""
-	opType = 23 if is_buy else 24      
-	orderType = 1101         
-	prType = 14              
-	quickTrade = 1
-	userOrderId = str(int(time.time() * 1000))
-	
-	volume_final = int(volume_abs)
-	action = "" if is_buy else ""
-	
-	if volume_final < 100 and is_buy: 
-		log(f": {stock_code}  100  ({volume_final})")
+	valid = []
+	for order in orders:
+		if order['volume'] < 100 and order['op_type'] == 23:
+			log(f": {order['code']}  100  ({order['volume']})")
+		else:
+			valid.append(order)
+
+	trader = ContextInfo.get_basket_trader(account_id, ContextInfo.strategyName)
+	tickets = trader.submit(valid, ContextInfo)
+	for ticket in tickets:
+		order = ticket.order
+		action = "" if order['op_type'] == 23 else ""
+		desc = f"{action} {order['code']} {order['volume']}  @ {order['price']:.2f} ({ticket.user_order_id})"
+		if not ticket.done():
+			log(f"ύ/Ŷ: {desc}")
+		ticket.future.add_done_callback(lambda future, desc=desc: report_ticket(future, desc))
+	return tickets
+
+def report_ticket(future, desc):
+	# ticket ίлر(order_callback)µ(orderError_callback)ʱɣزµɣûлر
+	error = future.exception()
+	if error is not None:
+		log(f"ʧ: {desc}. : {error}")
 		return
+	order_info = future.result()
+	if order_info is None:
+		log(f"ѱ: {desc}")
+	else:
+		log(f"ίȷ: {desc} ͬ {getattr(order_info, 'm_strOrderSysID', '')} ״̬ {getattr(order_info, 'm_nOrderStatus', '')}")
 
-	try:
-		passorder(
-			opType, 
-			orderType, 
-			account_id, 
-			stock_code, 
-			prType, 
-			price, 
-			volume_final, 
-			ContextInfo.strategyName, 
-			quickTrade, 
-			userOrderId, 
-			ContextInfo
-		)
-		log(f"׳ɹ: {action} {stock_code}: {volume_final}  @ {price:.2f}")
-		
-	except Exception as e:
-		log(f"ʧ: {action} {stock_code} {volume_final}  @ {price:.2f}. : {e}")
+def execute_trade(is_buy, stock_code, volume_abs, price, ContextInfo, account_id):
+	return execute_basket([make_order(is_buy, stock_code, volume_abs, price)], ContextInfo, account_id)
 
 # --------------------------------------------------------
 # 壺init  handlebar
@@ -151,7 +178,13 @@ def init(ContextInfo):
 	
 	# ---------------- 1. Բ ----------------
 	ContextInfo.account_id = '40098981' if ContextInfo.do_back_test else '8887911006'
+	# ֲ/ʽ𲾣ʵɽƻصάÿӶˣزÿζȡʱ
+	ContextInfo.get_position_book(ContextInfo.account_id, 'STOCK', reconcile_interval=0 if ContextInfo.do_back_test else 60)
+	if not ContextInfo.do_back_test:
+		ContextInfo.set_account(ContextInfo.account_id)
 	ContextInfo.strategyName = "ƱƸٷӼv1.26" 
+	# µÿ 20 
+	ContextInfo.get_basket_trader(ContextInfo.account_id, ContextInfo.strategyName, rate=20)
 	ContextInfo.hold_num = 10
 	
 	# MACD 
@@ -173,10 +206,33 @@ def init(ContextInfo):
 	stock_pool = ContextInfo.get_stock_list_in_sector('300') + ContextInfo.get_stock_list_in_sector('֤500')
 	# stock_pool = ContextInfo.get_stock_list_in_sector('֤1000')
 	ContextInfo.stock_pool = list(set(stock_pool))
+	#  MACD/ATR/MA ״̬ÿύߣаǰ O(1) 
+	ContextInfo.get_indicator_engine('1d', ContextInfo.stock_pool,
+		macd=(ContextInfo.MACD_SHORT, ContextInfo.MACD_LONG, ContextInfo.MACD_SIGNAL),
+		atr_period=ContextInfo.ATR_PERIOD)
 	
 	g.DAILY_DATA = {} 
 	g.DAILY_DATE = ''
 	g.HOLDING_BUY_DATE = {} 
+	g.TRIGGER_DATE = ''
+	
+	# ---------------- ״̬㣺ʵָֻͬһջָ ----------------
+	if not ContextInfo.do_back_test:
+		checkpoint = ContextInfo.get_checkpoint(ContextInfo.strategyName)
+		checkpoint.register('daily_data', lambda: g.DAILY_DATA, lambda v: setattr(g, 'DAILY_DATA', v), daily=True)
+		checkpoint.register('daily_date', lambda: g.DAILY_DATE, lambda v: setattr(g, 'DAILY_DATE', v), daily=True)
+		checkpoint.register('holding_buy_date', lambda: g.HOLDING_BUY_DATE, lambda v: setattr(g, 'HOLDING_BUY_DATE', v))
+		checkpoint.register_object('indicator_engine', ContextInfo.get_indicator_engine('1d'))
+		restored = checkpoint.restore(time.strftime('%Y%m%d'))
+		ContextInfo.get_indicator_engine('1d', ContextInfo.stock_pool)
+		if restored:
+			print(f"Ӽָ: {restored}")
+		
+		# ÿ 15:30 Ԥյ ATR / T-1 ֻ̼ۣȡļ͵տ̼
+		job = ContextInfo.get_precompute_job(ContextInfo.strategyName, sorted(ContextInfo.stock_pool),
+			fields=("close", "high", "low"), count=ContextInfo.look_back_days, dividend_type='none')
+		job.register('daily', lambda bars: daily_indicators(bars, ContextInfo.ATR_PERIOD))
+		job.schedule(ContextInfo, precompute_after_close, '153000')
 	
 	# ---------------- 2. Ԥ ̬ start_date ----------------
 	
@@ -205,6 +261,10 @@ def handlebar(ContextInfo):
 	current_time_log = timetag_to_datetime(bar_timetag, '%Y-%m-%d %H:%M')
 	current_time_full = timetag_to_datetime(bar_timetag, '%Y%m%d%H%M%S')
 	current_day = timetag_to_datetime(bar_timetag, '%Y%m%d')
+
+	# һK߽״̬б仯ʱд
+	if not ContextInfo.do_back_test:
+		ContextInfo.get_checkpoint(ContextInfo.strategyName).maybe_save(current_day)
 	
 	START_TIME_STR = '09:35'
 	OP_TIME_STR = '14:50' # **޸ 2βʱ**
@@ -216,64 +276,98 @@ def handlebar(ContextInfo):
 	if current_time_str >= START_TIME_STR and g.DAILY_DATE != current_day:
 		log(f"׶һÿݳʼʼ")
 		
-		all_codes = ContextInfo.stock_pool
-		daily_data = ContextInfo.get_market_data_ex(
-			fields=["close", "high", "low", "open", "preClose"], 
-			stock_code=all_codes, 
-			period="1d", 
-			end_time=current_day,
-			count=ContextInfo.look_back_days, 
-			dividend_type='none'
-		)
-		
-		g.DAILY_DATE = current_day
-		g.DAILY_DATA = {}
-		
-		for stock in ContextInfo.stock_pool:
-			df_daily = daily_data.get(stock)
-			
-			# ֻ㹻ʷڼ ATR
-			if df_daily is None:
-				log(f"ȡ {stock} ʧܡ")
-				continue
-			if len(df_daily) < ContextInfo.ATR_PERIOD + 1: 
-				log(f"{stock} ݲ㣬޷ ATR")
-				continue
-
-			df_daily['close'] = pd.to_numeric(df_daily['close'], errors='coerce')
-			
-			# MACD ָ/ʱ̬
+		# ʵһյ̺Ԥ (ָҲύ)ֻȡտ̼
+		table = None
+		if not ContextInfo.do_back_test:
+			table = ContextInfo.get_precompute_job(ContextInfo.strategyName).load_previous(ContextInfo, current_day)
+			engine_date = ContextInfo.get_indicator_engine('1d').date
+			if table is not None and (engine_date is None or engine_date[:8] < table.as_of):
+				table = None
+
+		if table is not None:
+			log(f"ʹ̺Ԥָ ( {table.as_of})")
+			open_data = ContextInfo.get_market_data_ex(
+				fields=["open"], 
+				stock_code=ContextInfo.stock_pool, 
+				period="1d", 
+				end_time=current_day,
+				count=1, 
+				dividend_type='none'
+			)
 			
-			# ---  ATR  --- **V1.18.2 **
-			# ATR ʷ
-			atr_abs = calculate_atr(df_daily, ContextInfo.ATR_PERIOD)
+			g.DAILY_DATE = current_day
+			g.DAILY_DATA = {}
+			ContextInfo.get_checkpoint(ContextInfo.strategyName).mark_dirty()
+
+			for stock in ContextInfo.stock_pool:
+				row = table.row(stock)
+				df_open = open_data.get(stock)
+				if row is None or df_open is None or df_open.empty:
+					log(f"ȡ {stock} ʧܡ")
+					continue
+				if row['bars'] < ContextInfo.ATR_PERIOD: 
+					log(f"{stock} ݲ㣬޷ ATR")
+					continue
+				t_day_open_price = df_open['open'].iloc[-1]
+				g.DAILY_DATA[stock] = make_daily_info(t_day_open_price, row['prev_close'], row['atr'], ContextInfo.ATR_MULTIPLIER)
+		else:
+			all_codes = ContextInfo.stock_pool
+			daily_data = ContextInfo.get_market_data_ex(
+				fields=["close", "high", "low", "open", "preClose"], 
+				stock_code=all_codes, 
+				period="1d", 
+				end_time=current_day,
+				count=ContextInfo.look_back_days, 
+				dividend_type='none'
+			)
 			
-			# T-1 յ̼
-			prev_day_close = df_daily['close'].iloc[-2] if len(df_daily) >= 2 else np.nan
-			t_day_open_price = df_daily['open'].iloc[-1]
+			g.DAILY_DATE = current_day
+			g.DAILY_DATA = {}
+			if not ContextInfo.do_back_test:
+				ContextInfo.get_checkpoint(ContextInfo.strategyName).mark_dirty()
+
+			# ָֻύ T-1 ǰ̵ߣΪȫؿ
+			engine = ContextInfo.get_indicator_engine('1d')
+			closed_dates = sorted(set(str(d) for df in daily_data.values() for d in df.index if str(d)[:8] < current_day))
+			engine.sync(
+				closed_dates,
+				_PyFactor.market_data_to_array(daily_data, engine.codes, closed_dates, 'close'),
+				_PyFactor.market_data_to_array(daily_data, engine.codes, closed_dates, 'high'),
+				_PyFactor.market_data_to_array(daily_data, engine.codes, closed_dates, 'low')
+			)
 			
-			# **V1.18.2 ߼㶯ֹ̬/˰ٷֱֵ**
-			dynamic_drop_pct_open = np.nan
-			dynamic_drop_pct_prev_close = np.nan #  T-1 ̼۵İٷֱ
-			if not np.isnan(atr_abs) and atr_abs > 0:
-				# ľԼ۸ = ATR_ABS * MULTIPLIER
-				drop_abs = atr_abs * ContextInfo.ATR_MULTIPLIER
+			# ATRƱһμ㣬ÿֻƱʹ
+			atr_all = _PyIndicator.atr(
+				_PyIndicator.market_data_matrix(daily_data, ContextInfo.stock_pool, 'high'),
+				_PyIndicator.market_data_matrix(daily_data, ContextInfo.stock_pool, 'low'),
+				_PyIndicator.market_data_matrix(daily_data, ContextInfo.stock_pool, 'close'),
+				ContextInfo.ATR_PERIOD
+			)[:, -1]
+
+			for k, stock in enumerate(ContextInfo.stock_pool):
+				df_daily = daily_data.get(stock)
 				
-				# 1. ̬ٷֱȣڵտ̼ (Buy Filter)
-				if t_day_open_price > 0:
-					dynamic_drop_pct_open = - (drop_abs / t_day_open_price)
-					
-				# 2. ̬ٷֱȣ T-1 ̼ (Sell Stop) ޸߼
-				if prev_day_close > 0:
-					dynamic_drop_pct_prev_close = - (drop_abs / prev_day_close)
+				# ֻ㹻ʷڼ ATR
+				if df_daily is None:
+					log(f"ȡ {stock} ʧܡ")
+					continue
+				if len(df_daily) < ContextInfo.ATR_PERIOD + 1: 
+					log(f"{stock} ݲ㣬޷ ATR")
+					continue
 
-			
-			g.DAILY_DATA[stock] = {
-				't_day_open_price': t_day_open_price,                      
-				'prev_day_close': prev_day_close, # **޸ 1 T-1 ̼**
-				'dynamic_drop_pct': dynamic_drop_pct_open, # ã (׼̼)
-				'dynamic_drop_pct_prev_close': dynamic_drop_pct_prev_close # ֹ (׼T-1 ̼)
-			}
+				df_daily['close'] = pd.to_numeric(df_daily['close'], errors='coerce')
+				
+				# MACD ָ/ʱ̬
+				
+				# ---  ATR  --- **V1.18.2 **
+				# ATR ʷ
+				atr_abs = atr_all[k]
+				
+				# T-1 յ̼
+				prev_day_close = df_daily['close'].iloc[-2] if len(df_daily) >= 2 else np.nan
+				t_day_open_price = df_daily['open'].iloc[-1]
+				
+				g.DAILY_DATA[stock] = make_daily_info(t_day_open_price, prev_day_close, atr_abs, ContextInfo.ATR_MULTIPLIER)
 
 		log(f"׶һÿݳʼɡ {len(g.DAILY_DATA)} ֻƱָꡣ")
 
@@ -286,6 +380,9 @@ def handlebar(ContextInfo):
 			dynamic_drop_pct_stop = daily_info.get('dynamic_drop_pct_prev_close', np.nan) # ʹµֵֹ
 			log(f"ֲ {stock}Tտ̼ {t_day_open_price:.2f}, ̬ATRֹ (׼:T-1̼) {dynamic_drop_pct_stop*100:.2f}%")
 
+	# ʵָ̣Ǽֹ (Ӽָʱͬ)K߼鱣Ϊ
+	if not ContextInfo.do_back_test and g.DAILY_DATE == current_day and g.TRIGGER_DATE != current_day:
+		arm_stop_triggers(ContextInfo, current_day)
 		
 	# --------------------------------------------------------
 	# ׶ζ飨14:50
@@ -296,11 +393,8 @@ def handlebar(ContextInfo):
 		log(f"׶ζ鿪ʼ")
 
 		curr_holdings_dict = get_current_positions(ContextInfo.account_id, ContextInfo)
-		total_asset = get_account_asset(ContextInfo.account_id)
-		account = get_trade_detail_data(ContextInfo.account_id, 'STOCK', 'ACCOUNT')
-		# log(account)
-		available_asset = account[0].m_dAvailable
-		total_asset = account[0].m_dBalance
+		available_asset = get_account_asset(ContextInfo.account_id, ContextInfo, 'available')
+		total_asset = get_account_asset(ContextInfo.account_id, ContextInfo, 'balance')
 		log(f"Ŀǰʽ: {available_asset:.2f} Ԫ, ˻ʲ: {total_asset:.2f} Ԫ")
 		# log(f"Ŀǰʲ: {total_asset:.2f} Ԫ")
 		# total_asset = 1000000
@@ -315,15 +409,14 @@ def handlebar(ContextInfo):
 			log("ȱָݣ޷ִ顣")
 			return
 
-		# A. ȡǰ 14:50 ļ۸ (close)  T-1 ̼
-		op_data = ContextInfo.get_market_data_ex(
-			fields=["close"], 
-			stock_code=stocks_to_check, 
-			period="1m", 
-			end_time=current_time_full,
-			count=1, 
-			dividend_type='none'
-		)
+		# A. ȡǰ 14:50 ļ۸ʵ̶ȡ黺棬زΪǰ̼
+		engine = ContextInfo.get_indicator_engine('1d')
+		stocks_to_check = [stock for stock in stocks_to_check if stock in engine.index]
+		check_index = {stock: k for k, stock in enumerate(stocks_to_check)}
+		op_prices = ContextInfo.get_last_prices(stocks_to_check)
+
+		# ȫѡһ԰ǰ MACD
+		macd_now = engine.what_if(op_prices, stocks_to_check)
 
 		qualified_candidates = []
 		
@@ -331,58 +424,26 @@ def handlebar(ContextInfo):
 			# log(stock)
 			daily_info = g.DAILY_DATA.get(stock)
 			# log(daily_info)
-			op_close_bar = op_data.get(stock)
-			# log(op_close_bar)
+			op_price = op_prices[check_index[stock]]
 			
-			if daily_info is None or op_close_bar is None or op_close_bar.empty or np.isnan(daily_info['prev_day_close']):
+			if daily_info is None or np.isnan(op_price) or np.isnan(daily_info['prev_day_close']):
 				log(f"[{current_time_log}] ׶ζȱָݣ޷ִ顣")
 				continue
 
-			op_price = op_close_bar['close'].iloc[-1]
 			# log(op_price)
 			t_day_open_price = daily_info.get('t_day_open_price', 0)
 			dynamic_drop_pct = daily_info.get('dynamic_drop_pct', np.nan) # **V1.18.2 ̬ ATR ֵ**
 
-			# ---  14:50 ȡ + ǰ ---
-			# Ϊȷ MACD ׼ȷԣҪȡʷ + շ
-			all_data = ContextInfo.get_market_data_ex(
-				fields=["close", "high", "low", "open", "preClose"], 
-				stock_code=[stock], 
-				period="1d", 
-				end_time=current_day,
-				count=ContextInfo.look_back_days - 1, # ȡ T-1 Ϊֹ
-				dividend_type='none'
-			)
-			df_daily = all_data.get(stock)
-			if df_daily is None or df_daily.empty: continue
-			
-			df_daily['close'] = pd.to_numeric(df_daily['close'], errors='coerce')
-
-			# ƴ T յĵǰ̼
-			close_series_full = pd.concat([df_daily['close'], pd.Series([op_price])])
-			# log(close_series_full)
-			
-			dif_series, dea_series, _ = calculate_macd(
-				close_series_full, 
-				ContextInfo.MACD_SHORT, 
-				ContextInfo.MACD_LONG, 
-				ContextInfo.MACD_SIGNAL
-			)
-			# log('dif_series')
-			# log(dif_series)
-			# log('dea_series')
-			# log( dea_series)
-			# log(dif_series.iloc[-1])
-			# exit()
-
-			if pd.isna(dif_series.iloc[-1]) or len(dif_series) < 3:
+			# --- MACDύ״̬ + T յǰӼ ---
+			k = check_index[stock]
+			if pd.isna(macd_now['dif'][k]) or macd_now['count'][k] < 3:
 				log(f"[{current_time_log}] ׶ζ޷ MACD ָ꣬ {stock}")
 				continue
 				
-			dif_t_minus_1 = dif_series.iloc[-2] # T-1  DIF
-			dea_t_minus_1 = dea_series.iloc[-2] # T-1  DEA
-			dif_t = dif_series.iloc[-1]          # T յǰӵ DIF
-			dea_t = dea_series.iloc[-1]          # T յǰӵ DEA
+			dif_t_minus_1 = macd_now['dif_prev'][k] # T-1  DIF
+			dea_t_minus_1 = macd_now['dea_prev'][k] # T-1  DEA
+			dif_t = macd_now['dif'][k]              # T յǰӵ DIF
+			dea_t = macd_now['dea'][k]              # T յǰӵ DEA
 			
 			# **޸ 1 ġT յǰӽж**
 			is_macd_golden_cross = (dif_t_minus_1 <= dea_t_minus_1) and (dif_t > dea_t)
@@ -423,6 +484,7 @@ def handlebar(ContextInfo):
 		
 		# C. ִ (ʽֱֲ)
 		target_per_stock = available_asset / (ContextInfo.hold_num - current_hold_count)
+		buy_orders = []
 		
 		for item in target_buys:
 			stock = item['code']
@@ -434,10 +496,13 @@ def handlebar(ContextInfo):
 				amount = int(target_per_stock / buy_price / 100) * 100
 				
 				if amount >= 100:
-					execute_trade(True, stock, amount, buy_price, ContextInfo, ContextInfo.account_id)
+					buy_orders.append(make_order(True, stock, amount, buy_price))
 					current_hold_count += 1
 					g.HOLDING_BUY_DATE[stock] = current_day 
 			
+		if buy_orders:
+			execute_basket(buy_orders, ContextInfo, ContextInfo.account_id)
+
 		if len(target_buys) > 0:
 			log(f"ɡĿ: {[item['code'] for item in target_buys]}")
 
@@ -454,23 +519,15 @@ def handlebar(ContextInfo):
 			return
 
 		holding_stocks = list(curr_holdings_dict.keys())
-		latest_data = ContextInfo.get_market_data_ex(
-			fields=["close"], 
-			stock_code=holding_stocks, 
-			period="1m", 
-			end_time=current_time_full,
-			count=1, 
-			dividend_type='none'
-		)
+		latest_prices = ContextInfo.get_last_prices(holding_stocks, as_dict=True)
 		
 		for stock, volume in curr_holdings_dict.items():
 			daily_info = g.DAILY_DATA.get(stock)
-			latest_bar = latest_data.get(stock)
+			current_price = latest_prices.get(stock, np.nan)
 			
-			if daily_info is None or latest_bar is None or latest_bar.empty or np.isnan(daily_info['prev_day_close']):
+			if daily_info is None or np.isnan(current_price) or np.isnan(daily_info['prev_day_close']):
 				continue
 
-			current_price = latest_bar['close'].iloc[-1]
 			
 			should_sell = False
 			sell_reason = ""
@@ -495,39 +552,17 @@ def handlebar(ContextInfo):
 			# 2. **޸ĺġMACD߼ (14:40) - ԭ**
 			if current_time_str == CHECK_MACD_SELL_TIME and not should_sell: 
 				
-				# --- ȡ + ǰ ---
-				all_data = ContextInfo.get_market_data_ex(
-					fields=["close"], 
-					stock_code=[stock], 
-					period="1d", 
-					end_time=current_day,
-					count=ContextInfo.look_back_days - 1, # ȡ T-1 Ϊֹ
-					dividend_type='none'
-				)
-				df_daily = all_data.get(stock)
-				if df_daily is None or df_daily.empty: continue
-				
-				df_daily['close'] = pd.to_numeric(df_daily['close'], errors='coerce')
+				# --- ύ״̬ + ǰӼ (14:40ļ۸) ---
+				macd_now = ContextInfo.get_indicator_engine('1d').what_if([current_price], [stock])
 
-				# ƴ T յĵǰ̼ (14:40ļ۸)
-				close_series_full = pd.concat([df_daily['close'], pd.Series([current_price])])
-				
-				#  MACD ָ ( DIF, DEA, MACD Hist)
-				dif_series, dea_series, hist_series = calculate_macd(
-					close_series_full, 
-					ContextInfo.MACD_SHORT, 
-					ContextInfo.MACD_LONG, 
-					ContextInfo.MACD_SIGNAL
-				)
-
-				if not pd.isna(dif_series.iloc[-1]) and len(hist_series) >= 3:
-					dif_t = dif_series.iloc[-1] 
-					dea_t = dea_series.iloc[-1] 
+				if not pd.isna(macd_now['dif'][0]) and macd_now['count'][0] >= 3:
+					dif_t = macd_now['dif'][0] 
+					dea_t = macd_now['dea'][0] 
 					
 					# ȡ״ͼֵ (CDMA)
-					hist_t = hist_series.iloc[-1]   # T (ǰ 14:40)
-					hist_t_1 = hist_series.iloc[-2] # T-1 ()
-					hist_t_2 = hist_series.iloc[-3] # T-2 (ǰ)
+					hist_t = macd_now['hist'][0]            # T (ǰ 14:40)
+					hist_t_1 = macd_now['hist_prev'][0]     # T-1 ()
+					hist_t_2 = macd_now['hist_prev2'][0]    # T-2 (ǰ)
 					
 					# ---  1ԭ߼ ---
 					is_dead_cross = dif_t < dea_t
@@ -546,10 +581,34 @@ def handlebar(ContextInfo):
 						log(f"ź {stock}{sell_reason}")
 
 			if should_sell and volume > 0:
+				# δɵʱظµ
+				if ContextInfo.get_order_manager().open_orders(stock, 'sell'):
+					continue
 				execute_trade(False, stock, volume, current_price, ContextInfo, ContextInfo.account_id)
 
 
+# --------------------------------------------------------
+# ƻص³ֲֲ
+# --------------------------------------------------------
+
+def deal_callback(ContextInfo, dealInfo):
+	ContextInfo.dispatch_trade_callback('deal', dealInfo)
+
+def order_callback(ContextInfo, orderInfo):
+	ContextInfo.dispatch_trade_callback('order', orderInfo)
+
+def orderError_callback(ContextInfo, orderArgs, errMsg):
+	ContextInfo.dispatch_trade_callback('order_error', orderArgs, errMsg)
 
+def position_callback(ContextInfo, positonInfo):
+	ContextInfo.dispatch_trade_callback('position', positonInfo)
 
+def account_callback(ContextInfo, accountInfo):
+	ContextInfo.dispatch_trade_callback('account', accountInfo)
 
 
+def stop(ContextInfo):
+	# ֹͣʱ㣬ѻ־д
+	if not ContextInfo.do_back_test:
+		ContextInfo.get_checkpoint(ContextInfo.strategyName).save(time.strftime('%Y%m%d'))
+	ContextInfo.close_loggers()